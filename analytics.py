@@ -0,0 +1,225 @@
+"""Аналитические запросы по истории сделок и сигналов.
+
+Именованные параметризованные запросы (QUERIES) выполняются колоночным
+движком DuckDB поверх базы бота (расширение sqlite, база подключается
+только на чтение). Если duckdb не установлен или не смог подключить базу,
+те же запросы выполняет sqlite, а строки транспонируются в колонки numpy.
+Результат - {колонка: np.ndarray} или таблица Arrow, без словаря на строку.
+
+Движок выбирается при старте бота (engine()): расширение sqlite для DuckDB
+загружается из локального каталога расширений, а скачивается (INSTALL)
+только если его там нет. Без сети и без установленного расширения
+аналитика работает на sqlite - это поддерживаемый режим, не ошибка.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict
+import numpy as np
+from db import DB
+from metrics import DB_SECONDS, timed
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ENGINE = os.getenv('ANALYTICS_ENGINE', 'auto')  # auto, duckdb, sqlite
+
+# Выражения, которые в диалектах пишутся по-разному
+DIALECTS = {
+    'duckdb': {'hour': 'hour(CAST({col} AS TIMESTAMP))', 'greatest': 'greatest'},
+    'sqlite': {'hour': "CAST(strftime('%H', {col}) AS INTEGER)", 'greatest': 'max'},
+}
+
+_OUTCOME_COLUMNS = """COUNT(*) AS signals,
+       AVG(CASE WHEN o.best_tp >= 1 THEN 100.0 ELSE 0.0 END) AS tp1_rate,
+       AVG(CASE WHEN o.best_tp >= 2 THEN 100.0 ELSE 0.0 END) AS tp2_rate,
+       AVG(CASE WHEN o.best_tp >= 3 THEN 100.0 ELSE 0.0 END) AS tp3_rate,
+       AVG(CASE WHEN o.status = 'STOP' AND o.best_tp = 0 THEN 100.0 ELSE 0.0 END) AS stop_rate,
+       AVG(o.mae_pct) AS avg_mae_pct,
+       AVG(o.mfe_pct) AS avg_mfe_pct,
+       AVG((o.tp1_ms - o.start_ms) / 60000.0) AS avg_minutes_to_tp1"""
+
+# Параметры: days - период, symbol - символ ('*' - все)
+QUERIES = {
+    'pnl_by_symbol': {
+        'description': 'PnL, сделки и доля прибыльных по символам',
+        'params': ('since',),
+        'sql': """SELECT symbol,
+       COUNT(*) AS trades,
+       SUM(CASE WHEN pnl > 0 THEN 1 ELSE 0 END) AS wins,
+       SUM(pnl) AS pnl,
+       AVG(pnl) AS avg_pnl,
+       SUM(CASE WHEN pnl > 0 THEN pnl ELSE 0 END) AS gross_profit,
+       SUM(CASE WHEN pnl < 0 THEN -pnl ELSE 0 END) AS gross_loss
+FROM trades
+WHERE ts >= $since
+GROUP BY symbol
+ORDER BY pnl DESC""",
+    },
+    'pnl_by_hour': {
+        'description': 'PnL и доля прибыльных сделок по часу дня (UTC)',
+        'params': ('since', 'symbol'),
+        'sql': """SELECT {hour:ts} AS hour,
+       COUNT(*) AS trades,
+       AVG(CASE WHEN pnl > 0 THEN 100.0 ELSE 0.0 END) AS win_rate,
+       SUM(pnl) AS pnl
+FROM trades
+WHERE ts >= $since AND ($symbol = '*' OR symbol = $symbol)
+GROUP BY 1
+ORDER BY 1""",
+    },
+    'equity_drawdown': {
+        'description': 'Кривая накопленного PnL и просадка от максимума по сделкам',
+        'params': ('since', 'symbol'),
+        'sql': """SELECT ts, symbol, pnl, equity,
+       {greatest}(MAX(equity) OVER (ORDER BY ts, id ROWS UNBOUNDED PRECEDING), 0) - equity AS drawdown
+FROM (SELECT id, ts, symbol, pnl,
+             SUM(pnl) OVER (ORDER BY ts, id ROWS UNBOUNDED PRECEDING) AS equity
+      FROM trades
+      WHERE ts >= $since AND ($symbol = '*' OR symbol = $symbol)) t
+ORDER BY ts, id""",
+    },
+    'outcomes_by_strategy': {
+        'description': 'Исходы завершенных сигналов по стратегии и направлению',
+        'params': ('since',),
+        'sql': f"""SELECT s.timeframe AS strategy, o.side,
+       {_OUTCOME_COLUMNS}
+FROM signal_outcomes o JOIN signals s ON s.id = o.signal_id
+WHERE o.ts >= $since AND o.status != 'OPEN'
+GROUP BY 1, 2
+ORDER BY 1, 2""",
+    },
+    'outcomes_by_symbol': {
+        'description': 'Исходы завершенных сигналов по символам',
+        'params': ('since',),
+        'sql': f"""SELECT o.symbol,
+       {_OUTCOME_COLUMNS}
+FROM signal_outcomes o
+WHERE o.ts >= $since AND o.status != 'OPEN'
+GROUP BY 1
+ORDER BY signals DESC, tp1_rate DESC""",
+    },
+    'outcomes_by_hour': {
+        'description': 'Исходы завершенных сигналов по часу публикации (UTC)',
+        'params': ('since', 'symbol'),
+        'sql': f"""SELECT {{hour:o.ts}} AS hour,
+       {_OUTCOME_COLUMNS}
+FROM signal_outcomes o
+WHERE o.ts >= $since AND o.status != 'OPEN' AND ($symbol = '*' OR o.symbol = $symbol)
+GROUP BY 1
+ORDER BY 1""",
+    },
+}
+
+_lock = threading.Lock()
+_duckdb = None
+_engine = None
+
+
+def _render(sql: str, dialect: str) -> str:
+    """Подставить диалектные выражения: {hour:колонка}, {greatest}"""
+    fragments = DIALECTS[dialect]
+    for col in ('ts', 'o.ts'):
+        sql = sql.replace(f'{{hour:{col}}}', fragments['hour'].format(col=col))
+    return sql.replace('{greatest}', fragments['greatest'])
+
+
+def _connect_duckdb():
+    import duckdb
+    con = duckdb.connect()
+    try:
+        con.execute("LOAD sqlite")
+    except duckdb.Error:
+        # Расширения еще нет в локальном каталоге - один раз скачиваем
+        con.execute("INSTALL sqlite")
+        con.execute("LOAD sqlite")
+    con.execute(f"ATTACH '{DB}' AS bot (TYPE SQLITE, READ_ONLY)")
+    con.execute("USE bot")
+    return con
+
+
+def engine() -> str:
+    """Выбрать движок при первом запросе: duckdb, если доступен, иначе sqlite"""
+    global _duckdb, _engine
+    with _lock:
+        if _engine is None:
+            _engine = 'sqlite'
+            if ANALYTICS_ENGINE in ('auto', 'duckdb'):
+                try:
+                    _duckdb = _connect_duckdb()
+                    _engine = 'duckdb'
+                except Exception as e:
+                    if ANALYTICS_ENGINE == 'duckdb':
+                        raise
+                    logger.info(f"DuckDB is not available ({e}), analytics run on sqlite")
+        return _engine
+
+
+def _params(name: str, days: float, symbol: str) -> Dict:
+    spec = QUERIES[name]
+    since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    values = {'since': since, 'symbol': symbol.upper() if symbol != '*' else symbol}
+    return {k: values[k] for k in spec['params']}
+
+
+def _column(values) -> np.ndarray:
+    """Колонка sqlite в numpy: NULL в числовой колонке - NaN"""
+    column = np.array(values)
+    if column.dtype == object:
+        try:
+            column = np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            pass
+    return column
+
+
+def _sqlite_columns(sql: str, params: Dict) -> Dict[str, np.ndarray]:
+    conn = sqlite3.connect(f'file:{DB}?mode=ro', uri=True)
+    try:
+        cursor = conn.execute(sql, params)
+        names = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return {name: np.empty(0) for name in names}
+    # zip(*rows) транспонирует строки в колонки на уровне C
+    return {name: _column(values) for name, values in zip(names, zip(*rows))}
+
+
+@timed(DB_SECONDS)
+def query(name: str, days: float = 7, symbol: str = '*') -> Dict[str, np.ndarray]:
+    """Выполнить именованный запрос, результат - {колонка: np.ndarray}"""
+    if name not in QUERIES:
+        raise KeyError(f"Unknown analytics query: {name}")
+    current = engine()
+    sql = _render(QUERIES[name]['sql'], current)
+    params = _params(name, days, symbol)
+    if current == 'duckdb':
+        return _duckdb.cursor().execute(sql, params).fetchnumpy()
+    return _sqlite_columns(sql, params)
+
+
+def query_arrow(name: str, days: float = 7, symbol: str = '*'):
+    """То же, что query, но таблица pyarrow"""
+    import pyarrow
+    if name not in QUERIES:
+        raise KeyError(f"Unknown analytics query: {name}")
+    if engine() == 'duckdb':
+        return _duckdb.cursor().execute(_render(QUERIES[name]['sql'], 'duckdb'), _params(name, days, symbol)).arrow()
+    return pyarrow.table(query(name, days, symbol))
+
+
+def to_json(columns: Dict[str, np.ndarray]) -> Dict[str, list]:
+    """Колоночный результат для JSON: NaN и маскированные значения - null"""
+    result = {}
+    for name, column in columns.items():
+        if np.ma.isMaskedArray(column):
+            column = column.astype(object).filled(None)
+        elif column.dtype.kind == 'f':
+            column = np.where(np.isnan(column), None, column)
+        elif column.dtype.kind == 'M':
+            column = np.datetime_as_string(column)
+        result[name] = column.tolist()
+    return result
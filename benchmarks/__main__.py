@@ -0,0 +1,60 @@
+"""Запуск бенчмарков:
+
+    python -m benchmarks run [--only scanner] [--output results.json]
+    python -m benchmarks compare results/abc123.json results/def456.json
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(args):
+    from benchmarks.fake_binance import FakeBinance
+    from benchmarks.runner import BenchmarkSession
+
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    with FakeBinance() as fake:
+        # Окружение до импорта модулей бота: они читают его при импорте
+        os.environ['BINANCE_REST'] = fake.url
+        os.environ['BOT_DB_PATH'] = os.path.join(workdir, 'data', 'bench.db')
+        os.chdir(workdir)
+
+        import logging
+        logging.disable(logging.CRITICAL)
+
+        from benchmarks.suites import SUITES
+        session = BenchmarkSession(only=args.only)
+        for suite in SUITES:
+            suite(session)
+
+    os.chdir(ROOT)
+    print(f"Results saved to {session.save(args.output)}")
+
+
+def main():
+    sys.path.insert(0, ROOT)
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run')
+    run_parser.add_argument('--only', help='запускать только бенчмарки, содержащие подстроку')
+    run_parser.add_argument('--output', help='путь к JSON с результатами')
+
+    compare_parser = sub.add_parser('compare')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.10)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        from benchmarks.runner import compare
+        sys.exit(0 if compare(args.base, args.new, args.threshold) else 1)
+
+
+if __name__ == '__main__':
+    main()
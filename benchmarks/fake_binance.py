@@ -0,0 +1,68 @@
+"""Локальный HTTP-сервер, отдающий фикстуры вместо fapi.binance.com"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks import fixtures
+
+# Число обработанных запросов (все экземпляры сервера) - для бенчмарков нагрузки на биржу
+_requests = 0
+_requests_lock = threading.Lock()
+
+
+def request_count() -> int:
+    return _requests
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    universe = 300
+
+    def do_GET(self):
+        global _requests
+        with _requests_lock:
+            _requests += 1
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == '/fapi/v1/klines':
+            body = fixtures.klines(query['symbol'], query.get('interval', '5m'), int(query.get('limit', 500)))
+        elif url.path == '/fapi/v1/ticker/24hr':
+            body = fixtures.tickers(self.universe)
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('X-MBX-USED-WEIGHT-1M', '1')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBinance:
+    """Фейковый Binance REST в фоновом потоке (контекстный менеджер)"""
+
+    def __init__(self, universe: int = 300):
+        handler = type('Handler', (_Handler,), {'universe': universe})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
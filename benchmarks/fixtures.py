@@ -0,0 +1,138 @@
+"""Детерминированные фикстуры Binance для бенчмарков.
+
+По умолчанию свечи и тикеры генерируются из фиксированного seed, поэтому
+прогоны на разных коммитах получают одинаковые данные. Реальные ответы
+можно записать один раз и дальше использовать их:
+
+    python -m benchmarks.fixtures record --symbols 30
+
+Записанный файл (fixtures/recorded.json.gz) имеет приоритет над генерацией.
+"""
+import argparse
+import functools
+import gzip
+import json
+import os
+import zlib
+import numpy as np
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+RECORDED_PATH = os.path.join(FIXTURES_DIR, 'recorded.json.gz')
+
+# Фиксированный "текущий" момент: 2025-01-01 00:00 UTC
+END_MS = 1_735_689_600_000
+MAX_BARS = 1500
+INTERVAL_MS = {'1m': 60_000, '5m': 300_000, '15m': 900_000, '1h': 3_600_000, '4h': 14_400_000,
+               '1d': 86_400_000}
+
+_recorded = None
+
+
+def symbols(n: int):
+    """Список синтетических символов, проходящих фильтры MarketScanner"""
+    return [f'X{i:03d}USDT' for i in range(n)]
+
+
+def _load_recorded():
+    global _recorded
+    if _recorded is None:
+        _recorded = {'tickers': None, 'klines': {}}
+        if os.path.exists(RECORDED_PATH):
+            with gzip.open(RECORDED_PATH, 'rt') as f:
+                _recorded = json.load(f)
+    return _recorded
+
+
+def _seed(*parts) -> int:
+    return zlib.crc32('|'.join(parts).encode())
+
+
+def klines(symbol: str, interval: str = '5m', limit: int = 500):
+    """Ответ /fapi/v1/klines: список 12-элементных строк, цены строками"""
+    recorded = _load_recorded()['klines'].get(f'{symbol}:{interval}')
+    if recorded:
+        return recorded[-limit:]
+    return _synthetic_klines(symbol, interval)[-limit:]
+
+
+@functools.lru_cache(maxsize=4096)
+def _synthetic_klines(symbol: str, interval: str):
+    step = INTERVAL_MS[interval]
+    rng = np.random.default_rng(_seed(symbol, interval))
+    closes = 100.0 * np.exp(np.cumsum(rng.normal(0.0002, 0.004, MAX_BARS)))
+    opens = np.concatenate(([closes[0]], closes[:-1]))
+    wick = np.abs(rng.normal(0, 0.002, (2, MAX_BARS))) * closes
+    highs = np.maximum(opens, closes) + wick[0]
+    lows = np.minimum(opens, closes) - wick[1]
+    volumes = rng.uniform(100, 1000, MAX_BARS)
+    start = END_MS - MAX_BARS * step
+
+    rows = []
+    for i in range(MAX_BARS):
+        open_time = start + i * step
+        quote = volumes[i] * closes[i]
+        rows.append([open_time, f'{opens[i]:.6f}', f'{highs[i]:.6f}', f'{lows[i]:.6f}', f'{closes[i]:.6f}',
+                     f'{volumes[i]:.3f}', open_time + step - 1, f'{quote:.4f}', 100 + i,
+                     f'{volumes[i] * 0.5:.3f}', f'{quote * 0.5:.4f}', '0'])
+    return rows
+
+
+def tickers(n: int = 300):
+    """Ответ /fapi/v1/ticker/24hr для n синтетических символов"""
+    recorded = _load_recorded()['tickers']
+    if recorded:
+        return recorded
+
+    rng = np.random.default_rng(_seed('ticker', str(n)))
+    result = []
+    for i, symbol in enumerate(symbols(n)):
+        last = float(klines(symbol, '5m', 1)[0][4])
+        change = rng.normal(0, 3)
+        high = last * (1 + abs(rng.normal(0, 0.03)))
+        low = last * (1 - abs(rng.normal(0, 0.03)))
+        volume = rng.uniform(1e5, 1e7)
+        result.append({
+            'symbol': symbol,
+            'priceChange': f'{last * change / 100:.6f}',
+            'priceChangePercent': f'{change:.3f}',
+            'weightedAvgPrice': f'{(high + low) / 2:.6f}',
+            'lastPrice': f'{last:.6f}',
+            'openPrice': f'{last / (1 + change / 100):.6f}',
+            'highPrice': f'{high:.6f}',
+            'lowPrice': f'{low:.6f}',
+            # Объем убывает с номером - топ по объему стабилен
+            'volume': f'{volume:.3f}',
+            'quoteVolume': f'{5e9 / (i + 1):.2f}',
+            'count': int(rng.uniform(1e4, 1e6)),
+        })
+    return result
+
+
+def record(n_symbols: int, intervals=('5m', '1h'), limit: int = 500):
+    """Записать реальные ответы Binance в fixtures/recorded.json.gz"""
+    import httpx
+
+    base = 'https://fapi.binance.com'
+    with httpx.Client(timeout=30) as client:
+        all_tickers = client.get(f'{base}/fapi/v1/ticker/24hr').json()
+        usdt = [t for t in all_tickers if t['symbol'].endswith('USDT')]
+        top = sorted(usdt, key=lambda t: float(t['quoteVolume']), reverse=True)[:n_symbols]
+        data = {'tickers': usdt, 'klines': {}}
+        for t in top:
+            for interval in intervals:
+                params = {'symbol': t['symbol'], 'interval': interval, 'limit': limit}
+                data['klines'][f"{t['symbol']}:{interval}"] = client.get(f'{base}/fapi/v1/klines',
+                                                                         params=params).json()
+
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    with gzip.open(RECORDED_PATH, 'wt') as f:
+        json.dump(data, f)
+    print(f"Recorded {len(top)} symbols to {RECORDED_PATH}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['record'])
+    parser.add_argument('--symbols', type=int, default=30)
+    args = parser.parse_args()
+    record(args.symbols)
@@ -0,0 +1,74 @@
+"""Бенчмарк времени импорта бота (python -X importtime).
+
+Запуск из корня репозитория:
+    python -m benchmarks.importtime [--module bot] [--budget-ms 1500] [--exclude aiogram]
+
+Бюджет (IMPORT_BUDGET_MS) проверяется по собственному времени импорта - без
+обязательного фреймворка (--exclude, по умолчанию aiogram: ~4 с на pydantic-моделях
+aiogram.types, которые бот убрать не может). Полное время печатается отдельно.
+Код возврата 1, если собственное время дольше бюджета.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Фиктивное окружение: bot.py без токена завершается при импорте
+DUMMY_ENV = {
+    'TELEGRAM_TOKEN': '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA',
+    'TELEGRAM_CHAT_ID': '1',
+    'DRY_RUN': 'true',
+}
+
+
+def measure(module: str):
+    """Импортировать модуль в чистом процессе, вернуть [(cumulative_us, name)]"""
+    env = {**os.environ, **{k: os.environ.get(k, v) for k, v in DUMMY_ENV.items()}}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        rows.append((int(cumulative), name.rstrip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='bot')
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('IMPORT_BUDGET_MS', '1500')))
+    parser.add_argument('--exclude', action='append', default=None,
+                        help="пакет-фреймворк, не входящий в бюджет (можно несколько раз)")
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    rows = measure(args.module)
+    exclude = args.exclude if args.exclude is not None else ['aiogram']
+    total_ms = next((c for c, name in rows if name.strip() == args.module), 0) / 1000
+    # Пакет импортируется один раз - его накопленное время учтено в одной строке
+    excluded_ms = sum(c for c, name in rows if name.strip() in exclude) / 1000
+    own_ms = total_ms - excluded_ms
+
+    # Самые тяжелые прямые импорты модуля (по накопленному времени)
+    top_level = [(c, name.strip()) for c, name in rows
+                 if name.startswith('   ') and not name.startswith('     ')]
+    print(f"import {args.module}: {total_ms:.0f} ms total, {excluded_ms:.0f} ms in {', '.join(exclude) or '-'}")
+    print(f"own import time: {own_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    for cumulative, name in sorted(top_level, reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    if own_ms > args.budget_ms:
+        print("FAIL: import time over budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Минимальный раннер бенчмарков в духе pytest-benchmark.
+
+Каждый бенчмарк выполняется warmup + rounds раз. Статистика сохраняется
+в JSON (benchmarks/results/<commit>.json), чтобы сравнивать коммиты.
+"""
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+class BenchmarkSession:
+    def __init__(self, only: str = None):
+        self.only = only
+        self.results = {}
+
+    def _selected(self, name: str) -> bool:
+        return self.only is None or self.only in name
+
+    def _record(self, name: str, timings, extra=None):
+        self.results[name] = {
+            'rounds': len(timings),
+            'min': min(timings),
+            'max': max(timings),
+            'mean': statistics.fmean(timings),
+            'median': statistics.median(timings),
+            'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            **(extra or {}),
+        }
+        r = self.results[name]
+        print(f"{name:50s} median {r['median'] * 1000:10.3f} ms  min {r['min'] * 1000:10.3f} ms  "
+              f"(n={r['rounds']})")
+
+    def bench(self, name: str, func, rounds: int = 20, warmup: int = 2, setup=None, extra=None):
+        """Замерить синхронную функцию; setup() вызывается перед каждым раундом"""
+        if not self._selected(name):
+            return
+        timings = []
+        for i in range(warmup + rounds):
+            arg = setup() if setup else None
+            start = time.perf_counter()
+            func(arg) if setup else func()
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                timings.append(elapsed)
+        self._record(name, timings, extra)
+
+    def abench(self, name: str, coro_func, rounds: int = 10, warmup: int = 1, setup=None, extra=None):
+        """Замерить корутину (каждый раунд в одном и том же event loop)"""
+        if not self._selected(name):
+            return
+
+        async def run():
+            timings = []
+            for i in range(warmup + rounds):
+                arg = setup() if setup else None
+                start = time.perf_counter()
+                await (coro_func(arg) if setup else coro_func())
+                elapsed = time.perf_counter() - start
+                if i >= warmup:
+                    timings.append(elapsed)
+            return timings
+
+        self._record(name, asyncio.run(run()), extra)
+
+    def save(self, path: str = None) -> str:
+        commit = _git_commit()
+        path = path or os.path.join(RESULTS_DIR, f'{commit}.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                'commit': commit,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'cpu_count': os.cpu_count()},
+                'benchmarks': self.results,
+            }, f, indent=2)
+        return path
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(base_path: str, new_path: str, threshold: float = 0.10) -> bool:
+    """Сравнить два файла результатов по медиане. False - есть регрессии"""
+    with open(base_path) as f:
+        base = json.load(f)['benchmarks']
+    with open(new_path) as f:
+        new = json.load(f)['benchmarks']
+
+    ok = True
+    for name in sorted(set(base) & set(new)):
+        old_median, new_median = base[name]['median'], new[name]['median']
+        change = (new_median - old_median) / old_median if old_median else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            ok = False
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"{name:50s} {old_median * 1000:10.3f} -> {new_median * 1000:10.3f} ms  {change:+7.1%}{flag}")
+    return ok
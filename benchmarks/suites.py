@@ -0,0 +1,404 @@
+"""Наборы бенчмарков горячих путей: данные, индикаторы, сигнал, скан, БД, WebSocket.
+
+Модули бота импортируются внутри функций: __main__ сначала поднимает
+фейковый Binance и выставляет BINANCE_REST / BOT_DB_PATH.
+"""
+import asyncio
+import pandas as pd
+
+from benchmarks import fixtures
+
+
+def _frame(symbol: str, interval: str, limit: int) -> pd.DataFrame:
+    """DataFrame в формате fetch_klines прямо из фикстуры (без HTTP)"""
+    return _legacy_frame(fixtures.klines(symbol, interval, limit))
+
+
+def _legacy_frame(raw) -> pd.DataFrame:
+    """Прежний разбор fetch_klines через 12-колоночный DataFrame (для сравнения)"""
+    df = pd.DataFrame(raw,
+                      columns=["open_time", "open", "high", "low", "close", "volume", "close_time", "q", "n",
+                               "taker_buy_base", "taker_buy_quote", "ignore"])
+    df = df[['open_time', 'open', 'high', 'low', 'close', 'volume']]
+    df['open_time'] = pd.to_datetime(df['open_time'], unit='ms', utc=True)
+    for col in ['open', 'high', 'low', 'close', 'volume']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def bench_data(session):
+    from data import decode_klines, fetch_klines
+
+    for limit in (1, 100, 500):
+        session.abench(f'data.fetch_klines[limit={limit}]',
+                       lambda limit=limit: fetch_klines('X000USDT', '5m', limit=limit), rounds=30)
+
+    # Разбор без HTTP: старый путь через DataFrame против decode_klines
+    for rows in (1, 100, 500):
+        raw = fixtures.klines('X000USDT', '5m', rows)
+        session.bench(f'data.decode[legacy_dataframe,rows={rows}]', lambda raw=raw: _legacy_frame(raw),
+                      rounds=200)
+        session.bench(f'data.decode[kline_batch,rows={rows}]', lambda raw=raw: decode_klines(raw), rounds=200)
+        session.bench(f'data.decode[kline_batch+to_frame,rows={rows}]',
+                      lambda raw=raw: decode_klines(raw).to_frame(), rounds=200)
+
+
+def bench_strategies(session):
+    from strategies import add_indicators, generate_signal_from_dfs
+
+    for bars in (100, 500):
+        df = _frame('X001USDT', '5m', bars)
+        session.bench(f'strategies.add_indicators[bars={bars}]', lambda df=df: add_indicators(df), rounds=50)
+
+    df_5m, df_1h = _frame('X002USDT', '5m', 100), _frame('X002USDT', '1h', 100)
+    session.bench('strategies.generate_signal_from_dfs[100/100]',
+                  lambda: generate_signal_from_dfs(df_5m, df_1h), rounds=50)
+    # Повторный скан того же символа: тренд 1h берется из кэша
+    session.bench('strategies.generate_signal_from_dfs[100/100,htf_cached]',
+                  lambda: generate_signal_from_dfs(df_5m, df_1h, symbol='X002USDT'), rounds=50)
+
+
+def bench_scanner(session):
+    from market_scanner import MarketScanner
+
+    for n in (25, 100, 300):
+        def setup(n=n):
+            # Новый сканер на каждый раунд - холодный кэш свечей; вселенная из n символов
+            return MarketScanner(universe_size=n)
+
+        session.abench(f'market_scanner.get_best_signals[symbols={n}]',
+                       lambda scanner: scanner.get_best_signals(max_signals=5),
+                       rounds=3 if n >= 300 else 5, setup=setup, extra={'symbols': n})
+
+
+def bench_cluster(session, symbols: int = 120):
+    """Скан в кластерном режиме: масштабирование по числу процессов-воркеров"""
+    import os
+    from scan_cluster import ScanCoordinator
+
+    universe = fixtures.symbols(symbols)
+    for workers in (1, 2, 4):
+        cluster = ScanCoordinator(workers=workers, address=f'unix:{os.getcwd()}/cluster-{workers}.sock')
+
+        async def scan(cluster=cluster):
+            # Воркеры запускаются в первом (прогревочном) раунде
+            if not cluster.size:
+                await cluster.start()
+            return await cluster.scan(universe)
+
+        session.abench(f'scan_cluster.scan[symbols={symbols},workers={workers}]', scan, rounds=3,
+                       extra={'workers': workers, 'cpu_count': os.cpu_count()})
+        cluster.close()
+
+
+def bench_db(session, writes: int = 500):
+    import db
+
+    db.init_db()
+
+    def write_trades():
+        for i in range(writes):
+            db.log_trade(f'X{i % 50:03d}USDT', 'BUY', 1.0, 100.0, (i % 7) - 3.0)
+
+    def write_signals():
+        for i in range(writes):
+            db.log_signal(f'X{i % 50:03d}USDT', 'multi', 'LONG', 100.0, 98.0, 102.0, 103.0, 104.0)
+
+    session.bench(f'db.log_trade[x{writes}]', write_trades, rounds=3, warmup=0, extra={'ops': writes})
+    session.bench(f'db.log_signal[x{writes}]', write_signals, rounds=3, warmup=0, extra={'ops': writes})
+    session.bench('db.get_trading_stats[7d]', lambda: db.get_trading_stats(7), rounds=50)
+    session.bench('db.get_signals[100]', lambda: db.get_signals(100), rounds=50)
+    session.bench('db.get_portfolio_summary', db.get_portfolio_summary, rounds=50)
+
+    import analytics
+    for name in ('pnl_by_symbol', 'equity_drawdown', 'outcomes_by_strategy'):
+        session.bench(f'analytics.{name}[{analytics.engine()}]', lambda name=name: analytics.query(name, 7), rounds=50)
+
+
+def bench_order_book(session, events: int = 2000):
+    """Применение диффов стакана и запросы ликвидности (источник - FakeDepthSource)"""
+    from order_book import FakeDepthSource, OrderBook
+
+    source = FakeDepthSource(levels=1000, seed=1)
+    # Как на бирже: lastUpdateId снимка совпадает с u одного из событий потока
+    diffs = [source.step('X000USDT')]
+    snapshot = asyncio.run(source.snapshot('X000USDT'))
+    diffs += [source.step('X000USDT') for _ in range(events - 1)]
+
+    def setup():
+        book = OrderBook('X000USDT')
+        book.load_snapshot(snapshot)
+        return book
+
+    def apply_all(book):
+        for event in diffs:
+            book.apply(event)
+
+    session.bench(f'order_book.apply[x{events}]', apply_all, rounds=10, setup=setup, extra={'ops': events})
+    book = setup()
+    apply_all(book)
+    session.bench('order_book.spread_bps', book.spread_bps, rounds=1000)
+    session.bench('order_book.estimate_slippage[10k USDT]', lambda: book.estimate_slippage('BUY', 10_000),
+                  rounds=1000)
+
+    # Запросы сразу после диффа: пересчет кумулятивных сумм + бинарный поиск
+    def update_and_query(book):
+        for event in diffs[:100]:
+            book.apply(event)
+            book.liquidity('BUY')
+
+    session.bench('order_book.apply+liquidity[x100]', update_and_query, rounds=10, setup=setup,
+                  extra={'ops': 100})
+
+
+def bench_trade_flow(session, trades: int = 50_000, symbols: int = 50):
+    """Прием aggTrade и расчет признаков потока сделок для топ-символов"""
+    import time
+    import numpy as np
+    from trade_flow import FakeTradeSource, TradeFlow
+
+    names = fixtures.symbols(symbols)
+    source = FakeTradeSource(seed=1)
+    start = int(time.time() * 1000) - 600_000
+    messages = [source.trade(names[i % symbols], start + i * 10) for i in range(trades)]
+    rows = np.arange(trades) % symbols
+    price = np.array([float(m['p']) for m in messages])
+    qty = np.array([float(m['q']) for m in messages])
+    maker = np.array([m['m'] for m in messages])
+    ts = np.array([m['T'] for m in messages], dtype=np.int64)
+
+    def setup():
+        flow = TradeFlow(capacity=symbols)
+        for name in names:
+            flow.row(name)
+        return flow
+
+    def ingest_messages(flow):
+        for message in messages:
+            flow.add_message(message)
+        flow.flush()
+
+    session.bench(f'trade_flow.add_message[x{trades}]', ingest_messages, rounds=5, setup=setup,
+                  extra={'ops': trades})
+    session.bench(f'trade_flow.add_batch[x{trades}]', lambda flow: (flow.add_batch(rows, price, qty, maker, ts),
+                                                                    flow.flush()),
+                  rounds=10, setup=setup, extra={'ops': trades})
+    flow = setup()
+    ingest_messages(flow)
+    session.bench('trade_flow.features', lambda: flow.features(names[0]), rounds=1000)
+
+
+def bench_correlation(session, window: int = 288):
+    """Обновление матрицы корреляций на свече и отбор сигналов при разном размере вселенной"""
+    import numpy as np
+    from correlation import RollingCorrelation, select_diversified
+
+    for n in (30, 100, 300):
+        names = fixtures.symbols(n)
+        rng = np.random.default_rng(n)
+        prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (window + 50, n)), axis=0))
+        matrix = RollingCorrelation(window=window, capacity=n + 100)
+        for k in range(window):
+            matrix.update(dict(zip(names, prices[k])), k * 300_000)
+
+        candle = iter(range(window, window + 50))
+
+        def update(matrix=matrix, names=names, prices=prices):
+            k = next(candle)
+            matrix.update(dict(zip(names, prices[k])), k * 300_000)
+
+        session.bench(f'correlation.update[symbols={n}]', update, rounds=40, warmup=5, extra={'symbols': n})
+        ranked = [(name, 1) for name in names[:20]]
+        session.bench(f'correlation.select_diversified[20 of {n}]',
+                      lambda matrix=matrix, ranked=ranked: select_diversified(
+                          ranked, matrix.matrix([name for name, _ in ranked]), 5),
+                      rounds=200)
+
+
+def bench_signal_outcomes(session, horizon: int = 576):
+    """Оценка исходов сигналов по свечам горизонта: один символ, разное число сигналов"""
+    import numpy as np
+    from data import INTERVAL_MS, decode_klines
+    from signal_outcomes import evaluate_outcome
+
+    interval_ms = INTERVAL_MS['5m']
+    batch = decode_klines(fixtures.klines('BTCUSDT', '5m', horizon * 2))
+    rng = np.random.default_rng(46)
+
+    for n in (10, 100, 1000):
+        def setup(n=n):
+            outcomes = []
+            for k in rng.integers(0, horizon, n):
+                side = 'LONG' if k % 2 else 'SHORT'
+                sign = 1 if side == 'LONG' else -1
+                entry = float(batch.close[k])
+                outcomes.append({
+                    'side': side, 'entry': entry, 'stop': entry * (1 - sign * 0.02),
+                    'tp1': entry * (1 + sign * 0.01), 'tp2': entry * (1 + sign * 0.02), 'tp3': entry * (1 + sign * 0.03),
+                    'start_ms': int(batch.open_time[k]), 'next_ms': int(batch.open_time[k]),
+                    'max_price': None, 'min_price': None, 'stop_ms': None, 'tp1_ms': None, 'tp2_ms': None,
+                    'tp3_ms': None, 'best_tp': 0, 'mae_pct': None, 'mfe_pct': None, 'status': 'OPEN'})
+            return outcomes
+
+        def evaluate(outcomes):
+            for outcome in outcomes:
+                evaluate_outcome(outcome, batch, interval_ms, horizon * interval_ms)
+
+        session.bench(f'signal_outcomes.evaluate[signals={n}]', evaluate, rounds=20, setup=setup,
+                      extra={'signals': n, 'candles': len(batch)})
+
+
+def bench_checkpoint(session, symbols: int = 30):
+    """Чекпоинт горячего состояния: снимок сканера, кодирование и восстановление"""
+    import numpy as np
+    import checkpoint
+    from data import decode_klines
+    from market_scanner import MarketScanner
+
+    scanner = MarketScanner(universe_size=300)
+    names = fixtures.symbols(300)
+    rng = np.random.default_rng(48)
+    for k in range(scanner.correlation.window):
+        scanner.correlation.update(dict(zip(names, 100 + rng.random(len(names)))), k * 300_000)
+    for name in names[:symbols]:
+        for interval in ('5m', '1h'):
+            scanner.cache._frames[(name, interval)] = decode_klines(fixtures.klines(name, interval, 500)).to_frame()
+    state = {'scanner': scanner.snapshot(), 'signals': []}
+    data = checkpoint.encode_checkpoint(state)
+
+    def restore(data=data):
+        _, restored = checkpoint.decode_checkpoint(data)
+        MarketScanner(universe_size=300).restore(restored['scanner'])
+
+    session.bench('checkpoint.snapshot', scanner.snapshot, rounds=20)
+    session.bench('checkpoint.encode', lambda: checkpoint.encode_checkpoint(state), rounds=10,
+                  extra={'bytes': len(data), 'series': 2 * symbols})
+    session.bench('checkpoint.restore', restore, rounds=10, extra={'bytes': len(data)})
+
+
+def bench_market_hub(session, symbols: int = 25):
+    """Несколько ботов через один хаб рыночных данных: время скана и запросы к бирже на бота"""
+    import os
+    from benchmarks import fake_binance
+    from market_hub import HubClient, MarketHub
+    from market_scanner import MarketScanner
+
+    for bots in (1, 3):
+        extra = {'symbols': symbols, 'bots': bots}
+
+        async def scan(bots=bots, extra=extra):
+            # Каждый раунд - холодный хаб: все боты вместе должны стоить бирже как один
+            hub = MarketHub(f'unix:{os.getcwd()}/market-hub.sock')
+            await hub.start()
+            scanners = [MarketScanner(universe_size=symbols) for _ in range(bots)]
+            for i, scanner in enumerate(scanners):
+                scanner.use_hub(HubClient(hub.address, name=f'bench-{i}'))
+            before = fake_binance.request_count()
+            try:
+                return await asyncio.gather(*(scanner.get_best_signals(max_signals=5) for scanner in scanners))
+            finally:
+                extra['exchange_requests'] = fake_binance.request_count() - before
+                extra['exchange_requests_per_bot'] = extra['exchange_requests'] / bots
+                await asyncio.gather(*(scanner.hub.close() for scanner in scanners))
+                hub.close()
+
+        session.abench(f'market_hub.get_best_signals[symbols={symbols},bots={bots}]', scan, rounds=3, extra=extra)
+
+
+def bench_chart_data(session, points: int = 800):
+    """Прореживание диапазона графика до бюджета точек: LTTB и min-max"""
+    import numpy as np
+    from chart_data import lttb, minmax
+    from data import decode_klines
+
+    base = decode_klines(fixtures.klines('BTCUSDT', '1m', 1500))
+    for bars in (1500, 20160, 60000):
+        # Две недели и больше 1m: повторяем фикстуру со сдвигом времени
+        reps = -(-bars // len(base))
+        open_time = (np.arange(reps * len(base), dtype=np.int64) * 60_000)[:bars]
+        close = np.tile(base.close, reps)[:bars]
+        batch = base[np.arange(bars) % len(base)]
+        batch.open_time[:] = open_time
+        session.bench(f'chart_data.lttb[bars={bars}]', lambda x=open_time.astype(np.float64), y=close: lttb(x, y, points),
+                      rounds=20, extra={'bars': bars, 'points': points})
+        session.bench(f'chart_data.minmax[bars={bars}]', lambda batch=batch: minmax(batch, points),
+                      rounds=50, extra={'bars': bars, 'points': points})
+
+
+class _FakeWebSocket:
+    async def send_text(self, message: str):
+        await asyncio.sleep(0)
+
+
+def bench_websocket(session):
+    from web_interface import ConnectionManager
+
+    for clients in (10, 100, 1000):
+        def setup(clients=clients):
+            manager = ConnectionManager()
+            manager.active_connections = [_FakeWebSocket() for _ in range(clients)]
+            return manager
+
+        session.abench(f'web_interface.broadcast[clients={clients}]',
+                       lambda manager: manager.broadcast('{"type": "new_signal", "data": {}}'),
+                       rounds=20, setup=setup, extra={'clients': clients})
+
+
+def bench_webhook(session, alerts: int = 1000, duplicate_every: int = 5, concurrency: int = 50):
+    """Нагрузочный тест /tradingview: поток алертов с повторами TradingView"""
+    import httpx
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+    from db import init_db
+    from webhook import WebhookPipeline, execute_alert
+
+    init_db()
+    # Каждый duplicate_every-й алерт - повтор предыдущего (тот же id)
+    ids = [i - 1 if i % duplicate_every == 0 else i for i in range(1, alerts + 1)]
+    unique = len(set(ids))
+
+    async def acknowledge_only(alert):
+        return None
+
+    def setup(executor):
+        pipeline = WebhookPipeline(executor=executor, secret='bench')
+        app = FastAPI()
+
+        @app.post('/tradingview')
+        async def tv_webhook(req: Request):
+            status, body = pipeline.accept(await req.body(), req.headers.get('X-Webhook-Secret'))
+            return JSONResponse(body, status_code=status)
+
+        return pipeline, app
+
+    async def run(args):
+        pipeline, app = args
+        pipeline.start()
+        semaphore = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            async def post(alert_id):
+                body = {'id': f'alert-{alert_id}', 'secret': 'bench', 'symbol': f'X{alert_id % 50:03d}USDT',
+                        'action': ('LONG', 'SHORT', 'CLOSE')[alert_id % 3], 'amount': 0.01}
+                async with semaphore:
+                    r = await client.post('/tradingview', json=body)
+                    r.raise_for_status()
+
+            await asyncio.gather(*(post(alert_id) for alert_id in ids))
+        await pipeline.drain()
+        await pipeline.stop()
+        if pipeline.executed + pipeline.failed != unique:
+            raise AssertionError(f"webhook executed {pipeline.executed + pipeline.failed} alerts, expected {unique}")
+
+    extra = {'alerts': alerts, 'unique': unique}
+    # Прием (проверка, дедупликация, очередь) без исполнения ордеров
+    session.abench(f'webhook.accept[alerts={alerts}]', run, rounds=5, setup=lambda: setup(acknowledge_only),
+                   extra=extra)
+    # Целиком: DRY_RUN-ордера, цена с фейкового Binance и запись в БД
+    session.abench(f'webhook.execute[alerts={alerts},unique={unique}]', run, rounds=3, warmup=0,
+                   setup=lambda: setup(execute_alert), extra=extra)
+
+
+SUITES = [bench_data, bench_strategies, bench_scanner, bench_cluster, bench_db, bench_order_book, bench_trade_flow,
+          bench_correlation, bench_signal_outcomes, bench_checkpoint, bench_chart_data,
+          bench_market_hub, bench_websocket, bench_webhook]
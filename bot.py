@@ -3,33 +3,45 @@ from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from data import fetch_klines
-from strategies import generate_signal_from_dfs
 from exchange import place_market_order, close_position_order  # Добавляем close_position_order
-from db import init_db, log_trade, log_signal, open_position, close_position, get_open_positions, get_portfolio_summary  # Добавляем новые функции
-from reports import generate_weekly_report
-from market_scanner import scanner
+from db import init_db, log_trade, log_signal, open_position, close_position, get_open_positions, get_portfolio_summary, add_subscriber, remove_subscriber  # Добавляем новые функции
+from reports import generate_weekly_report_async
+from market_scanner import get_scanner
 from portfolio_manager import update_portfolio_prices  # Этот импорт теперь должен работать
-from fastapi import FastAPI, Request
-import uvicorn
+from market_clock import schedule_on_candle_close, install_listeners, get_job_stats
+from fastapi import Request
+from fastapi.responses import JSONResponse
 import threading
-import httpx
 from dotenv import load_dotenv
-from web_interface import web_app, notify_websocket_clients
+from web_interface import web_app, notify_websocket_clients, register_scan_handler
+from metrics import telegram_request_middleware, monitor_event_loop_lag
+from notifier import Notifier
+from signal_tracker import SignalTracker, NEW, UPDATED, EXPIRED
+from webhook import WebhookPipeline
+from scan_cluster import SCAN_WORKERS
+from logging_setup import setup_logging
+from profiling import register_loop
+from tracing import OTLP_ENDPOINT, Trace, tracer
+# Опциональные подсистемы: здесь только флаги, сами объекты импортируются в main() при включении
+from order_book import MAX_SLIPPAGE_BPS, ORDER_BOOKS_ENABLED
+from trade_flow import TRADE_FLOW_ENABLED
+from signal_outcomes import OUTCOME_INTERVAL
+from market_hub import MARKET_HUB_ADDRESS
+from checkpoint import CHECKPOINT_INTERVAL, CHECKPOINT_PATH
 
 load_dotenv()
 app = web_app
 web_app_url = "https://olkosarau.github.io/crypto_futures_bot/"
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Форматирование и вывод логов - в отдельном потоке, не в event loop
+setup_logging()
 logger = logging.getLogger(__name__)
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
-SIGNAL_INTERVAL = int(os.getenv('SIGNAL_CHECK_INTERVAL_SEC', '300'))
+# Проверка сигналов - по закрытию свечи SIGNAL_TIMEFRAME (+ задержка, чтобы биржа успела закрыть бар)
+SIGNAL_TIMEFRAME = os.getenv('SIGNAL_TIMEFRAME', '5m')
+CANDLE_CLOSE_DELAY_MS = int(os.getenv('CANDLE_CLOSE_DELAY_MS', '300'))
 SUBSCRIBE_SYMBOLS = os.getenv('SUBSCRIBE_SYMBOLS', 'BTCUSDT,ETHUSDT').split(',')
 
 if not TELEGRAM_TOKEN:
@@ -43,8 +55,18 @@ if not CHAT_ID:
 logger.info(f"Bot initialized for chat: {CHAT_ID}")
 
 bot = Bot(token=TELEGRAM_TOKEN)
+bot.session.middleware(telegram_request_middleware)
 dp = Dispatcher()
+# Исходящие сообщения (сигналы, рассылки) идут через очередь с лимитами Telegram
+notifier = Notifier(bot, CHAT_ID)
+# Состояния сигналов между сканированиями (повторно найденные не рассылаются)
+signal_tracker = SignalTracker()
+SIGNAL_EVENTS = {NEW: "new_signal", UPDATED: "signal_updated", EXPIRED: "signal_expired"}
 scheduler = AsyncIOScheduler()
+install_listeners(scheduler)
+
+# Не запускаем новое сканирование, пока идет предыдущее (ручное или плановое)
+scan_lock = asyncio.Lock()
 
 
 keyboard = ReplyKeyboardMarkup(
@@ -101,6 +123,8 @@ async def cmd_start(message: types.Message):
         "• /signals - проверить сигналы\n"
         "• /scan - полное сканирование рынка\n"
         "• /report - недельный отчет\n"
+        "• /subscribe - подписаться на сигналы\n"
+        "• /unsubscribe - отписаться от сигналов\n"
         "• /long SYMBOL QTY - открыть лонг\n"
         "• /short SYMBOL QTY - открыть шорт\n"
         "• /close SYMBOL - закрыть позицию",
@@ -133,7 +157,9 @@ async def cmd_help(message: types.Message):
 
         "<b>⚙️ Управление:</b>\n"
         "• <code>/signals_on</code> - включить автоматические сигналы\n"
-        "• <code>/signals_off</code> - выключить автоматические сигналы\n\n"
+        "• <code>/signals_off</code> - выключить автоматические сигналы\n"
+        "• <code>/subscribe</code> - получать сигналы в этот чат\n"
+        "• <code>/unsubscribe</code> - отписаться от сигналов\n\n"
 
         "<i>Примеры команд смотрите в разделе 'Торговля'</i>",
         parse_mode='HTML'
@@ -145,7 +171,7 @@ async def cmd_status(message: types.Message):
     status_text = (
         "📊 <b>Статус бота:</b>\n\n"
         f"• <b>Мониторинг:</b> {', '.join(SUBSCRIBE_SYMBOLS)}\n"
-        f"• <b>Интервал проверки:</b> {SIGNAL_INTERVAL} сек\n"
+        f"• <b>Интервал проверки:</b> закрытие свечи {SIGNAL_TIMEFRAME}\n"
         f"• <b>Авто-сигналы:</b> {'✅ ВКЛ' if scheduler.running else '❌ ВЫКЛ'}\n"
         f"• <b>Режим:</b> {'🟢 РЕАЛЬНЫЙ' if not os.getenv('DRY_RUN', 'true').lower() == 'true' else '🟡 ТЕСТОВЫЙ'}\n"
         f"• <b>База данных:</b> {'✅ Активна' if os.path.exists('data/bot.db') else '❌ Неактивна'}\n\n"
@@ -175,7 +201,7 @@ async def cmd_weekly(message: types.Message):
         # Показываем что бот работает
         await bot.send_chat_action(message.chat.id, "typing")
 
-        path = generate_weekly_report()
+        path = await generate_weekly_report_async()
 
         if path and os.path.exists(path):
             file_size = os.path.getsize(path) / 1024  # Размер в KB
@@ -218,6 +244,22 @@ async def cmd_signals_off(message: types.Message):
     await message.answer("❌ Автоматические сигналы выключены")
 
 
+@dp.message(Command('subscribe'))
+async def cmd_subscribe(message: types.Message):
+    if add_subscriber(message.chat.id):
+        await message.answer("✅ Вы подписаны на торговые сигналы")
+    else:
+        await message.answer("ℹ️ Вы уже подписаны на торговые сигналы")
+
+
+@dp.message(Command('unsubscribe'))
+async def cmd_unsubscribe(message: types.Message):
+    if remove_subscriber(message.chat.id):
+        await message.answer("❌ Вы отписались от торговых сигналов")
+    else:
+        await message.answer("ℹ️ Вы не были подписаны на сигналы")
+
+
 @dp.message(Command('long', 'short'))
 async def manual_trade(message: types.Message):
     try:
@@ -266,10 +308,9 @@ async def manual_trade(message: types.Message):
         await bot.send_chat_action(message.chat.id, "typing")
 
         # Получаем текущую цену для записи в позицию
-        from data import fetch_klines
+        from data import fetch_last_price
         try:
-            df = await fetch_klines(symbol, '1m', limit=1)
-            current_price = float(df.iloc[-1]['close']) if not df.empty else 0
+            current_price = await fetch_last_price(symbol)
         except:
             current_price = 0
 
@@ -428,7 +469,7 @@ async def button_settings(message: types.Message):
     settings_text = (
         "⚙️ <b>Настройки бота:</b>\n\n"
         f"• <b>Символы:</b> {', '.join(SUBSCRIBE_SYMBOLS)}\n"
-        f"• <b>Интервал:</b> {SIGNAL_INTERVAL} сек\n"
+        f"• <b>Интервал:</b> закрытие свечи {SIGNAL_TIMEFRAME}\n"
         f"• <b>Режим:</b> {'РЕАЛЬНЫЙ' if not os.getenv('DRY_RUN', 'true').lower() == 'true' else 'ТЕСТОВЫЙ'}\n\n"
         "Для изменения настроек отредактируйте файл .env"
     )
@@ -555,64 +596,108 @@ async def unknown_message(message: types.Message):
 
 async def check_signals(notify_user=None):
     """Проверка торговых сигналов по всем монетам"""
-    logger.info("🔍 Scanning market for signals...")
-
-    try:
-        # Получаем лучшие сигналы
-        best_signals = await scanner.get_best_signals(max_signals=5)
+    if scan_lock.locked():
+        logger.info("Market scan already in progress, skipping")
+        if notify_user:
+            await bot.send_message(notify_user, "⏳ Сканирование уже выполняется, дождитесь результатов.")
+        return
 
-        if not best_signals:
-            logger.info("No strong signals found in market scan")
-            if notify_user:
-                await bot.send_message(notify_user, "📊 Сканирование завершено. Сильных сигналов не найдено.")
-            return
+    async with scan_lock:
+        await _check_signals(notify_user)
 
-        # Отправляем топ сигналы
-        for i, signal_data in enumerate(best_signals, 1):
-            symbol = signal_data['symbol']
-            signal = signal_data['signal']
-            strength = signal_data['strength']
 
-            if signal.side != 'NONE':
-                # Логируем сигнал
-                log_signal(symbol, 'multi', signal.side, signal.entry, signal.stop,
-                           signal.tp1, signal.tp2, signal.tp3)
+async def _check_signals(notify_user=None):
+    logger.info("🔍 Scanning market for signals...")
 
-                # Уведомляем веб-интерфейс
-                await notify_websocket_clients("new_signal", {
+    try:
+        # Получаем лучшие сигналы
+        best_signals = await get_scanner().get_best_signals(max_signals=5)
+
+        # Сохраняем и рассылаем только смену состояния сигнала, а не каждое повторное обнаружение
+        transitions = signal_tracker.update(best_signals)
+
+        # Сигналы одного скана уходят одним дайджестом
+        parts = []
+        traces = []
+        for transition in transitions:
+            tracked = transition.tracked
+            symbol = tracked.symbol
+            signal = tracked.signal
+
+            # Трасса задержки есть у найденного в этом скане сигнала (NEW/UPDATED)
+            trace = transition.data.get('trace') if transition.data else None
+            if trace is None:
+                trace = Trace(f"signal {symbol}", symbol=symbol, side=signal.side)
+            trace.attributes['state'] = transition.state
+
+            # Логируем сигнал
+            with trace.stage('log_signal'):
+                log_signal(symbol, tracked.strategy, signal.side, signal.entry, signal.stop,
+                           signal.tp1, signal.tp2, signal.tp3, state=transition.state)
+
+            # Уведомляем веб-интерфейс
+            with trace.stage('notify_websocket'):
+                await notify_websocket_clients(SIGNAL_EVENTS[transition.state], {
                     "symbol": symbol,
                     "side": signal.side,
                     "entry": signal.entry,
                     "confidence": signal.confidence,
-                    "reason": signal.reason
+                    "reason": signal.reason,
+                    "state": transition.state,
+                    "trace_id": trace.trace_id
                 })
 
-                # Формируем сообщение
-                emoji = "🟢" if signal.side == 'LONG' else "🔴"
-                strength_emoji = "🔥" * min(strength, 3)
-
-                text = (
-                    f"{strength_emoji} <b>СИГНАЛ #{i}</b> {strength_emoji}\n\n"
-                    f"• <b>Монета:</b> {symbol}\n"
-                    f"• <b>Направление:</b> {emoji} {signal.side}\n"
-                    f"• <b>Уверенность:</b> {signal.confidence:.1%}\n"
-                    f"• <b>Текущая цена:</b> {signal.entry:.4f}\n\n"
-                    f"<b>🎯 Тейк-профиты:</b>\n"
-                    f"TP1: {signal.tp1:.4f}\n"
-                    f"TP2: {signal.tp2:.4f}\n"
-                    f"TP3: {signal.tp3:.4f}\n\n"
-                    f"<b>🛑 Стоп-лосс:</b> {signal.stop:.4f}\n\n"
-                    f"<i>{signal.reason}</i>"
+            if transition.state == EXPIRED:
+                parts.append(f"⌛ <b>{symbol} {signal.side}</b> - сигнал больше не актуален")
+                continue
+
+            # Формируем сообщение
+            emoji = "🟢" if signal.side == 'LONG' else "🔴"
+            strength_emoji = "🔥" * min(transition.data['strength'], 3)
+            title = "СИГНАЛ" if transition.state == NEW else "ОБНОВЛЕНИЕ СИГНАЛА"
+
+            text = (
+                f"{strength_emoji} <b>{title}</b> {strength_emoji}\n\n"
+                f"• <b>Монета:</b> {symbol}\n"
+                f"• <b>Направление:</b> {emoji} {signal.side}\n"
+                f"• <b>Уверенность:</b> {signal.confidence:.1%}\n"
+                f"• <b>Текущая цена:</b> {signal.entry:.4f}\n\n"
+                f"<b>🎯 Тейк-профиты:</b>\n"
+                f"TP1: {signal.tp1:.4f}\n"
+                f"TP2: {signal.tp2:.4f}\n"
+                f"TP3: {signal.tp3:.4f}\n\n"
+                f"<b>🛑 Стоп-лосс:</b> {signal.stop:.4f}\n\n"
+                f"<i>{signal.reason}</i>"
+            )
+            liquidity = transition.data.get('liquidity')
+            if liquidity:
+                # Размер ордера, который стакан примет без сильного проскальзывания
+                text += (
+                    f"\n\n<b>📚 Стакан:</b> спред {liquidity['spread_bps']:.1f} bps, "
+                    f"глубина ±{liquidity['depth_bps']:g} bps: {liquidity['depth_usdt']:,.0f} USDT\n"
+                    f"Проскальзывание на {liquidity['notional']:,.0f} USDT: {liquidity['slippage_bps']:.1f} bps\n"
+                    f"Макс. ордер до {MAX_SLIPPAGE_BPS:g} bps: {liquidity['max_qty']:.4g} "
+                    f"(~{liquidity['max_notional']:,.0f} USDT)"
                 )
 
-                # Отправляем владельцу бота
-                await bot.send_message(CHAT_ID, text, parse_mode='HTML')
-                logger.info(f"Strong signal found: {symbol} {signal.side} (confidence: {signal.confidence:.1%})")
+            parts.append(text)
+            traces.append(trace)
+            logger.info(f"Strong signal {transition.state.lower()}: {symbol} {signal.side} "
+                        f"(confidence: {signal.confidence:.1%})")
+
+        # Отправка в фоне: скан не ждет Telegram, владелец и подписчики получают дайджест
+        if parts:
+            notifier.broadcast_digest(parts, traces=traces, parse_mode='HTML')
 
+        if not best_signals:
+            logger.info("No strong signals found in market scan")
+            if notify_user:
+                notifier.send(notify_user, "📊 Сканирование завершено. Сильных сигналов не найдено.")
         # Если это ручная проверка, отправляем summary
-        if notify_user and len(best_signals) > 0:
-            summary = f"📊 Найдено сигналов: {len(best_signals)}"
-            await bot.send_message(notify_user, summary)
+        elif notify_user:
+            changed = sum(t.state != EXPIRED for t in transitions)
+            summary = f"📊 Найдено сигналов: {len(best_signals)} (новых или обновленных: {changed})"
+            notifier.send(notify_user, summary)
 
     except Exception as e:
         logger.error(f"Market scan error: {e}")
@@ -645,8 +730,6 @@ def get_signals(limit=100):
     return signals
 
 
-# Исправляем планировщик - используем асинхронную функцию
-@scheduler.scheduled_job('interval', seconds=SIGNAL_INTERVAL)
 async def scheduled_check():
     """Планируемая проверка сигналов"""
     try:
@@ -654,8 +737,7 @@ async def scheduled_check():
     except Exception as e:
         logger.error(f"Scheduled check error: {e}")
 
-# ДОБАВЛЯЕМ НОВЫЙ ПЛАНИРОВЩИК ДЛЯ ОБНОВЛЕНИЯ ЦЕН
-@scheduler.scheduled_job('interval', seconds=60)  # Обновлять каждую минуту
+
 async def update_prices_job():
     """Планируемое обновление цен в портфеле"""
     try:
@@ -663,61 +745,62 @@ async def update_prices_job():
     except Exception as e:
         logger.error(f"Price update job error: {e}")
 
-# FastAPI webhook для TradingView
-@app.post('/tradingview')
-async def tv_webhook(req: Request):
+
+async def signal_outcomes_job():
+    """Проверка исходов опубликованных сигналов по новым свечам"""
+    from signal_outcomes import update_signal_outcomes
     try:
-        payload = await req.json()
-        symbol = payload.get('symbol')
-        action = payload.get('action')
-        amount = float(payload.get('amount', 0))
-
-        if action in ('LONG', 'SHORT'):
-            side = 'BUY' if action == 'LONG' else 'SELL'
-            res = await place_market_order(symbol, side, amount)
-            if res.success:
-                log_trade(symbol, side, amount, 0.0)
-                await bot.send_message(CHAT_ID, f'TradingView webhook executed: {action} {symbol} {amount}')
-                return {'ok': True, 'info': res.info}
-            return {'ok': False, 'error': res.info}
-        elif action == 'CLOSE':
-            await bot.send_message(CHAT_ID, f'TradingView webhook close requested: {symbol}')
-            return {'ok': True, 'info': 'close_requested'}
-        return {'ok': False, 'error': 'invalid action'}
+        await update_signal_outcomes()
     except Exception as e:
-        logger.error(f"Webhook error: {e}")
-        return {'ok': False, 'error': str(e)}
-
+        logger.error(f"Signal outcomes job error: {e}")
 
-@app.get('/')
-async def root():
-    return {'status': 'Bot is running'}
 
-# Добавьте эту задачу в планировщик (после существующей scheduled_check)
-@scheduler.scheduled_job('interval', seconds=60)  # Обновлять каждую минуту
-async def update_prices_job():
-    """Планируемое обновление цен в портфеле"""
+async def checkpoint_job():
+    """Периодический чекпоинт горячего состояния сканера"""
+    from checkpoint import save_hot_state
     try:
-        await update_portfolio_prices()
+        await save_hot_state(get_scanner(), signal_tracker)
     except Exception as e:
-        logger.error(f"Price update job error: {e}")
+        logger.error(f"Checkpoint job error: {e}")
 
-# API endpoints для веб-интерфейса
-@app.post("/api/scan")
-async def api_scan():
-    """API для запуска сканирования рынка"""
+
+async def export_traces_job():
+    """Выгрузка трасс задержки сигналов в OTLP-коллектор"""
     try:
-        await check_signals()
-        return {"status": "scan_started"}
+        await tracer.flush()
     except Exception as e:
-        logger.error(f"API scan error: {e}")
-        return {"status": "error", "error": str(e)}
+        logger.error(f"Trace export job error: {e}")
+
+
+# Запуски выровнены по закрытию свечей: сигналы - по SIGNAL_TIMEFRAME, цены - каждую минуту
+schedule_on_candle_close(scheduler, scheduled_check, SIGNAL_TIMEFRAME, CANDLE_CLOSE_DELAY_MS)
+schedule_on_candle_close(scheduler, update_prices_job, '1m', CANDLE_CLOSE_DELAY_MS)
+schedule_on_candle_close(scheduler, signal_outcomes_job, OUTCOME_INTERVAL, CANDLE_CLOSE_DELAY_MS)
+if CHECKPOINT_PATH:
+    schedule_on_candle_close(scheduler, checkpoint_job, CHECKPOINT_INTERVAL, CANDLE_CLOSE_DELAY_MS)
+if OTLP_ENDPOINT:
+    schedule_on_candle_close(scheduler, export_traces_job, '1m', CANDLE_CLOSE_DELAY_MS)
+
+# FastAPI webhook для TradingView: ответ сразу, ордер исполняется воркером в фоне
+webhook_pipeline = WebhookPipeline(notify=lambda text: notifier.send(CHAT_ID, text))
+
 
+@app.post('/tradingview')
+async def tv_webhook(req: Request):
+    status, body = webhook_pipeline.accept(await req.body(), req.headers.get('X-Webhook-Secret'))
+    return JSONResponse(body, status_code=status)
+
+
+@app.get('/')
+async def root():
+    return {'status': 'Bot is running'}
+
+# API endpoints для веб-интерфейса (/api/scan регистрирует web_interface через register_scan_handler)
 @app.post("/api/report")
 async def api_report():
     """API для генерации отчета"""
     try:
-        path = generate_weekly_report()
+        path = await generate_weekly_report_async()
         return {"status": "report_generated", "path": path}
     except Exception as e:
         return {"status": "error", "error": str(e)}
@@ -742,6 +825,12 @@ async def api_signals_disable():
     except Exception as e:
         return {"status": "error", "error": str(e)}
 
+@app.get("/api/scheduler")
+async def api_scheduler():
+    """Статистика планировщика: дрейф относительно закрытия свечей и длительность запусков"""
+    return {"running": scheduler.running, "jobs": get_job_stats()}
+
+
 @app.get("/api/status")
 async def api_status():
     """API статуса бота"""
@@ -758,6 +847,7 @@ async def api_status():
 
 def start_uvicorn():
     """Запуск FastAPI сервера"""
+    import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=8000, log_level="info")
 
 
@@ -768,6 +858,51 @@ async def main():
         init_db()
         logger.info("Database initialized")
 
+        # Основной loop бота - для дампа задач и отчета о медленных колбэках (/admin/*)
+        register_loop()
+        # Ручной скан из веб-интерфейса выполняется в этом loop
+        register_scan_handler(check_signals)
+
+        # Несколько ботов на машине: свечи и тикеры от общего хаба вместо REST
+        if MARKET_HUB_ADDRESS:
+            from market_hub import HubClient
+            get_scanner().use_hub(HubClient(MARKET_HUB_ADDRESS, name=f"bot-{CHAT_ID}"))
+
+        # Кластерный режим: символы сканируют SCAN_WORKERS процессов
+        cluster = None
+        if SCAN_WORKERS:
+            from scan_cluster import ScanCoordinator
+            cluster = ScanCoordinator()
+            await cluster.start()
+            get_scanner().cluster = cluster
+
+        # Локальные стаканы кандидатов: фильтр проскальзывания и размер ордеров
+        if ORDER_BOOKS_ENABLED:
+            from order_book import order_books
+            get_scanner().order_books = order_books
+        # Поток сделок кандидатов: VWAP, дельта и дисбаланс тейкеров для уверенности сигнала
+        if TRADE_FLOW_ENABLED:
+            from trade_flow import trade_flow
+            get_scanner().trade_flow = trade_flow
+
+        # Состояние до рестарта: прогрев ниже догрузит только свечи, закрывшиеся за время простоя
+        if CHECKPOINT_PATH:
+            from checkpoint import restore_hot_state
+            await asyncio.to_thread(restore_hot_state, get_scanner(), signal_tracker)
+
+        # Движок аналитики выбирается при старте, а не на первом запросе дашборда (INSTALL sqlite может идти в сеть)
+        from analytics import engine as analytics_engine
+        try:
+            logger.info(f"Analytics engine: {await asyncio.to_thread(analytics_engine)}")
+        except Exception as e:
+            logger.error(f"Analytics engine error: {e}")
+
+        # Прогрев кэша свечей в фоне, чтобы первое сканирование не ждало REST
+        warm_up_task = asyncio.create_task(get_scanner().warm_up())
+        loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+        notifier.start()
+        webhook_pipeline.start()
+
         # Запуск планировщика
         scheduler.start()
         logger.info("Scheduler started")
@@ -792,6 +927,18 @@ async def main():
         # Запуск бота
         await dp.start_polling(bot)
 
+        # Прогрев мог не закончиться до остановки; монитор лага работает бесконечно
+        warm_up_task.cancel()
+        loop_lag_task.cancel()
+        await asyncio.gather(warm_up_task, loop_lag_task, return_exceptions=True)
+
+        # Штатная остановка - сохраняем состояние для быстрого рестарта
+        if CHECKPOINT_PATH:
+            await checkpoint_job()
+        # Воркеры кластера - дочерние процессы, без close() они переживут бота
+        if cluster is not None:
+            cluster.close()
+
     except Exception as e:
         logger.error(f"Failed to start bot: {e}")
         # Попытаемся отправить сообщение об ошибке
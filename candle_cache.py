@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from data import INTERVAL_MS, fetch_kline_batch
+from resampler import compare_bars, resample_frame
+
+logger = logging.getLogger(__name__)
+
+
+class CandleCache:
+    """Кэш закрытых свечей по (symbol, interval) с догрузкой только недостающих баров.
+
+    Формирующаяся свеча не хранится: закрытые бары не меняются, поэтому
+    кэш валиден до закрытия следующей свечи.
+    """
+
+    def __init__(self, max_bars: int = 500, verify_every: int = 24):
+        self.max_bars = max_bars
+        # Каждые verify_every построенных баров старшего ТФ сверяемся с биржей
+        self.verify_every = verify_every
+        self._frames: Dict[Tuple[str, str], pd.DataFrame] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._derived_since_verify: Dict[Tuple[str, str], int] = {}
+        # HubClient: если задан, свечи берутся у хаба рыночных данных, а не с биржи
+        self.hub = None
+
+    @staticmethod
+    def _last_open_ms(df: pd.DataFrame) -> int:
+        return df['open_time'].iloc[-1].value // 1_000_000
+
+    def _is_fresh(self, interval: str, df: pd.DataFrame, now_ms: int) -> bool:
+        # Следующая свеча после последней закрытой еще не закрылась
+        return not df.empty and now_ms < self._last_open_ms(df) + 2 * INTERVAL_MS[interval]
+
+    async def _fetch_closed(self, symbol: str, interval: str, limit: int, now_ms: int) -> pd.DataFrame:
+        if self.hub is not None:
+            try:
+                # Хаб отдает только закрытые свечи
+                return await self.hub.klines(symbol, interval, limit)
+            except Exception as e:
+                logger.warning(f"Market hub klines for {symbol} {interval} failed, using exchange: {e!r}")
+        # +1 бар: последний в ответе биржи - формирующийся, он отбрасывается
+        batch = await fetch_kline_batch(symbol, interval, limit=limit + 1)
+        return batch.closed(now_ms).to_frame()
+
+    async def get(self, symbol: str, interval: str = '5m', limit: int = 100) -> pd.DataFrame:
+        """Получить последние limit закрытых свечей, обращаясь к бирже только за новыми"""
+        key = (symbol.upper(), interval)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            df = self._frames.get(key)
+            now_ms = int(time.time() * 1000)
+
+            if interval not in INTERVAL_MS:
+                return await self._fetch_closed(symbol, interval, limit, now_ms)
+
+            if df is None or len(df) < limit:
+                df = await self._fetch_closed(symbol, interval, limit, now_ms)
+            elif not self._is_fresh(interval, df, now_ms):
+                missing = int((now_ms - self._last_open_ms(df)) // INTERVAL_MS[interval])
+                if missing >= limit:
+                    df = await self._fetch_closed(symbol, interval, limit, now_ms)
+                else:
+                    # Догружаем только новые закрытые бары
+                    fresh = await self._fetch_closed(symbol, interval, missing, now_ms)
+                    if not fresh.empty:
+                        df = pd.concat([df[df['open_time'] < fresh['open_time'].iloc[0]], fresh])
+            else:
+                return df.tail(limit).reset_index(drop=True)
+
+            df = df.tail(self.max_bars).reset_index(drop=True)
+            self._frames[key] = df
+            return df.tail(limit).reset_index(drop=True)
+
+    async def get_resampled(self, symbol: str, interval: str = '1h', base: str = '5m',
+                            limit: int = 100) -> pd.DataFrame:
+        """Старший таймфрейм, достраиваемый из закрытых свечей base.
+
+        История один раз загружается с биржи, дальше новые бары строятся из base
+        без REST-запросов. При разрыве в base-данных или расхождении с биржей
+        история перезагружается.
+        """
+        key = (symbol.upper(), interval)
+        step = INTERVAL_MS[interval]
+        # Базовых свечей достаточно на два бара старшего ТФ
+        base_df = await self.get(symbol, base, limit=min(2 * step // INTERVAL_MS[base], self.max_bars))
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            df = self._frames.get(key)
+            now_ms = int(time.time() * 1000)
+
+            if df is None or len(df) < limit:
+                return await self._reseed(key, limit, now_ms)
+            if self._is_fresh(interval, df, now_ms):
+                return df.tail(limit).reset_index(drop=True)
+
+            next_open = pd.Timestamp(self._last_open_ms(df) + step, unit='ms', tz='UTC')
+            derived = resample_frame(base_df[base_df['open_time'] >= next_open], base, interval)
+            opens = derived['open_time'].to_numpy(dtype='datetime64[ms]').astype('int64')
+            if derived.empty or opens[0] != next_open.value // 1_000_000 or (np.diff(opens) != step).any():
+                # В базовых свечах нет полных следующих баров подряд - берем с биржи
+                return await self._reseed(key, limit, now_ms)
+
+            df = pd.concat([df, derived]).tail(self.max_bars).reset_index(drop=True)
+            self._frames[key] = df
+
+            count = self._derived_since_verify.get(key, 0) + len(derived)
+            self._derived_since_verify[key] = count
+            if count >= self.verify_every:
+                exchange = await self._fetch_closed(key[0], interval, min(count, limit), now_ms)
+                mismatches = compare_bars(df, exchange)
+                if mismatches:
+                    logger.warning(f"Resampled {key[0]} {interval} differs from exchange at "
+                                   f"{len(mismatches)} bars, reloading")
+                    return await self._reseed(key, limit, now_ms)
+                self._derived_since_verify[key] = 0
+
+            return df.tail(limit).reset_index(drop=True)
+
+    async def _reseed(self, key, limit: int, now_ms: int) -> pd.DataFrame:
+        df = await self._fetch_closed(key[0], key[1], limit, now_ms)
+        self._frames[key] = df
+        self._derived_since_verify[key] = 0
+        return df.tail(limit).reset_index(drop=True)
+
+    async def append(self, symbol: str, interval: str, fresh: pd.DataFrame) -> int:
+        """Дописать закрытые бары из рассылки хаба, если они продолжают серию без разрыва"""
+        key = (symbol.upper(), interval)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            df = self._frames.get(key)
+            if df is None or df.empty or fresh.empty:
+                return 0
+            fresh = fresh[fresh['open_time'] > df['open_time'].iloc[-1]]
+            if fresh.empty or fresh['open_time'].iloc[0].value // 1_000_000 != self._last_open_ms(df) + INTERVAL_MS[interval]:
+                # Разрыв - серию догрузит следующий get
+                return 0
+            self._frames[key] = pd.concat([df, fresh]).tail(self.max_bars).reset_index(drop=True)
+            return len(fresh)
+
+    def snapshot(self) -> Dict[Tuple[str, str], Dict[str, np.ndarray]]:
+        """Закрытые свечи всех серий колонками numpy (open_time - мс) для чекпоинта"""
+        state = {}
+        for key, df in self._frames.items():
+            columns = {col: df[col].to_numpy() for col in df.columns}
+            columns['open_time'] = df['open_time'].to_numpy(dtype='datetime64[ms]').astype('int64')
+            state[key] = columns
+        return state
+
+    def restore(self, state: Dict[Tuple[str, str], Dict[str, np.ndarray]]) -> int:
+        """Загрузить серии из чекпоинта; недостающие бары догрузит следующий get"""
+        for key, columns in state.items():
+            df = pd.DataFrame(columns)
+            df['open_time'] = pd.to_datetime(df['open_time'], unit='ms', utc=True)
+            self._frames[tuple(key)] = df.tail(self.max_bars).reset_index(drop=True)
+        return len(state)
+
+    async def warm_up(self, symbols: List[str], intervals: List[str], limit: int = 100,
+                      concurrency: int = 10) -> int:
+        """Параллельно загрузить свечи для списка символов и таймфреймов"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def load(symbol, interval):
+            async with semaphore:
+                try:
+                    await self.get(symbol, interval, limit)
+                    return True
+                except Exception as e:
+                    logger.error(f"Warm-up error for {symbol} {interval}: {e}")
+                    return False
+
+        results = await asyncio.gather(*(load(s, i) for s in symbols for i in intervals))
+        return sum(results)
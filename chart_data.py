@@ -0,0 +1,226 @@
+"""Данные для графика дашборда: диапазоны свечей с прореживанием на сервере.
+
+Свечи берутся с биржи плитками по TILE_BARS баров, выровненными по
+интервалу: плитка (symbol, interval, номер) целиком в прошлом не меняется
+и кэшируется в LRU, текущая (с формирующейся свечой) живет OPEN_TILE_TTL
+секунд. Диапазон любой длины собирается из плиток и прореживается до
+бюджета точек (ширина графика в пикселях):
+
+- lttb - Largest-Triangle-Three-Buckets по цене закрытия (линия);
+- minmax - OHLC по корзинам: open первой свечи, max high, min low, close
+  последней - экстремумы не теряются при любом масштабе.
+
+Обновления "since" отдают сырые свечи начиная с последней известной
+клиенту, поэтому график дописывает точки, а не строится заново.
+
+Эндпоинт открыт без авторизации, а запросы к бирже идут с веса IP бота:
+символ проверяется по списку фьючерсов (exchangeInfo), а запросы свечей
+всех графиков ограничены бюджетом CHART_FETCH_BUDGET в минуту.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+import numpy as np
+from data import INTERVAL_MS, KlineBatch, decode_klines, fetch_kline_batch, fetch_lot_sizes
+
+logger = logging.getLogger(__name__)
+
+TILE_BARS = 1000  # не больше лимита /fapi/v1/klines (1500)
+CHART_POINTS = int(os.getenv('CHART_POINTS', '800'))
+CHART_MAX_POINTS = 5000
+CHART_MAX_BARS = int(os.getenv('CHART_MAX_BARS', '60000'))  # ~6 недель 1m за один запрос
+CHART_TILE_CACHE = int(os.getenv('CHART_TILE_CACHE', '512'))
+CHART_SINCE_LIMIT = 1000
+OPEN_TILE_TTL = 10.0
+CHART_FETCH_BUDGET = int(os.getenv('CHART_FETCH_BUDGET', '120'))  # запросов свечей к бирже в минуту
+METHODS = ('lttb', 'minmax')
+
+
+class ChartRateLimited(Exception):
+    """Бюджет запросов к бирже исчерпан; retry_after - через сколько секунд повторить"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"chart data rate limit, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Индексы точек, выбранных LTTB (первая и последняя точка сохраняются всегда)"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = x - x[0]
+    # n_out - 2 корзины на внутренних точках [1, n - 1); шаг >= 1, пустых корзин нет
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    # Среднее следующей корзины не зависит от выбора - считаем для всех сразу (за последней - точка n - 1)
+    next_lo, next_hi = edges[1:], np.append(edges[2:], n)
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    avg_x = ((cx[next_hi] - cx[next_lo]) / (next_hi - next_lo)).tolist()
+    avg_y = ((cy[next_hi] - cy[next_lo]) / (next_hi - next_lo)).tolist()
+    bounds = edges.tolist()
+    selected = np.empty(n_out, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    ax, ay = 0.0, float(y[0])
+    for i in range(n_out - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        # Удвоенная площадь треугольника (выбранная точка, кандидат, среднее следующей корзины)
+        area = np.abs((ax - avg_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y[i] - ay))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+        ax, ay = float(x[a]), float(y[a])
+    return selected
+
+
+def minmax(batch: KlineBatch, n_out: int) -> Dict[str, np.ndarray]:
+    """OHLC по n_out корзинам подряд идущих свечей (reduceat, без цикла по корзинам)"""
+    n = len(batch)
+    if n <= n_out:
+        return {'t': batch.open_time, 'o': batch.open, 'h': batch.high, 'l': batch.low, 'c': batch.close,
+                'v': batch.volume}
+    starts = np.linspace(0, n, n_out, endpoint=False).astype(np.intp)
+    last = np.append(starts[1:] - 1, n - 1)
+    return {
+        't': batch.open_time[starts],
+        'o': batch.open[starts],
+        'h': np.maximum.reduceat(batch.high, starts),
+        'l': np.minimum.reduceat(batch.low, starts),
+        'c': batch.close[last],
+        'v': np.add.reduceat(batch.volume, starts),
+    }
+
+
+def _concat(batches) -> KlineBatch:
+    batches = [b for b in batches if len(b)]
+    if not batches:
+        return decode_klines([])
+    return KlineBatch(np.concatenate([b.open_time for b in batches]), np.concatenate([b.close_time for b in batches]),
+                      np.concatenate([b.trades for b in batches]), np.concatenate([b.values for b in batches], axis=1))
+
+
+def _columns(columns: Dict[str, np.ndarray]) -> Dict[str, list]:
+    return {k: v.tolist() for k, v in columns.items()}
+
+
+class ChartDataService:
+    """Плитки свечей в LRU-кэше и диапазоны графика с прореживанием"""
+
+    def __init__(self, max_tiles: int = CHART_TILE_CACHE, concurrency: int = 5, budget: int = CHART_FETCH_BUDGET):
+        self.max_tiles = max_tiles
+        # Token bucket запросов к бирже: budget в минуту, не больше budget подряд
+        self.budget = budget
+        self._tokens = float(budget)
+        self._tokens_updated = time.monotonic()
+        # (symbol, interval, номер плитки) -> (KlineBatch, истекает по monotonic или None для закрытой)
+        self._tiles: 'OrderedDict[Tuple[str, str, int], Tuple[KlineBatch, float]]' = OrderedDict()
+        self._locks: Dict[Tuple[str, str, int], asyncio.Lock] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.hits = 0
+        self.misses = 0
+
+    def _spend(self, requests: int):
+        """Списать запросы к бирже из бюджета или ChartRateLimited"""
+        if requests > self.budget:
+            raise ValueError(f"range needs {requests} exchange requests, budget is {self.budget} per minute")
+        now = time.monotonic()
+        self._tokens = min(self.budget, self._tokens + (now - self._tokens_updated) * self.budget / 60)
+        self._tokens_updated = now
+        if requests > self._tokens:
+            raise ChartRateLimited(math.ceil((requests - self._tokens) * 60 / self.budget))
+        self._tokens -= requests
+
+    async def _check_symbol(self, symbol: str):
+        if symbol not in await fetch_lot_sizes(symbol):
+            raise ValueError(f"unknown symbol {symbol}")
+
+    def _cached(self, key: Tuple[str, str, int]) -> bool:
+        cached = self._tiles.get(key)
+        return cached is not None and (cached[1] is None or cached[1] > time.monotonic())
+
+    async def tile(self, symbol: str, interval: str, tile_id: int, now_ms: int) -> KlineBatch:
+        key = (symbol, interval, tile_id)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            if self._cached(key):
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return self._tiles[key][0]
+
+            self.misses += 1
+            span = INTERVAL_MS[interval] * TILE_BARS
+            start_ms, end_ms = tile_id * span, (tile_id + 1) * span
+            async with self._semaphore:
+                batch = await fetch_kline_batch(symbol, interval, TILE_BARS, start_ms=start_ms, end_ms=end_ms - 1)
+            # Без endTime на листинге или разрыве биржа отдает бары следующей плитки - оставляем только свои
+            batch = batch[(batch.open_time >= start_ms) & (batch.open_time < end_ms)]
+            # Плитка закрыта, если закрылась ее последняя свеча
+            complete = (tile_id + 1) * span <= now_ms
+            self._tiles[key] = (batch, None if complete else time.monotonic() + OPEN_TILE_TTL)
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                evicted, _ = self._tiles.popitem(last=False)
+                self._locks.pop(evicted, None)
+            return batch
+
+    async def candles(self, symbol: str, interval: str, start_ms: int, end_ms: int) -> KlineBatch:
+        """Свечи с open_time в [start_ms, end_ms), собранные из плиток"""
+        span = INTERVAL_MS[interval] * TILE_BARS
+        now_ms = int(time.time() * 1000)
+        tile_ids = range(start_ms // span, (end_ms - 1) // span + 1)
+        self._spend(sum(not self._cached((symbol, interval, tile_id)) for tile_id in tile_ids))
+        tiles = await asyncio.gather(*[self.tile(symbol, interval, tile_id, now_ms) for tile_id in tile_ids])
+        batch = _concat(tiles)
+        return batch[(batch.open_time >= start_ms) & (batch.open_time < end_ms)]
+
+    async def range(self, symbol: str, interval: str = '5m', start_ms: int = None, end_ms: int = None,
+                    points: int = CHART_POINTS, method: str = 'lttb') -> Dict:
+        """Диапазон для графика, прореженный до points точек"""
+        symbol = symbol.upper()
+        if interval not in INTERVAL_MS:
+            raise ValueError(f"unsupported interval {interval}")
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}")
+        step = INTERVAL_MS[interval]
+        points = max(3, min(points, CHART_MAX_POINTS))
+        now_ms = int(time.time() * 1000)
+        end_ms = min(end_ms or now_ms + step, now_ms + step)
+        start_ms = start_ms if start_ms is not None else end_ms - points * step
+        if start_ms >= end_ms:
+            raise ValueError("start must be before end")
+        if (end_ms - start_ms) // step > CHART_MAX_BARS:
+            raise ValueError(f"range is longer than {CHART_MAX_BARS} {interval} bars, use a larger interval")
+        await self._check_symbol(symbol)
+
+        batch = await self.candles(symbol, interval, start_ms, end_ms)
+        if method == 'lttb':
+            selected = lttb(batch.open_time.astype(np.float64), batch.close, points)
+            columns = {'t': batch.open_time[selected], 'c': batch.close[selected]}
+        else:
+            columns = minmax(batch, points)
+        return {'symbol': symbol, 'interval': interval, 'method': method, 'bars': len(batch),
+                'last': int(batch.open_time[-1]) if len(batch) else None, **_columns(columns)}
+
+    async def since(self, symbol: str, interval: str, since_ms: int) -> Dict:
+        """Сырые свечи с open_time >= since_ms (включая формирующуюся) для дописывания графика"""
+        symbol = symbol.upper()
+        if interval not in INTERVAL_MS:
+            raise ValueError(f"unsupported interval {interval}")
+        step = INTERVAL_MS[interval]
+        await self._check_symbol(symbol)
+        bars = (int(time.time() * 1000) - since_ms) // step + 1
+        truncated = bars > CHART_SINCE_LIMIT
+        self._spend(1)
+        batch = await fetch_kline_batch(symbol, interval, min(max(bars, 1), CHART_SINCE_LIMIT), start_ms=since_ms)
+        return {'symbol': symbol, 'interval': interval, 'method': 'raw', 'bars': len(batch),
+                'last': int(batch.open_time[-1]) if len(batch) else since_ms,
+                # Клиент отстал больше чем на лимит - ему нужно перезапросить диапазон
+                'truncated': truncated,
+                **_columns({'t': batch.open_time, 'o': batch.open, 'h': batch.high, 'l': batch.low,
+                            'c': batch.close, 'v': batch.volume})}
+
+
+chart_data = ChartDataService()
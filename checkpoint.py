@@ -0,0 +1,122 @@
+"""Чекпоинт горячего состояния для быстрого рестарта.
+
+После рестарта сканеру снова нужны список монет, 100+ свечей на серию
+(EMA100 + dropna), базовые объемы прескрина, окно корреляций и активные
+сигналы - без чекпоинта все это набирается заново запросами к REST и
+сканами. Состояние периодически пишется в один бинарный файл:
+
+    заголовок (magic, версия, время создания, crc32, длина) + zlib(pickle)
+
+Запись атомарная: временный файл в том же каталоге, fsync, os.replace.
+При старте файл проверяется (версия, контрольная сумма, возраст), а
+недостающие за время простоя свечи догружает обычный прогрев кэша.
+Стаканы и поток сделок не сохраняются - они устаревают за секунды.
+"""
+import asyncio
+import logging
+import os
+import pickle
+import struct
+import tempfile
+import time
+import zlib
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH', 'data/checkpoint.bin')
+CHECKPOINT_INTERVAL = os.getenv('CHECKPOINT_INTERVAL', '5m')
+CHECKPOINT_MAX_AGE_SEC = float(os.getenv('CHECKPOINT_MAX_AGE_SEC', '3600'))
+CHECKPOINT_VERSION = 1
+
+MAGIC = b'CFBHOT'
+_HEADER = struct.Struct('<6sHqII')  # magic, версия, создан (мс), crc32, длина данных
+
+
+class CheckpointError(Exception):
+    """Файл чекпоинта поврежден или несовместим"""
+
+
+def encode_checkpoint(state: Dict, created_ms: int = None) -> bytes:
+    created_ms = created_ms or int(time.time() * 1000)
+    payload = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 6)
+    return _HEADER.pack(MAGIC, CHECKPOINT_VERSION, created_ms, zlib.crc32(payload), len(payload)) + payload
+
+
+def decode_checkpoint(data: bytes):
+    """(created_ms, state) или CheckpointError"""
+    if len(data) < _HEADER.size:
+        raise CheckpointError("file is truncated")
+    magic, version, created_ms, crc, length = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CheckpointError("not a checkpoint file")
+    if version != CHECKPOINT_VERSION:
+        raise CheckpointError(f"version {version}, expected {CHECKPOINT_VERSION}")
+    payload = data[_HEADER.size:_HEADER.size + length]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise CheckpointError("checksum mismatch")
+    return created_ms, pickle.loads(zlib.decompress(payload))
+
+
+def write_checkpoint(state: Dict, path: str = CHECKPOINT_PATH) -> int:
+    """Атомарно записать чекпоинт: читатель видит либо старый файл, либо новый целиком"""
+    data = encode_checkpoint(state)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.checkpoint-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return len(data)
+
+
+def read_checkpoint(path: str = CHECKPOINT_PATH, max_age_sec: float = CHECKPOINT_MAX_AGE_SEC,
+                    now_ms: int = None) -> Optional[Dict]:
+    """Состояние из чекпоинта или None, если файла нет, он устарел или поврежден"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        created_ms, state = decode_checkpoint(data)
+    except Exception as e:
+        logger.warning(f"Ignoring checkpoint {path}: {e}")
+        return None
+    age = ((now_ms or int(time.time() * 1000)) - created_ms) / 1000
+    if age > max_age_sec:
+        logger.info(f"Ignoring checkpoint {path}: {age:.0f}s old (max {max_age_sec:.0f}s)")
+        return None
+    state['age_sec'] = age
+    return state
+
+
+async def save_hot_state(scanner, tracker, path: str = CHECKPOINT_PATH) -> int:
+    """Снять состояние в event loop (согласованно) и записать файл в потоке"""
+    state = {'scanner': scanner.snapshot(), 'signals': tracker.snapshot()}
+    started = time.perf_counter()
+    size = await asyncio.to_thread(write_checkpoint, state, path)
+    logger.info(f"Checkpoint saved: {size / 1024:.0f} KiB in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return size
+
+
+def restore_hot_state(scanner, tracker, path: str = CHECKPOINT_PATH,
+                      max_age_sec: float = CHECKPOINT_MAX_AGE_SEC) -> bool:
+    """Восстановить сканер и активные сигналы из чекпоинта (до запуска сканов)"""
+    state = read_checkpoint(path, max_age_sec)
+    if state is None:
+        return False
+    try:
+        restored = scanner.restore(state['scanner'])
+        restored['signals'] = tracker.restore(state['signals'])
+    except Exception as e:
+        logger.warning(f"Checkpoint {path} could not be applied: {e}")
+        return False
+    logger.info(f"Hot state restored from {state['age_sec']:.0f}s old checkpoint: {restored}")
+    return True
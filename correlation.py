@@ -0,0 +1,214 @@
+"""Скользящая корреляция доходностей по всей вселенной скана.
+
+Цены берутся из 24h-тикеров, которые скан и так запрашивает на каждой
+свече, поэтому матрица обновляется без дополнительных запросов. Окно -
+кольцо последних window доходностей; суммы для ковариации обновляются
+rank-1 поправками (добавить новую строку, вычесть вытесненную) за O(N²).
+Корреляция считается попарно только по свечам, где есть оба символа.
+"""
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from data import INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+CORRELATION_WINDOW = int(os.getenv('CORRELATION_WINDOW', '288'))  # свечей (сутки 5m)
+CORRELATION_MIN_OBS = int(os.getenv('CORRELATION_MIN_OBS', '24'))  # общих свечей для оценки пары
+CORRELATION_INTERVAL = os.getenv('CORRELATION_INTERVAL', '5m')
+MAX_SIGNAL_CORRELATION = float(os.getenv('MAX_SIGNAL_CORRELATION', '0.7'))
+
+
+class RollingCorrelation:
+    """Матрица корреляций доходностей N символов за последние window свечей"""
+
+    def __init__(self, window: int = CORRELATION_WINDOW, capacity: int = 400, interval: str = CORRELATION_INTERVAL,
+                 min_obs: int = CORRELATION_MIN_OBS):
+        self.window = window
+        self.capacity = capacity
+        self.interval_ms = INTERVAL_MS[interval]
+        self.min_obs = min_obs
+        self.index: Dict[str, int] = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self._used = 0  # строки [0, _used) когда-либо выделялись
+
+        self.returns = np.zeros((window, capacity))  # кольцо доходностей (0 - нет данных)
+        self.valid = np.zeros((window, capacity))  # 1 - доходность символа на этой свече есть
+        # Суммы по окну: P = Σ r rᵀ, S[i, j] = Σ r_i m_j, Q[i, j] = Σ r_i² m_j, C = Σ m mᵀ
+        self.P = np.zeros((capacity, capacity))
+        self.S = np.zeros((capacity, capacity))
+        self.Q = np.zeros((capacity, capacity))
+        self.C = np.zeros((capacity, capacity))
+        self.prev_price = np.full(capacity, np.nan)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        self.head = 0
+        self.updates = 0
+        self.bucket = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def _row(self, symbol: str) -> int:
+        row = self.index.get(symbol)
+        if row is None:
+            if not self._free:
+                # Нет места - освобождаем символ, который дольше всех не встречался
+                self._release(min(self.index, key=lambda s: self.last_seen[self.index[s]]))
+            row = self.index[symbol] = self._free.pop()
+            self._used = max(self._used, row + 1)
+        return row
+
+    def _release(self, symbol: str):
+        row = self.index.pop(symbol)
+        for matrix in (self.P, self.S, self.Q, self.C):
+            matrix[row, :] = 0
+            matrix[:, row] = 0
+        self.returns[:, row] = 0
+        self.valid[:, row] = 0
+        self.prev_price[row] = np.nan
+        self._free.append(row)
+
+    def update(self, prices: Dict[str, float], ts_ms: int = None) -> bool:
+        """Учесть цены закрытия свечи. Несколько вызовов в одной свече - обновляется только цена"""
+        ts_ms = ts_ms or int(time.time() * 1000)
+        bucket = ts_ms // self.interval_ms
+        rows = np.fromiter((self._row(s) for s in prices), dtype=np.intp, count=len(prices))
+        price = np.fromiter(prices.values(), dtype=np.float64, count=len(prices))
+        seen = self.last_seen[rows]
+        self.last_seen[rows] = bucket
+        if bucket == self.bucket:
+            # Доходность следующей свечи считается от последней цены этой
+            fresh = price > 0
+            self.prev_price[rows[fresh]] = price[fresh]
+            return False
+
+        n = self._used
+        r = np.zeros(n)
+        m = np.zeros(n)
+        if self.bucket is not None and bucket - self.bucket > 1:
+            # Пропущенные свечи (скан не запускался, рестарт): окно - последние window свечей,
+            # поэтому они входят в кольцо пустыми
+            self._skip(min(bucket - self.bucket - 1, self.window))
+        # Доходность только от цены предыдущей свечи: символ, пропавший на несколько свечей
+        # (или весь скан после простоя), дает доходность за несколько свечей - ее не учитываем,
+        # а prev_price заменяется текущей ценой ниже
+        previous = np.where(seen == bucket - 1, self.prev_price[rows], np.nan)
+        self.bucket = bucket
+        ok = (previous > 0) & (price > 0)
+        r[rows[ok]] = np.log(price[ok] / previous[ok])
+        m[rows[ok]] = 1.0
+        self.prev_price[rows] = price
+        self._push(r, m)
+        return True
+
+    def _push(self, r: np.ndarray, m: np.ndarray):
+        n = len(r)
+        old_r, old_m = self.returns[self.head, :n], self.valid[self.head, :n]
+        # Rank-1 поправки: новая свеча входит в окно, самая старая выходит
+        self.P[:n, :n] += np.outer(r, r) - np.outer(old_r, old_r)
+        self.S[:n, :n] += np.outer(r, m) - np.outer(old_r, old_m)
+        self.Q[:n, :n] += np.outer(r * r, m) - np.outer(old_r * old_r, old_m)
+        self.C[:n, :n] += np.outer(m, m) - np.outer(old_m, old_m)
+        self.returns[self.head, :n] = r
+        self.valid[self.head, :n] = m
+        self.head = (self.head + 1) % self.window
+        self.updates += 1
+
+        if self.updates % self.window == 0:
+            self._recompute()
+
+    def _skip(self, candles: int):
+        """Сдвинуть кольцо на candles пустых свечей"""
+        if candles >= self.window:
+            for array in (self.returns, self.valid, self.P, self.S, self.Q, self.C):
+                array[...] = 0
+            self.head = (self.head + candles) % self.window
+            self.updates += candles
+            return
+        empty = np.zeros(self._used)
+        for _ in range(candles):
+            self._push(empty, empty)
+
+    def _recompute(self):
+        """Пересчитать суммы по кольцу целиком - убирает накопленную ошибку округления"""
+        n = self._used
+        r, m = self.returns[:, :n], self.valid[:, :n]
+        self.P[:n, :n] = r.T @ r
+        self.S[:n, :n] = r.T @ m
+        self.Q[:n, :n] = (r * r).T @ m
+        self.C[:n, :n] = m.T @ m
+
+    def snapshot(self) -> Dict:
+        """Кольцо доходностей и цены для чекпоинта (суммы пересчитываются при загрузке)"""
+        n = self._used
+        return {'window': self.window, 'interval_ms': self.interval_ms, 'index': dict(self.index),
+                'returns': self.returns[:, :n].copy(), 'valid': self.valid[:, :n].copy(),
+                'prev_price': self.prev_price[:n].copy(), 'last_seen': self.last_seen[:n].copy(),
+                'head': self.head, 'updates': self.updates, 'bucket': self.bucket}
+
+    def restore(self, state: Dict) -> bool:
+        """Загрузить состояние из snapshot; False - другое окно, интервал или не хватает строк"""
+        n = state['returns'].shape[1]
+        if state['window'] != self.window or state['interval_ms'] != self.interval_ms or n > self.capacity:
+            return False
+        for array in (self.returns, self.valid, self.P, self.S, self.Q, self.C, self.last_seen):
+            array[...] = 0
+        self.prev_price[:] = np.nan
+        self.index = dict(state['index'])
+        used = set(self.index.values())
+        self._free = [row for row in range(self.capacity - 1, -1, -1) if row not in used]
+        self._used = n
+        self.returns[:, :n] = state['returns']
+        self.valid[:, :n] = state['valid']
+        self.prev_price[:n] = state['prev_price']
+        self.last_seen[:n] = state['last_seen']
+        self.head, self.updates, self.bucket = state['head'], state['updates'], state['bucket']
+        self._recompute()
+        return True
+
+    def matrix(self, symbols: List[str]) -> np.ndarray:
+        """Корреляции между symbols (NaN - мало общих свечей или символ неизвестен)"""
+        known = np.array([s in self.index for s in symbols], dtype=bool)
+        rows = np.array([self.index.get(s, 0) for s in symbols], dtype=np.intp)
+        ix = np.ix_(rows, rows)
+        count, S, Q, P = self.C[ix], self.S[ix], self.Q[ix], self.P[ix]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Попарно по общим свечам: S[i, j] - сумма r_i там, где есть j
+            cov = P - S * S.T / count
+            var_i = Q - S * S / count
+            corr = cov / np.sqrt(var_i * var_i.T)
+        corr[(count < self.min_obs) | ~known[:, None] | ~known[None, :]] = np.nan
+        np.fill_diagonal(corr, 1.0)
+        return np.clip(corr, -1.0, 1.0)
+
+    def correlation(self, a: str, b: str) -> Optional[float]:
+        value = self.matrix([a, b])[0, 1]
+        return None if np.isnan(value) else float(value)
+
+
+def select_diversified(candidates: List[Tuple[str, int]], correlation: np.ndarray, limit: int,
+                       max_correlation: float = MAX_SIGNAL_CORRELATION):
+    """Жадный отбор: идти по убыванию ранга и брать кандидата, если его позиция
+    не коррелирует сильнее max_correlation ни с одной уже выбранной.
+
+    candidates - (символ, направление +1/-1) по убыванию ранга, correlation - их матрица.
+    Корреляция позиций = корреляция доходностей * направление_a * направление_b:
+    LONG и SHORT на сильно связанных монетах - хедж, а не одна ставка.
+    Возвращает индексы выбранных и причины отказа {индекс: (индекс выбранного, корреляция)}.
+    """
+    directions = np.array([direction for _, direction in candidates], dtype=np.float64)
+    position = np.nan_to_num(correlation * np.outer(directions, directions), nan=0.0)
+    selected: List[int] = []
+    rejected: Dict[int, Tuple[int, float]] = {}
+    for i in range(len(candidates)):
+        if len(selected) >= limit:
+            break
+        if selected:
+            j = int(np.argmax(position[i, selected]))
+            if position[i, selected[j]] > max_correlation:
+                rejected[i] = (selected[j], float(position[i, selected[j]]))
+                continue
+        selected.append(i)
+    return selected, rejected
@@ -1,20 +1,157 @@
+import os
+import time
 import httpx
-import pandas as pd
-from typing import List
+import numpy as np
+from decimal import Decimal
+from typing import Dict, List, Tuple, TYPE_CHECKING
 from datetime import datetime
+from metrics import FETCH_KLINES_SECONDS, observe_binance_response
 
-BINANCE_REST = 'https://fapi.binance.com'  # futures REST
+if TYPE_CHECKING:
+    import pandas as pd
 
-async def fetch_klines(symbol: str, interval: str = '5m', limit: int = 500) -> pd.DataFrame:
+BINANCE_REST = os.getenv('BINANCE_REST', 'https://fapi.binance.com')  # futures REST
+BINANCE_WS = os.getenv('BINANCE_WS', 'wss://fstream.binance.com')  # futures market streams
+
+INTERVAL_MS = {
+    '1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '2h': 7_200_000, '4h': 14_400_000, '1d': 86_400_000,
+}
+
+# Колонки ответа /fapi/v1/klines:
+# open_time, open, high, low, close, volume, close_time, quote_volume, trades,
+# taker_buy_base, taker_buy_quote, ignore
+_FLOAT_COLUMNS = (1, 2, 3, 4, 5, 7, 9, 10)
+# Колонки потока сделок, которые to_frame добавляет к OHLCV
+FLOW_COLUMNS = ('quote_volume', 'taker_buy_base')
+
+
+class KlineBatch:
+    """Свечи в виде непрерывных numpy-массивов (DataFrame строится только по запросу)"""
+    __slots__ = ('open_time', 'close_time', 'trades', 'values', 'open', 'high', 'low', 'close', 'volume',
+                 'quote_volume', 'taker_buy_base', 'taker_buy_quote')
+
+    def __init__(self, open_time: np.ndarray, close_time: np.ndarray, trades: np.ndarray, values: np.ndarray):
+        # values - матрица (8, n) float64, строки - представления без копирования
+        self.open_time = open_time
+        self.close_time = close_time
+        self.trades = trades
+        self.values = values
+        (self.open, self.high, self.low, self.close, self.volume,
+         self.quote_volume, self.taker_buy_base, self.taker_buy_quote) = values
+
+    def __len__(self):
+        return len(self.open_time)
+
+    def __getitem__(self, item) -> 'KlineBatch':
+        """Срез или булева маска по свечам"""
+        return KlineBatch(self.open_time[item], self.close_time[item], self.trades[item], self.values[:, item])
+
+    def closed(self, now_ms: int) -> 'KlineBatch':
+        """Только закрытые свечи (без формирующейся последней)"""
+        return self[self.close_time < now_ms]
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """DataFrame в формате fetch_klines: open_time + OHLCV + объем в USDT и покупки тейкеров"""
+        import pandas as pd
+        return pd.DataFrame({
+            'open_time': pd.to_datetime(self.open_time, unit='ms', utc=True),
+            'open': self.open,
+            'high': self.high,
+            'low': self.low,
+            'close': self.close,
+            'volume': self.volume,
+            'quote_volume': self.quote_volume,
+            'taker_buy_base': self.taker_buy_base,
+        })
+
+
+def decode_klines(raw: List[list]) -> KlineBatch:
+    """Разобрать сырой ответ klines в KlineBatch за один проход"""
+    if not raw:
+        empty = np.empty(0, dtype=np.int64)
+        return KlineBatch(empty, empty, empty, np.empty((len(_FLOAT_COLUMNS), 0), dtype=np.float64))
+    # zip(*raw) транспонирует строки в колонки на уровне C
+    columns = list(zip(*raw))
+    return KlineBatch(
+        np.array(columns[0], dtype=np.int64),
+        np.array(columns[6], dtype=np.int64),
+        np.array(columns[8], dtype=np.int64),
+        np.array([columns[i] for i in _FLOAT_COLUMNS], dtype=np.float64),
+    )
+
+
+async def fetch_klines_raw(symbol: str, interval: str = '5m', limit: int = 500, start_ms: int = None,
+                           end_ms: int = None) -> List[list]:
     url = f"{BINANCE_REST}/fapi/v1/klines"
     params = {'symbol': symbol.upper(), 'interval': interval, 'limit': limit}
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        raw = r.json()
-    df = pd.DataFrame(raw, columns=["open_time","open","high","low","close","volume","close_time","q","n","taker_buy_base","taker_buy_quote","ignore"]) 
-    df = df[['open_time','open','high','low','close','volume']]
-    df['open_time'] = pd.to_datetime(df['open_time'], unit='ms', utc=True)
-    for col in ['open','high','low','close','volume']:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-    return df
+    if start_ms is not None:
+        # Свечи вперед от start_ms (по умолчанию - последние limit свечей)
+        params['startTime'] = int(start_ms)
+    if end_ms is not None:
+        params['endTime'] = int(end_ms)
+    with FETCH_KLINES_SECONDS.labels(interval).time():
+        async with httpx.AsyncClient(timeout=20) as client:
+            r = await client.get(url, params=params)
+            observe_binance_response('klines', r)
+            r.raise_for_status()
+            return r.json()
+
+
+async def fetch_kline_batch(symbol: str, interval: str = '5m', limit: int = 500, start_ms: int = None,
+                            end_ms: int = None) -> KlineBatch:
+    return decode_klines(await fetch_klines_raw(symbol, interval, limit, start_ms, end_ms))
+
+
+async def fetch_klines(symbol: str, interval: str = '5m', limit: int = 500) -> 'pd.DataFrame':
+    return (await fetch_kline_batch(symbol, interval, limit)).to_frame()
+
+
+LOT_SIZE_TTL = 3600.0
+LOT_SIZE_MIN_REFRESH = 60.0  # неизвестный символ перезапрашивает exchangeInfo не чаще
+# symbol -> (stepSize, minQty) фильтра LOT_SIZE; обновляется целиком
+_lot_sizes: Dict[str, Tuple[Decimal, Decimal]] = {}
+_lot_sizes_updated = 0.0
+
+
+async def fetch_lot_sizes(symbol: str = None) -> Dict[str, Tuple[Decimal, Decimal]]:
+    """(stepSize, minQty) всех фьючерсов из exchangeInfo (кэш на LOT_SIZE_TTL; symbol, которого
+    нет в кэше, - новый листинг - обновляет его раньше)"""
+    global _lot_sizes, _lot_sizes_updated
+    age = time.monotonic() - _lot_sizes_updated
+    if age > LOT_SIZE_TTL or (symbol is not None and symbol not in _lot_sizes and age > LOT_SIZE_MIN_REFRESH):
+        async with httpx.AsyncClient(timeout=20) as client:
+            r = await client.get(f"{BINANCE_REST}/fapi/v1/exchangeInfo")
+            observe_binance_response('exchange_info', r)
+            r.raise_for_status()
+        lot_sizes = {}
+        for info in r.json()['symbols']:
+            for f in info['filters']:
+                if f['filterType'] == 'LOT_SIZE':
+                    lot_sizes[info['symbol']] = (Decimal(f['stepSize']), Decimal(f['minQty']))
+        _lot_sizes, _lot_sizes_updated = lot_sizes, time.monotonic()
+    return _lot_sizes
+
+
+async def fetch_lot_size(symbol: str) -> Tuple[Decimal, Decimal]:
+    """(stepSize, minQty) символа"""
+    symbol = symbol.upper()
+    lot_sizes = await fetch_lot_sizes(symbol)
+    if symbol not in lot_sizes:
+        raise ValueError(f"No LOT_SIZE filter for {symbol}")
+    return lot_sizes[symbol]
+
+
+def floor_to_step(quantity: float, step: Decimal) -> float:
+    """Округлить объем вниз до шага лота (через Decimal, без хвостов двоичной арифметики)"""
+    if step <= 0:
+        return quantity
+    return float(Decimal(str(quantity)) // step * step)
+
+
+async def fetch_last_price(symbol: str) -> float:
+    """Текущая цена (close последней минутной свечи) без построения DataFrame"""
+    batch = await fetch_kline_batch(symbol, '1m', limit=1)
+    if not len(batch):
+        raise ValueError(f"No klines for {symbol}")
+    return float(batch.close[-1])
@@ -1,5 +1,6 @@
 import sqlite3, os
-from datetime import datetime
+from datetime import datetime, timedelta
+from metrics import DB_SECONDS, timed
 
 DB = os.getenv('BOT_DB_PATH', 'data/bot.db')
 
@@ -31,8 +32,12 @@ def init_db():
         stop REAL,
         tp1 REAL,
         tp2 REAL,
-        tp3 REAL
+        tp3 REAL,
+        state TEXT DEFAULT 'NEW'
     )''')
+    # Старая схема без состояния сигнала
+    if 'state' not in [r[1] for r in c.execute("PRAGMA table_info(signals)")]:
+        c.execute("ALTER TABLE signals ADD COLUMN state TEXT DEFAULT 'NEW'")
 
     # Таблица открытых позиций
     c.execute('''CREATE TABLE IF NOT EXISTS positions (
@@ -47,29 +52,173 @@ def init_db():
         status TEXT DEFAULT 'OPEN'
     )''')
 
+    # Подписчики рассылки сигналов
+    c.execute('''CREATE TABLE IF NOT EXISTS subscribers (
+        chat_id INTEGER PRIMARY KEY,
+        ts TIMESTAMP
+    )''')
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_trades_ts ON trades (ts)")
+
+    # Исход сигналов по свечам после публикации (обновляется инкрементально).
+    # start_ms - начало свечи сигнала, next_ms - начало следующей непроверенной свечи,
+    # *_ms - закрытие свечи первого касания уровня, best_tp - старший достигнутый тейк.
+    # status: OPEN, STOP (стоп), TP3 (последний тейк), EXPIRED (истек горизонт)
+    c.execute('''CREATE TABLE IF NOT EXISTS signal_outcomes (
+        signal_id INTEGER PRIMARY KEY,
+        ts TIMESTAMP,
+        symbol TEXT,
+        side TEXT,
+        entry REAL,
+        stop REAL,
+        tp1 REAL,
+        tp2 REAL,
+        tp3 REAL,
+        start_ms INTEGER,
+        next_ms INTEGER,
+        max_price REAL,
+        min_price REAL,
+        stop_ms INTEGER,
+        tp1_ms INTEGER,
+        tp2_ms INTEGER,
+        tp3_ms INTEGER,
+        best_tp INTEGER DEFAULT 0,
+        mae_pct REAL,
+        mfe_pct REAL,
+        status TEXT DEFAULT 'OPEN'
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_signal_outcomes_status ON signal_outcomes (status)")
+
+    # Предагрегированная статистика сделок (дневная и часовая, по символам).
+    # symbol='*' - агрегат по всему портфелю, нужен для расчета просадки.
+    # cum_max/cum_min - экстремумы накопленного PnL внутри бакета (начиная с 0),
+    # max_dd - максимальная просадка внутри бакета
+    for table in STATS_TABLES.values():
+        c.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+            bucket TEXT,
+            symbol TEXT,
+            trades INTEGER,
+            wins INTEGER,
+            gross_profit REAL,
+            gross_loss REAL,
+            pnl_sum REAL,
+            cum_max REAL,
+            cum_min REAL,
+            max_dd REAL,
+            PRIMARY KEY (bucket, symbol)
+        )''')
+
+    # Существующая база без агрегатов - заполняем их один раз при старте
+    needs_backfill = (c.execute("SELECT 1 FROM trade_stats_daily LIMIT 1").fetchone() is None
+                      and c.execute("SELECT 1 FROM trades LIMIT 1").fetchone() is not None)
+
     conn.commit()
     conn.close()
 
-
+    if needs_backfill:
+        rebuild_trade_stats()
+
+
+STATS_TABLES = {'daily': 'trade_stats_daily', 'hourly': 'trade_stats_hourly'}
+STATS_BUCKET_FORMATS = {'daily': '%Y-%m-%d', 'hourly': '%Y-%m-%d %H:00'}
+STATS_BUCKET_STEPS = {'daily': timedelta(days=1), 'hourly': timedelta(hours=1)}
+
+
+def _update_trade_stats(c, ts, symbol, pnl):
+    """Инкрементально обновить агрегаты статистики одной сделкой"""
+    pnl = float(pnl or 0.0)
+    win = 1 if pnl > 0 else 0
+    for granularity, table in STATS_TABLES.items():
+        bucket = ts.strftime(STATS_BUCKET_FORMATS[granularity])
+        for key in (symbol, '*'):
+            # В UPDATE справа стоят старые значения колонок
+            c.execute(f"""INSERT INTO {table} (bucket,symbol,trades,wins,gross_profit,gross_loss,pnl_sum,cum_max,cum_min,max_dd)
+                          VALUES (?,?,1,?,?,?,?,?,?,?)
+                          ON CONFLICT(bucket, symbol) DO UPDATE SET
+                              trades = trades + 1,
+                              wins = wins + excluded.wins,
+                              gross_profit = gross_profit + excluded.gross_profit,
+                              gross_loss = gross_loss + excluded.gross_loss,
+                              pnl_sum = pnl_sum + excluded.pnl_sum,
+                              cum_max = max(cum_max, pnl_sum + excluded.pnl_sum),
+                              cum_min = min(cum_min, pnl_sum + excluded.pnl_sum),
+                              max_dd = max(max_dd, cum_max - (pnl_sum + excluded.pnl_sum))""",
+                      (bucket, key, win, max(pnl, 0.0), max(-pnl, 0.0), pnl, max(pnl, 0.0), min(pnl, 0.0), max(-pnl, 0.0)))
+
+
+@timed(DB_SECONDS)
 def log_trade(symbol, side, qty, price, pnl=0.0):
     conn = sqlite3.connect(DB)
     c = conn.cursor()
+    ts = datetime.utcnow()
     c.execute("INSERT INTO trades (ts,symbol,side,qty,price,pnl) VALUES (?,?,?,?,?,?)",
-              (datetime.utcnow(), symbol, side, qty, price, pnl))
+              (ts, symbol, side, qty, price, pnl))
+    _update_trade_stats(c, ts, symbol, pnl)
+    conn.commit()
+    conn.close()
+
+
+def rebuild_trade_stats():
+    """Пересчитать агрегаты статистики по всей таблице trades (бэкфилл)"""
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    for table in STATS_TABLES.values():
+        c.execute(f"DELETE FROM {table}")
+    rows = conn.execute("SELECT ts, symbol, pnl FROM trades ORDER BY ts, id")
+    count = 0
+    for ts, symbol, pnl in rows:
+        _update_trade_stats(c, datetime.fromisoformat(str(ts)), symbol, pnl)
+        count += 1
     conn.commit()
     conn.close()
+    return count
 
 
-def log_signal(symbol, timeframe, side, entry, stop, tp1, tp2, tp3):
+@timed(DB_SECONDS)
+def log_signal(symbol, timeframe, side, entry, stop, tp1, tp2, tp3, state='NEW'):
     conn = sqlite3.connect(DB)
     c = conn.cursor()
-    c.execute("INSERT INTO signals (ts,symbol,timeframe,side,entry,stop,tp1,tp2,tp3) VALUES (?,?,?,?,?,?,?,?,?)",
-              (datetime.utcnow(), symbol, timeframe, side, entry, stop, tp1, tp2, tp3))
+    c.execute("INSERT INTO signals (ts,symbol,timeframe,side,entry,stop,tp1,tp2,tp3,state) VALUES (?,?,?,?,?,?,?,?,?,?)",
+              (datetime.utcnow(), symbol, timeframe, side, entry, stop, tp1, tp2, tp3, state))
     conn.commit()
     conn.close()
 
 
+# Подписчики
+@timed(DB_SECONDS)
+def add_subscriber(chat_id):
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute("INSERT OR IGNORE INTO subscribers (chat_id, ts) VALUES (?,?)", (int(chat_id), datetime.utcnow()))
+    added = c.rowcount > 0
+    conn.commit()
+    conn.close()
+    return added
+
+
+@timed(DB_SECONDS)
+def remove_subscriber(chat_id):
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute("DELETE FROM subscribers WHERE chat_id=?", (int(chat_id),))
+    removed = c.rowcount > 0
+    conn.commit()
+    conn.close()
+    return removed
+
+
+@timed(DB_SECONDS)
+def get_subscribers():
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute("SELECT chat_id FROM subscribers")
+    rows = c.fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
 # Функции для работы с позициями
+@timed(DB_SECONDS)
 def open_position(symbol, side, qty, entry_price):
     conn = sqlite3.connect(DB)
     c = conn.cursor()
@@ -80,6 +229,7 @@ def open_position(symbol, side, qty, entry_price):
     conn.close()
 
 
+@timed(DB_SECONDS)
 def close_position(symbol):
     conn = sqlite3.connect(DB)
     c = conn.cursor()
@@ -88,6 +238,7 @@ def close_position(symbol):
     conn.close()
 
 
+@timed(DB_SECONDS)
 def get_open_positions():
     conn = sqlite3.connect(DB)
     c = conn.cursor()
@@ -108,6 +259,7 @@ def get_open_positions():
     return positions
 
 
+@timed(DB_SECONDS)
 def get_portfolio_summary():
     conn = sqlite3.connect(DB)
     c = conn.cursor()
@@ -130,6 +282,7 @@ def get_portfolio_summary():
     }
 
 
+@timed(DB_SECONDS)
 def update_position_price(symbol, current_price, pnl):
     """Обновить текущую цену и PnL для позиции"""
     conn = sqlite3.connect(DB)
@@ -141,6 +294,7 @@ def update_position_price(symbol, current_price, pnl):
 
 
 # ДОБАВЛЯЕМ НЕДОСТАЮЩИЕ ФУНКЦИИ ДЛЯ WEB ИНТЕРФЕЙСА
+@timed(DB_SECONDS)
 def get_trades(limit=100):
     """Получить последние сделки"""
     conn = sqlite3.connect(DB)
@@ -163,6 +317,7 @@ def get_trades(limit=100):
     return trades
 
 
+@timed(DB_SECONDS)
 def get_signals(limit=100):
     """Получить последние сигналы"""
     conn = sqlite3.connect(DB)
@@ -183,36 +338,180 @@ def get_signals(limit=100):
             'stop': r[6],
             'tp1': r[7],
             'tp2': r[8],
-            'tp3': r[9]
+            'tp3': r[9],
+            'state': r[10]
         })
     return signals
 
 
-def get_trading_stats(days=7):
-    """Получить торговую статистику"""
+OUTCOME_COLUMNS = ('signal_id', 'ts', 'symbol', 'side', 'entry', 'stop', 'tp1', 'tp2', 'tp3', 'start_ms', 'next_ms',
+                   'max_price', 'min_price', 'stop_ms', 'tp1_ms', 'tp2_ms', 'tp3_ms', 'best_tp', 'mae_pct', 'mfe_pct',
+                   'status')
+# Поля, которые меняет оценка исхода
+OUTCOME_STATE_COLUMNS = OUTCOME_COLUMNS[10:]
+
+
+@timed(DB_SECONDS)
+def sync_signal_outcomes(interval_ms):
+    """Завести исходы для новых сигналов (EXPIRED в signals - снятие сигнала, а не новые уровни)"""
     conn = sqlite3.connect(DB)
     c = conn.cursor()
+    c.execute("""INSERT INTO signal_outcomes (signal_id, ts, symbol, side, entry, stop, tp1, tp2, tp3, start_ms, next_ms)
+                 SELECT id, ts, symbol, side, entry, stop, tp1, tp2, tp3,
+                        CAST(strftime('%s', ts) AS INTEGER) * 1000 / ? * ?,
+                        CAST(strftime('%s', ts) AS INTEGER) * 1000 / ? * ?
+                 FROM signals
+                 WHERE id > (SELECT COALESCE(MAX(signal_id), 0) FROM signal_outcomes)
+                   AND side IN ('LONG', 'SHORT') AND COALESCE(state, 'NEW') != 'EXPIRED'""",
+              (interval_ms, interval_ms, interval_ms, interval_ms))
+    added = c.rowcount
+    conn.commit()
+    conn.close()
+    return added
 
-    # Общее количество сделок
-    c.execute("SELECT COUNT(*) FROM trades WHERE ts >= datetime('now','-? days')", (days,))
-    total_trades = c.fetchone()[0]
 
-    # Прибыльные сделки
-    c.execute("SELECT COUNT(*) FROM trades WHERE pnl > 0 AND ts >= datetime('now','-? days')", (days,))
-    winning_trades = c.fetchone()[0]
+@timed(DB_SECONDS)
+def get_open_signal_outcomes():
+    """Исходы, которые еще ждут свечей"""
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute(f"SELECT {', '.join(OUTCOME_COLUMNS)} FROM signal_outcomes WHERE status='OPEN' ORDER BY signal_id")
+    rows = c.fetchall()
+    conn.close()
+    return [dict(zip(OUTCOME_COLUMNS, r)) for r in rows]
 
-    # Общий PnL
-    c.execute("SELECT SUM(pnl) FROM trades WHERE ts >= datetime('now','-? days')", (days,))
-    total_pnl = c.fetchone()[0] or 0
 
-    # Win rate
-    win_rate = (winning_trades / total_trades * 100) if total_trades > 0 else 0
+@timed(DB_SECONDS)
+def save_signal_outcomes(outcomes):
+    """Сохранить состояние оценки исходов одной транзакцией"""
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.executemany(f"""UPDATE signal_outcomes SET {', '.join(f'{k}=?' for k in OUTCOME_STATE_COLUMNS)}
+                       WHERE signal_id=?""",
+                  [tuple(o[k] for k in OUTCOME_STATE_COLUMNS) + (o['signal_id'],) for o in outcomes])
+    conn.commit()
+    conn.close()
+
+
+@timed(DB_SECONDS)
+def get_signal_outcome_stats(days=7):
+    """Реальная статистика сигналов за период: доля достижения тейков, стопов, MAE/MFE"""
+    since = datetime.utcnow() - timedelta(days=days)
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute("""SELECT COUNT(*),
+                        SUM(status != 'OPEN'),
+                        SUM(status != 'OPEN' AND best_tp >= 1),
+                        SUM(status != 'OPEN' AND best_tp >= 2),
+                        SUM(status != 'OPEN' AND best_tp >= 3),
+                        SUM(status = 'STOP' AND best_tp = 0),
+                        SUM(status = 'EXPIRED' AND best_tp = 0),
+                        AVG(CASE WHEN status != 'OPEN' THEN mae_pct END),
+                        AVG(CASE WHEN status != 'OPEN' THEN mfe_pct END),
+                        AVG(CASE WHEN status != 'OPEN' THEN (tp1_ms - start_ms) / 60000.0 END),
+                        AVG(CASE WHEN status != 'OPEN' AND best_tp = 0 THEN (stop_ms - start_ms) / 60000.0 END)
+                 FROM signal_outcomes WHERE ts >= ?""", (since,))
+    (total, closed, tp1, tp2, tp3, stopped, expired,
+     mae, mfe, tp1_minutes, stop_minutes) = [v or 0 for v in c.fetchone()]
+    conn.close()
+
+    def rate(count):
+        return (count / closed * 100) if closed else 0
 
+    return {
+        'signals': total,
+        'closed': closed,
+        'open': total - closed,
+        'tp1': tp1,
+        'tp2': tp2,
+        'tp3': tp3,
+        'stopped': stopped,
+        'expired': expired,
+        # Доля закрытых сигналов, дошедших до уровня раньше стопа
+        'hit_rate': rate(tp1),
+        'tp2_rate': rate(tp2),
+        'tp3_rate': rate(tp3),
+        'stop_rate': rate(stopped),
+        'avg_mae_pct': mae,
+        'avg_mfe_pct': mfe,
+        'avg_minutes_to_tp1': tp1_minutes,
+        'avg_minutes_to_stop': stop_minutes
+    }
+
+
+@timed(DB_SECONDS)
+def get_stats_buckets(days=7, granularity='daily', symbol='*'):
+    """Получить бакеты статистики за период (symbol='*' - весь портфель).
+
+    Период - days суток целыми бакетами, включая текущий: для daily и days=7
+    это сегодня и 6 предыдущих дней, а не 8 календарных дат.
+    """
+    table = STATS_TABLES[granularity]
+    fmt = STATS_BUCKET_FORMATS[granularity]
+    current = datetime.strptime(datetime.utcnow().strftime(fmt), fmt)
+    since = (current - (timedelta(days=days) - STATS_BUCKET_STEPS[granularity])).strftime(fmt)
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute(f"""SELECT bucket, trades, wins, gross_profit, gross_loss, pnl_sum, cum_max, cum_min, max_dd
+                  FROM {table} WHERE symbol=? AND bucket >= ? ORDER BY bucket""", (symbol, since))
+    rows = c.fetchall()
     conn.close()
 
+    return [{
+        'bucket': r[0],
+        'trades': r[1],
+        'wins': r[2],
+        'gross_profit': r[3],
+        'gross_loss': r[4],
+        'pnl': r[5],
+        'cum_max': r[6],
+        'cum_min': r[7],
+        'max_dd': r[8]
+    } for r in rows]
+
+
+def _max_drawdown(buckets):
+    """Максимальная просадка по последовательности бакетов"""
+    equity = peak = max_dd = 0.0
+    for b in buckets:
+        max_dd = max(max_dd, b['max_dd'], peak - (equity + b['cum_min']))
+        peak = max(peak, equity + b['cum_max'])
+        equity += b['pnl']
+    return max_dd
+
+
+@timed(DB_SECONDS)
+def get_trading_stats(days=7):
+    """Получить торговую статистику"""
+    buckets = get_stats_buckets(days)
+
+    total_trades = sum(b['trades'] for b in buckets)
+    winning_trades = sum(b['wins'] for b in buckets)
+    gross_profit = sum(b['gross_profit'] for b in buckets)
+    gross_loss = sum(b['gross_loss'] for b in buckets)
+    total_pnl = sum(b['pnl'] for b in buckets)
+
+    # Win rate
+    win_rate = (winning_trades / total_trades * 100) if total_trades > 0 else 0
+
     return {
         'total_trades': total_trades,
         'winning_trades': winning_trades,
         'win_rate': win_rate,
-        'total_pnl': total_pnl
-    }
\ No newline at end of file
+        'total_pnl': total_pnl,
+        'gross_profit': gross_profit,
+        'gross_loss': gross_loss,
+        'profit_factor': (gross_profit / gross_loss) if gross_loss > 0 else None,
+        'max_drawdown': _max_drawdown(buckets)
+    }
+
+
+if __name__ == '__main__':
+    import sys
+
+    # python db.py backfill - пересчитать статистику для существующей базы
+    if sys.argv[1:] == ['backfill']:
+        init_db()
+        print(f"Trade stats rebuilt from {rebuild_trade_stats()} trades")
+    else:
+        print("Usage: python db.py backfill")
\ No newline at end of file
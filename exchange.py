@@ -1,8 +1,8 @@
 import os
-from binance.client import Client
 from dataclasses import dataclass
 import logging
 from dotenv import load_dotenv
+from metrics import ORDER_SECONDS, timed
 
 load_dotenv()
 
@@ -14,19 +14,35 @@ DRY_RUN = os.getenv('DRY_RUN', 'true').lower() == 'true'
 
 if not API_KEY or not API_SECRET:
     logger.warning("Binance API keys not found. Using dry run mode only.")
-    client = None
-else:
-    client = Client(API_KEY, API_SECRET)
+
+# Клиент создается лениво: импорт python-binance и конструктор Client
+# (он сразу ходит в сеть) не должны задерживать старт бота
+_client = None
+
+
+def get_client():
+    """Получить клиент Binance (создается при первом обращении)"""
+    global _client
+    if _client is None and API_KEY and API_SECRET:
+        from binance.client import Client
+        _client = Client(API_KEY, API_SECRET)
+    return _client
+
 
 @dataclass
 class OrderResult:
     success: bool
     info: dict
 
+@timed(ORDER_SECONDS)
 async def place_market_order(symbol: str, side: str, quantity: float) -> OrderResult:
     symbol = symbol.upper()
     side = side.upper()
-    if DRY_RUN or client is None:
+    try:
+        client = None if DRY_RUN else get_client()
+    except Exception as e:
+        return OrderResult(False, {'error': str(e)})
+    if client is None:
         fake = {'symbol': symbol, 'side': side, 'origQty': str(quantity), 'status': 'FILLED', 'note': 'dry_run'}
         return OrderResult(True, fake)
     try:
@@ -36,9 +52,14 @@ async def place_market_order(symbol: str, side: str, quantity: float) -> OrderRe
         return OrderResult(False, {'error': str(e)})
 
 # ДОБАВЛЯЕМ ФУНКЦИЮ ДЛЯ ЗАКРЫТИЯ ПОЗИЦИЙ
+@timed(ORDER_SECONDS)
 async def close_position_order(symbol: str) -> OrderResult:
     symbol = symbol.upper()
-    if DRY_RUN or client is None:
+    try:
+        client = None if DRY_RUN else get_client()
+    except Exception as e:
+        return OrderResult(False, {'error': str(e)})
+    if client is None:
         fake = {'symbol': symbol, 'side': 'CLOSE', 'status': 'FILLED', 'note': 'dry_run_close'}
         return OrderResult(True, fake)
     try:
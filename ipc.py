@@ -0,0 +1,81 @@
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+from typing import Tuple
+
+# Сообщения - JSON с 4-байтным префиксом длины (big-endian)
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+# Общий секрет: клиент присылает его в hello, без него TCP слушает только loopback
+IPC_SECRET = os.getenv('IPC_SECRET', '')
+
+
+def parse_address(address: str) -> Tuple[str, ...]:
+    """'unix:/path/sock' или '/path/sock' -> Unix-сокет, 'host:port' -> TCP"""
+    if address.startswith('unix:'):
+        return ('unix', address[5:])
+    if address.startswith('/') or address.startswith('.'):
+        return ('unix', address)
+    host, _, port = address.rpartition(':')
+    return ('tcp', host or '127.0.0.1', int(port))
+
+
+def _is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def authorized(hello: dict, secret: str = IPC_SECRET) -> bool:
+    """Проверить секрет из hello (без IPC_SECRET пускаем всех - сервер тогда только локальный)"""
+    if not secret:
+        return True
+    return hmac.compare_digest(str(hello.get('secret', '')).encode(), secret.encode())
+
+
+def hello(**fields) -> dict:
+    """Первое сообщение клиента: поля + секрет, если он задан"""
+    message = {'type': 'hello', 'pid': os.getpid(), **fields}
+    if IPC_SECRET:
+        message['secret'] = IPC_SECRET
+    return message
+
+
+async def start_server(handler, address: str):
+    kind, *where = parse_address(address)
+    if kind == 'tcp' and not IPC_SECRET and not _is_loopback(where[0]):
+        # Любой, кто достучится до порта, иначе подключится как воркер или клиент
+        raise ValueError(f"listening on {where[0]} requires IPC_SECRET, or use a loopback address")
+    if kind == 'unix':
+        path = where[0]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Сокет мог остаться от предыдущего запуска
+        if os.path.exists(path):
+            os.remove(path)
+        return await asyncio.start_unix_server(handler, path=path)
+    return await asyncio.start_server(handler, host=where[0], port=where[1])
+
+
+async def open_connection(address: str):
+    kind, *where = parse_address(address)
+    if kind == 'unix':
+        return await asyncio.open_unix_connection(where[0])
+    return await asyncio.open_connection(where[0], where[1])
+
+
+async def send_message(writer: asyncio.StreamWriter, message: dict):
+    data = json.dumps(message, separators=(',', ':')).encode()
+    writer.write(len(data).to_bytes(4, 'big') + data)
+    await writer.drain()
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict:
+    """Прочитать одно сообщение; IncompleteReadError при закрытии соединения"""
+    size = int.from_bytes(await reader.readexactly(4), 'big')
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError(f"IPC message too large: {size} bytes")
+    return json.loads(await reader.readexactly(size))
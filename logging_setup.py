@@ -0,0 +1,124 @@
+"""Логирование без блокировки event loop.
+
+Обработчики логгеров только кладут запись в очередь (QueueHandler),
+форматирование и запись в консоль/файл выполняет поток QueueListener.
+
+Переменные окружения:
+    LOG_LEVEL       уровень (INFO)
+    LOG_FORMAT      text | json (text)
+    LOG_FILE        путь к файлу с ротацией по размеру (по умолчанию не пишется)
+    LOG_MAX_BYTES   размер файла до ротации (10 МБ)
+    LOG_BACKUPS     число архивных файлов (5)
+    LOG_RATE_BURST  сколько записей DEBUG..WARNING из одного места кода за LOG_RATE_PERIOD секунд (20 за 60)
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+JSON_FORMAT = '%(asctime)s %(name)s %(levelname)s %(message)s'
+
+# Логгеры библиотек, пишущие INFO на каждый запрос
+NOISY_LOGGERS = ('httpx', 'httpcore', 'apscheduler.executors.default', 'aiogram.event')
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Ограничение частоты записей из одного места кода (logger + строка).
+
+    Первые burst записей за period секунд проходят, остальные отбрасываются;
+    число отброшенных дописывается к первой записи следующего окна.
+    Ограничиваются только записи не выше max_level (WARNING): ERROR и CRITICAL
+    проходят всегда.
+    """
+
+    def __init__(self, burst: int = 20, period: float = 60.0, max_level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.max_level = max_level
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.period:
+                if suppressed:
+                    record.msg = f"{record.msg} (suppressed {suppressed} similar messages)"
+                started, count, suppressed = now, 0, 0
+            if count >= self.burst:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+            self._windows[key] = (started, count + 1, suppressed)
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке (очередь в том же процессе)"""
+
+    def prepare(self, record):
+        return record
+
+
+def _json_formatter():
+    try:
+        from pythonjsonlogger.json import JsonFormatter
+    except ImportError:  # python-json-logger < 3
+        from pythonjsonlogger.jsonlogger import JsonFormatter
+    return JsonFormatter(JSON_FORMAT, rename_fields={'asctime': 'ts', 'levelname': 'level', 'name': 'logger'})
+
+
+def setup_logging(level: str = None, fmt: str = None, log_file: str = None):
+    """Настроить корневой логгер: QueueHandler -> поток QueueListener -> консоль/файл"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    fmt = (fmt or os.getenv('LOG_FORMAT', 'text')).lower()
+    log_file = log_file or os.getenv('LOG_FILE')
+    formatter = _json_formatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+            backupCount=int(os.getenv('LOG_BACKUPS', '5')), encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(int(os.getenv('LOG_RATE_BURST', '20')),
+                                            float(os.getenv('LOG_RATE_PERIOD', '60'))))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописать оставшиеся записи и остановить поток логирования"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,128 @@
+import functools
+import logging
+import math
+import time
+from datetime import datetime
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from apscheduler.triggers.base import BaseTrigger
+from data import INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+
+class CandleCloseTrigger(BaseTrigger):
+    """Триггер APScheduler: срабатывает через delay_ms после закрытия каждой свечи таймфрейма"""
+    __slots__ = ('timeframe', 'step', 'delay')
+
+    def __init__(self, timeframe: str = '5m', delay_ms: int = 300):
+        self.timeframe = timeframe
+        self.step = INTERVAL_MS[timeframe] / 1000
+        self.delay = delay_ms / 1000
+
+    def last_fire_ts(self, ts: float) -> float:
+        """Плановое время последнего срабатывания не позже ts"""
+        return math.floor((ts - self.delay) / self.step) * self.step + self.delay
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        # Следующая граница строго после предыдущего срабатывания и не раньше now
+        base = now.timestamp()
+        if previous_fire_time is not None:
+            base = max(base, previous_fire_time.timestamp() + 0.001)
+        fire_ts = math.ceil((base - self.delay) / self.step) * self.step + self.delay
+        return datetime.fromtimestamp(fire_ts, tz=now.tzinfo)
+
+    def __str__(self):
+        return f"candle_close[{self.timeframe}+{self.delay * 1000:.0f}ms]"
+
+    def __repr__(self):
+        return f"<CandleCloseTrigger (timeframe='{self.timeframe}', delay_ms={self.delay * 1000:.0f})>"
+
+
+class JobStats:
+    """Статистика задачи: дрейф запуска относительно закрытия свечи и длительность"""
+
+    def __init__(self, timeframe: str):
+        self.timeframe = timeframe
+        self.runs = 0
+        self.skipped = 0
+        self.missed = 0
+        self.running = False
+        self.last_drift = 0.0
+        self.max_drift = 0.0
+        self.total_drift = 0.0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_run_at = None
+
+    def as_dict(self) -> dict:
+        return {
+            'timeframe': self.timeframe,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'missed': self.missed,
+            'running': self.running,
+            'last_drift_ms': round(self.last_drift * 1000, 1),
+            'max_drift_ms': round(self.max_drift * 1000, 1),
+            'avg_drift_ms': round(self.total_drift / self.runs * 1000, 1) if self.runs else 0.0,
+            'last_duration_sec': round(self.last_duration, 3),
+            'max_duration_sec': round(self.max_duration, 3),
+            'avg_duration_sec': round(self.total_duration / self.runs, 3) if self.runs else 0.0,
+            'last_run_at': self.last_run_at,
+        }
+
+
+JOB_STATS = {}
+
+
+def schedule_on_candle_close(scheduler, func, timeframe: str = '5m', delay_ms: int = 300, job_id: str = None):
+    """Зарегистрировать корутину на закрытие свечей timeframe.
+
+    Перекрывающиеся запуски пропускаются (max_instances=1), пропущенные
+    за время простоя схлопываются в один (coalesce).
+    """
+    job_id = job_id or func.__name__
+    trigger = CandleCloseTrigger(timeframe, delay_ms)
+    stats = JOB_STATS[job_id] = JobStats(timeframe)
+
+    @functools.wraps(func)
+    async def run():
+        started = time.time()
+        stats.running = True
+        stats.last_drift = started - trigger.last_fire_ts(started)
+        try:
+            return await func()
+        finally:
+            stats.running = False
+            stats.last_duration = time.time() - started
+            stats.runs += 1
+            stats.total_drift += stats.last_drift
+            stats.max_drift = max(stats.max_drift, stats.last_drift)
+            stats.total_duration += stats.last_duration
+            stats.max_duration = max(stats.max_duration, stats.last_duration)
+            stats.last_run_at = datetime.utcfromtimestamp(started).isoformat()
+            # Скан дольше таймфрейма - следующий запуск будет пропущен
+            if stats.last_duration > trigger.step:
+                logger.warning(f"Job {job_id} took {stats.last_duration:.1f}s, longer than {timeframe}")
+
+    return scheduler.add_job(run, trigger, id=job_id, max_instances=1, coalesce=True,
+                             misfire_grace_time=int(trigger.step // 2) or 1, replace_existing=True)
+
+
+def _on_job_event(event):
+    stats = JOB_STATS.get(event.job_id)
+    if stats is None:
+        return
+    if event.code == EVENT_JOB_MAX_INSTANCES:
+        stats.skipped += 1
+        logger.warning(f"Job {event.job_id} skipped: previous run is still in progress")
+    elif event.code == EVENT_JOB_MISSED:
+        stats.missed += 1
+
+
+def install_listeners(scheduler):
+    scheduler.add_listener(_on_job_event, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+
+
+def get_job_stats() -> dict:
+    return {job_id: stats.as_dict() for job_id, stats in JOB_STATS.items()}
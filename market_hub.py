@@ -0,0 +1,325 @@
+"""Хаб рыночных данных для нескольких экземпляров бота на одной машине.
+
+Хаб - отдельный процесс с единственным подключением к бирже: кэш закрытых
+свечей (CandleCache) и 24h-тикеры. Боты подключаются по Unix-сокету
+(протокол ipc) и вместо REST запрашивают у хаба свечи и тикеры; на каждом
+закрытии свечи хаб сам догружает новые бары по запрошенным сериям и
+рассылает их подписчикам, поэтому к скану кэш бота уже свежий. Одинаковые
+запросы разных ботов хаб обслуживает одним обращением к бирже - новый
+экземпляр почти не добавляет нагрузки.
+
+    python market_hub.py serve --listen unix:data/market_hub.sock
+
+В боте: MARKET_HUB_ADDRESS=unix:data/market_hub.sock. Если хаб недоступен,
+бот ходит на биржу напрямую. Хаб на TCP-адресе не на loopback требует
+IPC_SECRET (тот же, что у ботов).
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple, TYPE_CHECKING
+import numpy as np
+import ipc
+from data import INTERVAL_MS
+from logging_setup import setup_logging
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MARKET_HUB_ADDRESS = os.getenv('MARKET_HUB_ADDRESS')  # например unix:data/market_hub.sock
+HUB_TIMEOUT = float(os.getenv('MARKET_HUB_TIMEOUT', '30'))
+HUB_TICKER_TTL = float(os.getenv('MARKET_HUB_TICKER_TTL', '5'))
+HUB_CLOSE_DELAY_MS = int(os.getenv('CANDLE_CLOSE_DELAY_MS', '300'))
+HUB_PUSH_BARS = 10  # сколько последних баров хаб догружает на закрытии свечи
+HUB_CONCURRENCY = 10
+
+
+class HubError(Exception):
+    """Ошибка, которую хаб вернул на запрос"""
+
+
+def encode_frame(df: 'pd.DataFrame') -> Dict[str, list]:
+    """DataFrame свечей -> колонки для JSON (open_time - мс)"""
+    columns = {col: df[col].tolist() for col in df.columns if col != 'open_time'}
+    return {'open_time': df['open_time'].to_numpy(dtype='datetime64[ms]').astype('int64').tolist(), **columns}
+
+
+def decode_frame(columns: Dict[str, list]) -> 'pd.DataFrame':
+    import pandas as pd
+    df = pd.DataFrame({col: np.asarray(values, dtype=np.float64) for col, values in columns.items()
+                       if col != 'open_time'})
+    df.insert(0, 'open_time', pd.to_datetime(np.asarray(columns['open_time'], dtype=np.int64), unit='ms', utc=True))
+    return df
+
+
+class MarketHub:
+    """Сервер хаба: свечи и тикеры из одного кэша, рассылка новых баров подписчикам"""
+
+    def __init__(self, address: str = MARKET_HUB_ADDRESS):
+        from market_scanner import MarketScanner
+        self.address = address
+        # Сканер хаба ничего не сканирует - нужны его кэш свечей и запрос тикеров
+        self.scanner = MarketScanner()
+        self.cache = self.scanner.cache
+        self._tickers: Tuple[float, List[dict]] = (0.0, [])
+        self._tickers_lock = asyncio.Lock()
+        self._subscribers: Dict[Tuple[str, str], Set[asyncio.StreamWriter]] = defaultdict(set)
+        self._last_pushed: Dict[Tuple[str, str], int] = {}
+        # Одинаковые одновременные запросы свечей ждут одну загрузку (кэш тут не поможет, если
+        # биржа еще не отдала закрывшийся бар и серия выглядит устаревшей)
+        self._inflight: Dict[Tuple[str, str, int], asyncio.Future] = {}
+        self._send_locks: Dict[asyncio.StreamWriter, asyncio.Lock] = {}
+        self._semaphore = asyncio.Semaphore(HUB_CONCURRENCY)
+        self._server = None
+        self.requests = 0
+
+    async def start(self):
+        self._server = await ipc.start_server(self._handle_client, self.address)
+        logger.info(f"Market hub listening on {self.address}")
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def tickers(self) -> List[dict]:
+        """24h-тикеры; одновременные и частые запросы ботов - одно обращение к бирже"""
+        async with self._tickers_lock:
+            fetched_at, tickers = self._tickers
+            if time.monotonic() - fetched_at > HUB_TICKER_TTL:
+                tickers = await self.scanner.fetch_tickers()
+                self._tickers = (time.monotonic(), tickers)
+            return tickers
+
+    async def klines(self, writer: asyncio.StreamWriter, symbol: str, interval: str, limit: int) -> Dict[str, list]:
+        key = (symbol.upper(), interval)
+        flight = self._inflight.get((*key, limit))
+        if flight is None:
+            flight = self._inflight[(*key, limit)] = asyncio.ensure_future(self._load(key, limit))
+            flight.add_done_callback(lambda _, k=(*key, limit): self._inflight.pop(k, None))
+        # shield: отключившийся клиент не отменяет загрузку для остальных
+        df = await asyncio.shield(flight)
+        if interval in INTERVAL_MS and not df.empty:
+            # Запросивший подписывается на новые бары серии
+            self._subscribers[key].add(writer)
+            self._last_pushed.setdefault(key, int(df['open_time'].iloc[-1].value // 1_000_000))
+        return encode_frame(df)
+
+    async def _load(self, key: Tuple[str, str], limit: int) -> 'pd.DataFrame':
+        async with self._semaphore:
+            return await self.cache.get(key[0], key[1], limit)
+
+    async def _send(self, writer: asyncio.StreamWriter, message: dict):
+        async with self._send_locks.setdefault(writer, asyncio.Lock()):
+            await ipc.send_message(writer, message)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = '?'
+        tasks = set()
+        try:
+            hello = await ipc.read_message(reader)
+            if not ipc.authorized(hello):
+                logger.warning(f"Rejected market hub client {hello.get('client')!r}: bad secret")
+                return
+            client = hello.get('client', '?')
+            logger.info(f"Market hub client {client} connected (pid {hello.get('pid')})")
+            while True:
+                message = await ipc.read_message(reader)
+                task = asyncio.create_task(self._answer(writer, message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.info(f"Market hub client {client} disconnected")
+        finally:
+            for task in tasks:
+                task.cancel()
+            for subscribers in self._subscribers.values():
+                subscribers.discard(writer)
+            self._send_locks.pop(writer, None)
+            writer.close()
+
+    async def _answer(self, writer: asyncio.StreamWriter, message: dict):
+        self.requests += 1
+        try:
+            if message['type'] == 'tickers':
+                data = await self.tickers()
+            elif message['type'] == 'klines':
+                data = await self.klines(writer, message['symbol'], message['interval'], int(message['limit']))
+            else:
+                raise ValueError(f"unknown request {message['type']}")
+            reply = {'type': 'result', 'id': message['id'], 'data': data}
+        except Exception as e:
+            logger.error(f"Market hub request {message.get('type')} failed: {e}")
+            reply = {'type': 'error', 'id': message.get('id'), 'error': str(e)}
+        try:
+            await self._send(writer, reply)
+        except ConnectionError:
+            pass
+
+    async def publish(self, now_ms: int = None) -> int:
+        """Догрузить закрывшиеся бары подписанных серий и разослать их подписчикам"""
+        now_ms = now_ms or int(time.time() * 1000)
+        due = [key for key, subscribers in self._subscribers.items() if subscribers
+               and now_ms // INTERVAL_MS[key[1]] * INTERVAL_MS[key[1]] - INTERVAL_MS[key[1]] > self._last_pushed[key]]
+        sent = await asyncio.gather(*(self._publish_series(key) for key in due), return_exceptions=True)
+        for key, result in zip(due, sent):
+            if isinstance(result, Exception):
+                logger.warning(f"Market hub failed to refresh {key[0]} {key[1]}: {result}")
+        return sum(r for r in sent if isinstance(r, int))
+
+    async def _publish_series(self, key: Tuple[str, str]) -> int:
+        async with self._semaphore:
+            df = await self.cache.get(key[0], key[1], HUB_PUSH_BARS)
+        opens = df['open_time'].to_numpy(dtype='datetime64[ms]').astype('int64')
+        fresh = df[opens > self._last_pushed[key]]
+        if fresh.empty:
+            return 0
+        self._last_pushed[key] = int(opens[-1])
+        message = {'type': 'candles', 'symbol': key[0], 'interval': key[1], 'bars': encode_frame(fresh)}
+        results = await asyncio.gather(*(self._send(w, message) for w in list(self._subscribers[key])),
+                                       return_exceptions=True)
+        return sum(1 for r in results if not isinstance(r, Exception))
+
+
+class HubClient:
+    """Подключение бота к хабу: запросы свечей и тикеров, прием рассылки новых баров в CandleCache"""
+
+    def __init__(self, address: str = MARKET_HUB_ADDRESS, name: str = None, timeout: float = HUB_TIMEOUT):
+        self.address = address
+        self.name = name or f"bot-{os.getpid()}"
+        self.timeout = timeout
+        # CandleCache, в который дописываются бары из рассылки
+        self.cache = None
+        self._writer = None
+        self._reader_task = None
+        # Рассылка применяется отдельной задачей: append ждет блокировку серии, которую держит
+        # CandleCache.get, пока ждет ответ хаба - ответ должен дочитываться, не дожидаясь append
+        self._pushes: asyncio.Queue = asyncio.Queue()
+        self._push_task = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._send_lock = asyncio.Lock()
+        self.pushed_bars = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _ensure_connected(self):
+        async with self._connect_lock:
+            if self.connected:
+                return
+            reader, writer = await asyncio.wait_for(ipc.open_connection(self.address), self.timeout)
+            await ipc.send_message(writer, ipc.hello(client=self.name))
+            self._writer = writer
+            self._reader_task = asyncio.create_task(self._read(reader, writer))
+            if self._push_task is None:
+                self._push_task = asyncio.create_task(self._apply_pushes())
+            logger.info(f"Connected to market hub at {self.address}")
+
+    async def _read(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                message = await ipc.read_message(reader)
+                if message['type'] == 'candles':
+                    self._pushes.put_nowait(message)
+                    continue
+                future = self._pending.get(message['id'])
+                if future is None or future.done():
+                    continue
+                if message['type'] == 'error':
+                    future.set_exception(HubError(message['error']))
+                else:
+                    future.set_result(message['data'])
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.warning(f"Market hub connection lost: {e!r}")
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("market hub connection lost"))
+
+    async def _apply_pushes(self):
+        while True:
+            message = await self._pushes.get()
+            if self.cache is None:
+                continue
+            try:
+                bars = decode_frame(message['bars'])
+                self.pushed_bars += await self.cache.append(message['symbol'], message['interval'], bars)
+            except Exception as e:
+                logger.warning(f"Market hub push for {message['symbol']} {message['interval']} failed: {e}")
+
+    async def request(self, message: dict):
+        await self._ensure_connected()
+        message['id'] = request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            async with self._send_lock:
+                await ipc.send_message(self._writer, message)
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def tickers(self) -> List[dict]:
+        return await self.request({'type': 'tickers'})
+
+    async def klines(self, symbol: str, interval: str, limit: int) -> 'pd.DataFrame':
+        """Последние limit закрытых свечей (хаб подписывает на новые бары серии)"""
+        return decode_frame(await self.request({'type': 'klines', 'symbol': symbol, 'interval': interval,
+                                                'limit': limit}))
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._push_task is not None:
+            self._push_task.cancel()
+        await asyncio.gather(*(t for t in (self._reader_task, self._push_task) if t is not None),
+                             return_exceptions=True)
+        self._push_task = None
+
+
+async def run_hub(address: str):
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from market_clock import schedule_on_candle_close
+
+    hub = MarketHub(address)
+    await hub.start()
+
+    async def publish_job():
+        try:
+            sent = await hub.publish()
+            if sent:
+                logger.info(f"Market hub published new bars to {sent} subscriptions")
+        except Exception as e:
+            logger.error(f"Market hub publish error: {e}")
+
+    scheduler = AsyncIOScheduler()
+    # Серии разных таймфреймов: проверяем на закрытии каждой минутной свечи, какие из них закрылись
+    schedule_on_candle_close(scheduler, publish_job, '1m', HUB_CLOSE_DELAY_MS)
+    scheduler.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Market data hub')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve_parser = sub.add_parser('serve')
+    serve_parser.add_argument('--listen', default=MARKET_HUB_ADDRESS or 'unix:data/market_hub.sock',
+                              help='адрес для ботов (unix:/path или host:port)')
+    args = parser.parse_args()
+    setup_logging()
+    try:
+        asyncio.run(run_hub(args.listen))
+    except KeyboardInterrupt:
+        pass
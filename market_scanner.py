@@ -1,17 +1,45 @@
 import asyncio
+import importlib
 import logging
+import os
+import time
 import httpx
-from typing import List, Dict
-import pandas as pd
-from data import fetch_klines
-from strategies import generate_signal_from_dfs
+from typing import List, Dict, Optional
+from correlation import RollingCorrelation, select_diversified
+from data import BINANCE_REST, INTERVAL_MS
+from metrics import SCANS_TOTAL, SCAN_SECONDS, SIGNALS_TOTAL, observe_binance_response
+from order_book import MAX_SLIPPAGE_BPS, SYNC_TIMEOUT
+from prescreen import TickerPrescreener
+from tracing import Trace
 
 logger = logging.getLogger(__name__)
 
 
+# Монеты по умолчанию, если биржа недоступна
+DEFAULT_SYMBOLS = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'SOLUSDT', 'XRPUSDT', 'ADAUSDT',
+                   'AVAXUSDT', 'DOTUSDT', 'LINKUSDT', 'MATICUSDT', 'DOGEUSDT', 'LTCUSDT']
+
+
 class MarketScanner:
-    def __init__(self):
+    def __init__(self, universe_size: int = None, prescreen_keep: int = None):
+        # candle_cache тянет pandas - импортируем при создании сканера, а не при импорте модуля
+        from candle_cache import CandleCache
         self.top_symbols = []
+        self.cache = CandleCache()
+        # Вселенная скана (по объему) и сколько из нее доходит до полного анализа
+        self.universe_size = universe_size or int(os.getenv('SCAN_UNIVERSE_SIZE', '300'))
+        self.prescreen_keep = prescreen_keep or int(os.getenv('PRESCREEN_KEEP', '30'))
+        self.prescreener = TickerPrescreener()
+        # Корреляции доходностей вселенной по ценам тикеров - для разнообразия итоговых сигналов
+        self.correlation = RollingCorrelation(capacity=self.universe_size + 100)
+        # ScanCoordinator: если задан, символы сканируют процессы-воркеры
+        self.cluster = None
+        # OrderBookManager: если задан, сигналы ранжируются с учетом стакана
+        self.order_books = None
+        # TradeFlow: если задан, признаки потока сделок берутся из aggTrade, иначе из свечей
+        self.trade_flow = None
+        # HubClient: если задан, тикеры и свечи берутся у общего хаба рыночных данных
+        self.hub = None
         # Черный список сомнительных монет
         self.blacklist = {
             'PUMPUSDT', 'BLUAIUSDT', 'COAIUSDT', 'LIGHTUSDT', 'ASTERUSDT',
@@ -19,75 +47,127 @@ class MarketScanner:
             'AIAUSDT', 'ALPHAUSDT', 'ZECUSDT', 'TAOUSDT', 'HYPEUSDT'
         }
 
+    def use_hub(self, hub):
+        """Брать тикеры и свечи у хаба рыночных данных; новые бары из его рассылки идут в кэш"""
+        self.hub = hub
+        self.cache.hub = hub
+        hub.cache = self.cache
+
+    async def fetch_tickers(self) -> List[dict]:
+        """24h-тикеры всех фьючерсов одним запросом"""
+        if self.hub is not None:
+            try:
+                return await self.hub.tickers()
+            except Exception as e:
+                logger.warning(f"Market hub tickers failed, using exchange: {e!r}")
+        url = f"{BINANCE_REST}/fapi/v1/ticker/24hr"
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.get(url)
+            observe_binance_response('ticker_24hr', response)
+            response.raise_for_status()
+            return response.json()
+
+    def liquid_tickers(self, tickers: List[dict], limit: int) -> List[dict]:
+        """Ликвидные USDT-пары без сомнительных монет, по убыванию объема"""
+        def is_valid_symbol(symbol):
+            if not symbol.endswith('USDT'):
+                return False
+            # Исключаем черный список
+            if symbol in self.blacklist:
+                return False
+            # Исключаем символы с не-ASCII
+            if not symbol.replace('USDT', '').isalnum():
+                return False
+            # Исключаем слишком короткие/длинные
+            if len(symbol) < 7 or len(symbol) > 12:
+                return False
+            return True
+
+        usdt_pairs = [item for item in tickers if is_valid_symbol(item['symbol'])]
+
+        # Сортируем по объему и берем только ликвидные
+        sorted_pairs = sorted(usdt_pairs, key=lambda x: float(x['quoteVolume']), reverse=True)
+
+        # Берем только монеты с достаточным объемом
+        min_volume = 10000000  # 10M USDT минимальный объем
+        liquid_pairs = [pair for pair in sorted_pairs if float(pair['quoteVolume']) > min_volume]
+        return liquid_pairs[:limit]
+
     async def get_top_volume_symbols(self, limit: int = 25) -> List[str]:
         """Получить топ монет по объему, исключая сомнительные"""
         try:
-            url = "https://fapi.binance.com/fapi/v1/ticker/24hr"
-            async with httpx.AsyncClient(timeout=30) as client:
-                response = await client.get(url)
-                data = response.json()
-
-            def is_valid_symbol(symbol):
-                if not symbol.endswith('USDT'):
-                    return False
-                # Исключаем черный список
-                if symbol in self.blacklist:
-                    return False
-                # Исключаем символы с не-ASCII
-                if not symbol.replace('USDT', '').isalnum():
-                    return False
-                # Исключаем слишком короткие/длинные
-                if len(symbol) < 7 or len(symbol) > 12:
-                    return False
-                return True
-
-            usdt_pairs = [item for item in data if is_valid_symbol(item['symbol'])]
-
-            # Сортируем по объему и берем только ликвидные
-            sorted_pairs = sorted(usdt_pairs, key=lambda x: float(x['quoteVolume']), reverse=True)
-
-            # Берем только монеты с достаточным объемом
-            min_volume = 10000000  # 10M USDT минимальный объем
-            liquid_pairs = [pair for pair in sorted_pairs if float(pair['quoteVolume']) > min_volume]
-
-            top_symbols = [pair['symbol'] for pair in liquid_pairs[:limit]]
+            top_symbols = [pair['symbol'] for pair in self.liquid_tickers(await self.fetch_tickers(), limit)]
             logger.info(f"Found {len(top_symbols)} valid liquid symbols")
             return top_symbols
 
         except Exception as e:
             logger.error(f"Error fetching top symbols: {e}")
             # Возвращаем только качественные монеты по умолчанию
-            return ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'SOLUSDT', 'XRPUSDT', 'ADAUSDT',
-                    'AVAXUSDT', 'DOTUSDT', 'LINKUSDT', 'MATICUSDT', 'DOGEUSDT', 'LTCUSDT']
+            return list(DEFAULT_SYMBOLS)
 
-    async def scan_symbols(self, symbols: List[str]) -> Dict[str, Dict]:
-        """Сканировать список символов на наличие КАЧЕСТВЕННЫХ сигналов"""
+    async def get_candidates(self) -> List[str]:
+        """Первый этап: предварительный отбор по 24h-тикерам всей вселенной"""
+        try:
+            universe = self.liquid_tickers(await self.fetch_tickers(), self.universe_size)
+        except Exception as e:
+            logger.error(f"Error fetching tickers for prescreen: {e}")
+            return self.top_symbols or list(DEFAULT_SYMBOLS)
+
+        self.top_symbols = [t['symbol'] for t in universe]
+        try:
+            self.correlation.update({t['symbol']: float(t['lastPrice']) for t in universe})
+        except Exception as e:
+            logger.error(f"Error updating correlation matrix: {e}")
+        return self.prescreener.select(universe, self.prescreen_keep)
+
+    async def scan_symbols(self, symbols: List[str], on_signal=None) -> Dict[str, Dict]:
+        """Сканировать список символов на наличие КАЧЕСТВЕННЫХ сигналов.
+
+        on_signal(symbol, data) - корутина, вызывается сразу для каждого найденного сигнала
+        """
+        # pandas_ta тяжелый - загружаем стратегию при первом сканировании
+        from strategies import generate_signal_from_dfs
         signals = {}
 
         for symbol in symbols:
             try:
+                fetch_start = time.time_ns()
                 # Получаем данные для разных таймфреймов
-                df_5m = await fetch_klines(symbol, '5m', limit=100)
-                df_1h = await fetch_klines(symbol, '1h', limit=100)
+                df_5m = await self.cache.get(symbol, '5m', limit=100)
+                # 1h строится из 5m-свечей, отдельный запрос только при первом обращении
+                df_1h = await self.cache.get_resampled(symbol, '1h', base='5m', limit=100)
 
                 if df_5m.empty or df_1h.empty:
                     continue
 
                 # Генерируем сигнал
-                signal = generate_signal_from_dfs(df_5m, df_1h)
+                fetch_end = time.time_ns()
+                flow = self.flow_features(symbol, df_5m)
+                signal = generate_signal_from_dfs(df_5m, df_1h, symbol=symbol, higher_timeframe='1h', flow=flow)
+                generate_end = time.time_ns()
 
                 # ФИЛЬТРУЕМ: берем только сигналы с высокой уверенностью
                 if signal.side != 'NONE' and signal.confidence > 0.6:
+                    # Трасса задержки сигнала: отсчет от закрытия последней 5m-свечи по часам биржи
+                    close_ns = df_5m['open_time'].iloc[-1].value + INTERVAL_MS['5m'] * 1_000_000
+                    trace = Trace(f"signal {symbol}", origin_ns=close_ns, symbol=symbol, side=signal.side)
+                    trace.span('fetch_klines', fetch_start, fetch_end)
+                    trace.span('generate_signal', fetch_end, generate_end)
                     signals[symbol] = {
                         'signal': signal,
                         'strength': signal.confidence * 10,
                         'timeframes': ['5m', '1h'],
                         'price': float(df_5m.iloc[-1]['close']),
-                        'volume': float(df_5m.iloc[-1]['volume'])
+                        'volume': float(df_5m.iloc[-1]['volume']),
+                        'flow': flow,
+                        'trace': trace
                     }
+                    SIGNALS_TOTAL.labels(signal.side).inc()
 
-                    logger.info(
-                        f"QUALITY signal found for {symbol}: {signal.side} (confidence: {signal.confidence:.1%})")
+                    logger.debug("QUALITY signal found for %s: %s (confidence: %.1f%%)",
+                                 symbol, signal.side, signal.confidence * 100)
+                    if on_signal is not None:
+                        await on_signal(symbol, signals[symbol])
 
             except Exception as e:
                 logger.error(f"Error scanning {symbol}: {e}")
@@ -95,22 +175,98 @@ class MarketScanner:
 
         return signals
 
+    def flow_features(self, symbol: str, df_5m) -> Optional[Dict]:
+        """Признаки потока сделок, если по символу идет поток aggTrade (иначе None - уверенность без поправки)"""
+        if self.trade_flow is None:
+            return None
+        try:
+            return self.trade_flow.flow_features(symbol, df_5m)
+        except Exception as e:
+            logger.debug("Flow features error for %s: %s", symbol, e)
+            return None
+
+    async def scan_candidates(self, symbols: List[str]) -> Dict[str, Dict]:
+        """Сканировать в кластере воркеров, если он есть, иначе в этом процессе"""
+        if self.cluster is not None and self.cluster.size:
+            try:
+                return await self.cluster.scan(symbols)
+            except Exception as e:
+                logger.error(f"Cluster scan failed, scanning locally: {e}")
+        return await self.scan_symbols(symbols)
+
+    def filter_by_liquidity(self, signals: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Добавить к сигналам сводку стакана и отбросить те, где ордер проскальзывает сильнее MAX_SLIPPAGE_BPS"""
+        result = {}
+        for symbol, data in signals.items():
+            book = self.order_books.book(symbol)
+            # Стакан еще не готов - сигнал ранжируется как раньше
+            if book is not None:
+                data['liquidity'] = book.liquidity(data['signal'].side)
+                slippage = data['liquidity']['slippage_bps']
+                if slippage > MAX_SLIPPAGE_BPS:
+                    logger.info(f"Skipping {symbol} signal: estimated slippage {slippage:.1f} bps "
+                                f"> {MAX_SLIPPAGE_BPS:g} bps")
+                    continue
+            result[symbol] = data
+        return result
+
+    @staticmethod
+    def rank(data: Dict) -> float:
+        """Сила сигнала, уменьшенная до двух раз по мере приближения проскальзывания к лимиту"""
+        liquidity = data.get('liquidity')
+        if not liquidity:
+            return data['strength']
+        return data['strength'] * (1 - 0.5 * min(liquidity['slippage_bps'] / MAX_SLIPPAGE_BPS, 1.0))
+
+    def diversify(self, ranked: List[tuple], limit: int) -> List[tuple]:
+        """Жадно выбрать до limit сигналов (по убыванию ранга) с корреляцией позиций не выше лимита"""
+        if len(ranked) <= 1:
+            return ranked[:limit]
+        symbols = [symbol for symbol, _ in ranked]
+        candidates = [(symbol, 1 if data['signal'].side == 'LONG' else -1) for symbol, data in ranked]
+        selected, rejected = select_diversified(candidates, self.correlation.matrix(symbols), limit)
+        for i, (j, value) in rejected.items():
+            logger.info(f"Skipping {symbols[i]} signal: position correlation {value:.2f} with {symbols[j]}")
+        return [ranked[i] for i in selected]
+
     async def get_best_signals(self, max_signals: int = 3) -> List[Dict]:
         """Получить только ЛУЧШИЕ сигналы"""
-        if not self.top_symbols:
-            self.top_symbols = await self.get_top_volume_symbols(25)
+        SCANS_TOTAL.inc()
+        with SCAN_SECONDS.time():
+            # Свечи и индикаторы считаем только для прошедших предварительный отбор
+            scan_start = time.time_ns()
+            candidates = await self.get_candidates()
+            prescreen_end = time.time_ns()
+            if self.order_books is not None:
+                # Стаканы кандидатов синхронизируются, пока идет скан
+                self.order_books.track(candidates)
+            if self.trade_flow is not None:
+                self.trade_flow.track(candidates)
+            all_signals = await self.scan_candidates(candidates)
+            scan_end = time.time_ns()
+            if self.order_books is not None:
+                await self.order_books.wait_synced(all_signals, SYNC_TIMEOUT)
+                all_signals = self.filter_by_liquidity(all_signals)
+            liquidity_end = time.time_ns()
 
-        all_signals = await self.scan_symbols(self.top_symbols)
+        for data in all_signals.values():
+            trace = data.get('trace')
+            if trace is not None:
+                trace.span('candle_close_to_scan', trace.origin_ns, scan_start)
+                trace.span('prescreen', scan_start, prescreen_end)
+                trace.span('scan', prescreen_end, scan_end, symbols=len(candidates))
+                if 'liquidity' in data:
+                    trace.span('order_book', scan_end, liquidity_end)
 
-        # Сортируем по силе сигнала и объему
+        # Сортируем по силе сигнала (с поправкой на проскальзывание) и объему
         sorted_signals = sorted(
             all_signals.items(),
-            key=lambda x: (x[1]['strength'], x[1]['volume']),
+            key=lambda x: (self.rank(x[1]), x[1]['volume']),
             reverse=True
         )
 
-        # Берем только топ сигналы
-        best_signals = [{'symbol': k, **v} for k, v in sorted_signals[:max_signals]]
+        # Берем только топ сигналы, отсеивая сильно коррелирующие с уже выбранными
+        best_signals = [{'symbol': k, **v} for k, v in self.diversify(sorted_signals, max_signals)]
 
         if best_signals:
             logger.info(f"Found {len(best_signals)} quality signals")
@@ -119,5 +275,46 @@ class MarketScanner:
 
         return best_signals
 
+    def snapshot(self) -> Dict:
+        """Горячее состояние для чекпоинта: вселенная, базовые объемы, корреляции, свечи"""
+        return {'top_symbols': list(self.top_symbols), 'prescreen': self.prescreener.snapshot(),
+                'correlation': self.correlation.snapshot(), 'candles': self.cache.snapshot()}
+
+    def restore(self, state: Dict) -> Dict:
+        self.top_symbols = list(state['top_symbols'])
+        self.prescreener.restore(state['prescreen'])
+        correlation = self.correlation.restore(state['correlation'])
+        candles = self.cache.restore(state['candles'])
+        return {'symbols': len(self.top_symbols), 'candle_series': candles, 'correlation': correlation}
+
+    async def warm_up(self) -> int:
+        """Прогрев после старта: список монет, стратегия и кэш свечей параллельно.
+
+        После восстановления из чекпоинта кэш догружает только бары, закрывшиеся за время простоя
+        """
+        started = time.monotonic()
+        # Импорт стратегии (pandas_ta) идет в потоке, пока грузятся свечи
+        import_task = asyncio.create_task(asyncio.to_thread(importlib.import_module, 'strategies'))
+        candidates = await self.get_candidates()
+        loaded = await self.cache.warm_up(candidates, ['5m', '1h'], limit=100)
+        await import_task
+        logger.info(f"Warm-up finished: {loaded} candle series in {time.monotonic() - started:.1f}s")
+        return loaded
+
+
+_scanner = None
+
+
+def get_scanner() -> MarketScanner:
+    """Глобальный сканер (создается при первом обращении)"""
+    global _scanner
+    if _scanner is None:
+        _scanner = MarketScanner()
+    return _scanner
+
 
-scanner = MarketScanner()
\ No newline at end of file
+def __getattr__(name):
+    # Обратная совместимость: market_scanner.scanner
+    if name == 'scanner':
+        return get_scanner()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
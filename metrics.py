@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+logger = logging.getLogger(__name__)
+
+# Бакеты от 1 мс до 30 с - покрывают и индикаторы, и медленные REST-запросы
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+FETCH_KLINES_SECONDS = Histogram('bot_fetch_klines_seconds', 'fetch_klines latency', ['interval'],
+                                 buckets=LATENCY_BUCKETS)
+ADD_INDICATORS_SECONDS = Histogram('bot_add_indicators_seconds', 'add_indicators latency',
+                                   buckets=LATENCY_BUCKETS)
+GENERATE_SIGNAL_SECONDS = Histogram('bot_generate_signal_seconds', 'generate_signal_from_dfs latency',
+                                    buckets=LATENCY_BUCKETS)
+DB_SECONDS = Histogram('bot_db_call_seconds', 'db.py call latency', ['call'], buckets=LATENCY_BUCKETS)
+ORDER_SECONDS = Histogram('bot_order_seconds', 'Order placement latency', ['call'], buckets=LATENCY_BUCKETS)
+TELEGRAM_SECONDS = Histogram('bot_telegram_request_seconds', 'Telegram Bot API request latency', ['method'],
+                             buckets=LATENCY_BUCKETS)
+SCAN_SECONDS = Histogram('bot_scan_seconds', 'Full market scan duration', buckets=LATENCY_BUCKETS)
+
+SCANS_TOTAL = Counter('bot_scans_total', 'Market scans started')
+SIGNALS_TOTAL = Counter('bot_signals_total', 'Quality signals found by the scanner', ['side'])
+HTTP_ERRORS_TOTAL = Counter('bot_http_errors_total', 'Failed Binance REST requests', ['endpoint', 'status'])
+HTF_CACHE_TOTAL = Counter('bot_htf_bias_cache_total', 'Higher-timeframe bias cache lookups', ['result'])
+NOTIFY_MESSAGES_TOTAL = Counter('bot_notify_messages_total', 'Outbound Telegram messages', ['result'])
+WEBHOOK_ALERTS_TOTAL = Counter('bot_webhook_alerts_total', 'TradingView webhook alerts', ['result'])
+ORDER_BOOK_RESYNCS_TOTAL = Counter('bot_order_book_resyncs_total', 'Local order book resyncs', ['reason'])
+NOTIFY_QUEUE_SIZE = Gauge('bot_notify_queue_size', 'Messages waiting in the outbound Telegram queue')
+BINANCE_USED_WEIGHT = Gauge('bot_binance_used_weight_1m', 'Last reported X-MBX-USED-WEIGHT-1M')
+
+EVENT_LOOP_LAG_SECONDS = Histogram('bot_event_loop_lag_seconds', 'Event loop scheduling lag',
+                                   buckets=LATENCY_BUCKETS)
+
+
+def timed(histogram, label: str = None):
+    """Декоратор: замер времени вызова (sync и async) в гистограмму.
+
+    Если у гистограммы есть лейбл, передается его значение (по умолчанию - имя функции).
+    """
+    def decorator(func):
+        metric = histogram.labels(label or func.__name__) if histogram._labelnames else histogram
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    metric.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+def observe_binance_response(endpoint: str, response):
+    """Учесть ответ Binance: использованный вес и HTTP-ошибки"""
+    weight = response.headers.get('x-mbx-used-weight-1m')
+    if weight is not None:
+        BINANCE_USED_WEIGHT.set(float(weight))
+    if response.status_code >= 400:
+        HTTP_ERRORS_TOTAL.labels(endpoint, str(response.status_code)).inc()
+
+
+async def telegram_request_middleware(make_request, bot, method):
+    """Middleware сессии aiogram: время каждого запроса к Bot API"""
+    with TELEGRAM_SECONDS.labels(type(method).__name__).time():
+        return await make_request(bot, method)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Фоновая задача: насколько позже планового просыпается event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+
+
+def render_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return generate_latest(), CONTENT_TYPE_LATEST
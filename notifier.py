@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List
+from aiogram.exceptions import (TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter,
+                                TelegramServerError)
+from db import get_subscribers, remove_subscriber
+from metrics import NOTIFY_MESSAGES_TOTAL, NOTIFY_QUEUE_SIZE
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API: ~30 сообщений/с всего, 1/с в личный чат, 20/мин в группу
+GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+MAX_MESSAGE_LENGTH = 4096
+MAX_SEND_ATTEMPTS = 5
+# Сетевые ошибки и 5xx: экспоненциальная пауза чата перед повтором
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> float:
+        """Взять токен без ожидания: 0 - взят, иначе через сколько секунд он появится"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (ответ 429 retry_after)"""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated = time.monotonic()
+
+
+def split_digest(parts: List[str], separator: str = '\n\n') -> List[str]:
+    """Склеить части в минимум сообщений, не превышающих лимит длины Telegram"""
+    messages, current = [], ''
+    for part in parts:
+        part = part[:MAX_MESSAGE_LENGTH]
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) > MAX_MESSAGE_LENGTH:
+            messages.append(current)
+            candidate = part
+        current = candidate
+    if current:
+        messages.append(current)
+    return messages
+
+
+class Notifier:
+    """Очередь исходящих сообщений Telegram.
+
+    Отправка идет в фоновых воркерах, поэтому сканирование не ждет Telegram.
+    Скорость ограничена глобальным и по-чатовым token bucket, на 429 чат
+    ждет retry_after, на сетевую ошибку или 5xx - экспоненциальную паузу;
+    сообщение отбрасывается после MAX_SEND_ATTEMPTS попыток. У каждого чата своя очередь, а в общей очереди готовых
+    стоят чаты (каждый не больше одного раза): воркер отправляет одно
+    сообщение чата и возвращает чат в конец очереди, а чат, который ждет
+    свой bucket, возвращается туда по таймеру. Сообщения одному чату уходят
+    в порядке постановки, и медленный чат не занимает воркеров.
+    """
+
+    def __init__(self, bot, owner_chat_id=None, workers: int = 8, max_queue: int = 10000):
+        self.bot = bot
+        self.owner_chat_id = owner_chat_id
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ready: asyncio.Queue = asyncio.Queue()
+        # chat_id -> [text, kwargs, traces, queued_ns, attempts]; чат есть здесь, пока у него есть сообщения
+        self._pending: Dict[int, Deque[list]] = {}
+        self._size = 0
+        self.global_bucket = TokenBucket(GLOBAL_RATE, capacity=GLOBAL_RATE)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._loop = None
+
+    def start(self):
+        if not self._tasks:
+            self._loop = asyncio.get_running_loop()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(f"Notifier started with {self.workers} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def send(self, chat_id, text: str, traces: list = None, **kwargs) -> bool:
+        """Поставить сообщение в очередь (не ждет отправки).
+
+        traces - трассы сигналов, которые завершаются доставкой этого сообщения
+        """
+        if self._loop is not None and not self._in_loop():
+            # Вызов из другого потока: очереди не потокобезопасны - ставим через loop воркеров
+            self._loop.call_soon_threadsafe(lambda: self.send(chat_id, text, traces, **kwargs))
+            return True
+        if self._size >= self.max_queue:
+            NOTIFY_MESSAGES_TOTAL.labels('dropped').inc()
+            logger.warning(f"Notify queue is full, dropping message to {chat_id}")
+            return False
+        chat_id = int(chat_id)
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            pending = self._pending[chat_id] = deque()
+            self.ready.put_nowait(chat_id)
+        pending.append([text, kwargs, traces, time.time_ns(), 0])
+        self._size += 1
+        NOTIFY_QUEUE_SIZE.set(self._size)
+        return True
+
+    def recipients(self) -> List[int]:
+        """Владелец бота и все подписчики из БД"""
+        chats = [int(self.owner_chat_id)] if self.owner_chat_id else []
+        try:
+            chats += get_subscribers()
+        except Exception as e:
+            logger.error(f"Error loading subscribers: {e}")
+        return list(dict.fromkeys(chats))
+
+    def broadcast(self, text: str, chats: Iterable[int] = None, **kwargs) -> int:
+        """Разослать сообщение всем получателям"""
+        chats = self.recipients() if chats is None else chats
+        return sum(self.send(chat_id, text, **kwargs) for chat_id in chats)
+
+    def broadcast_digest(self, parts: List[str], chats: Iterable[int] = None, traces: list = None,
+                         **kwargs) -> int:
+        """Разослать части одним дайджестом (несколько сообщений, только если не влезает)"""
+        chats = self.recipients() if chats is None else list(chats)
+        messages = split_digest(parts)
+        sent = 0
+        for i, message in enumerate(messages):
+            for chat_id in chats:
+                # Трассы завершает доставка последнего сообщения дайджеста первому получателю (владельцу)
+                last = traces and i == len(messages) - 1 and chat_id == chats[0]
+                sent += self.send(chat_id, message, traces=traces if last else None, **kwargs)
+        return sent
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательный id - группа или канал
+            rate = GROUP_CHAT_RATE if chat_id < 0 else PRIVATE_CHAT_RATE
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            pending = self._pending[chat_id]
+            wait = self._bucket(chat_id).try_acquire()
+            if wait:
+                # Чат ограничен (лимит чата или retry_after) - вернется в очередь, когда появится токен
+                self._loop.call_later(wait, self.ready.put_nowait, chat_id)
+                continue
+            message = pending[0]
+            try:
+                done = await self._deliver(chat_id, *message)
+            except Exception as e:
+                logger.error(f"Notifier error for {chat_id}: {e}")
+                done = True
+            if done:
+                pending.popleft()
+                self._size -= 1
+                NOTIFY_QUEUE_SIZE.set(self._size)
+            else:
+                message[4] += 1
+            if pending:
+                self.ready.put_nowait(chat_id)
+            else:
+                del self._pending[chat_id]
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: dict, traces: list = None, queued_ns: int = 0,
+                       attempt: int = 0) -> bool:
+        """Одна попытка отправки; False - повторить позже (429, сеть, 5xx)"""
+        await self.global_bucket.acquire()
+        try:
+            send_start = time.time_ns()
+            await self.bot.send_message(chat_id, text, **kwargs)
+            NOTIFY_MESSAGES_TOTAL.labels('sent').inc()
+            if traces:
+                sent_ns = time.time_ns()
+                for trace in traces:
+                    trace.span('telegram_queue', queued_ns, send_start, attempts=attempt + 1)
+                    trace.span('telegram_send', send_start, sent_ns, chat_id=chat_id)
+                    tracer.finish(trace, sent_ns)
+            return True
+        except TelegramRetryAfter as e:
+            NOTIFY_MESSAGES_TOTAL.labels('retry_after').inc()
+            logger.warning(f"Telegram flood control for {chat_id}: retry after {e.retry_after}s")
+            # Ограничение может быть глобальным - притормаживаем всю отправку
+            self._bucket(chat_id).pause(e.retry_after)
+            self.global_bucket.pause(e.retry_after)
+            if attempt + 1 < MAX_SEND_ATTEMPTS:
+                return False
+        except (TelegramNetworkError, TelegramServerError) as e:
+            NOTIFY_MESSAGES_TOTAL.labels('retry_error').inc()
+            if attempt + 1 < MAX_SEND_ATTEMPTS:
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+                logger.warning(f"Telegram error for {chat_id} (attempt {attempt + 1}): {e}, retry in {delay:.1f}s")
+                # Пауза только этого чата: воркер вернет его в очередь, когда появится токен
+                self._bucket(chat_id).pause(delay)
+                return False
+        except TelegramForbiddenError:
+            # Бот заблокирован или удален из чата - больше не рассылаем
+            NOTIFY_MESSAGES_TOTAL.labels('forbidden').inc()
+            logger.info(f"Chat {chat_id} blocked the bot, unsubscribing")
+            remove_subscriber(chat_id)
+            return True
+        NOTIFY_MESSAGES_TOTAL.labels('failed').inc()
+        logger.error(f"Giving up on message to {chat_id} after {attempt + 1} attempts")
+        return True
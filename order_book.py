@@ -0,0 +1,516 @@
+"""Локальные стаканы (L2) для символов-кандидатов скана.
+
+Стакан строится по снимку REST /fapi/v1/depth и потоку диффов <symbol>@depth
+по правилам Binance Futures:
+
+1. поток открывается первым, события буферизуются;
+2. берется снимок, события с u < lastUpdateId отбрасываются;
+3. первое применяемое событие: U <= lastUpdateId <= u;
+4. у каждого следующего pu равен u предыдущего, иначе разрыв - новый снимок.
+
+Уровни хранятся в отсортированных массивах (лучшая цена - индекс 0),
+кумулятивные суммы пересчитываются лениво после изменений. Спред - O(1),
+глубина и проскальзывание - бинарный поиск по кумулятивным суммам.
+
+Стаканы держат по websocket-потоку на кандидата, поэтому включаются явно.
+
+Переменные окружения:
+    ORDER_BOOKS             true - вести стаканы кандидатов: фильтр проскальзывания
+                            сигналов и урезание объема ордеров вебхука (false)
+    ORDER_BOOK_DEPTH        уровней в REST-снимке (1000)
+    ORDER_BOOK_MAX          одновременно поддерживаемых стаканов (50)
+    ORDER_BOOK_IDLE_SEC     стакан без запросов закрывается через столько секунд (900)
+    ORDER_NOTIONAL_USDT     размер ордера для оценки проскальзывания (1000)
+    MAX_SLIPPAGE_BPS        допустимое проскальзывание, б.п. (15)
+    ORDER_BOOK_DEPTH_BPS    глубина стакана в пределах стольких б.п. от середины (10)
+    ORDER_BOOK_SYNC_TIMEOUT сколько секунд скан ждет синхронизации стаканов (3)
+"""
+import asyncio
+import bisect
+import json
+import logging
+import math
+import os
+import random
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+import numpy as np
+from data import BINANCE_REST, BINANCE_WS
+from metrics import ORDER_BOOK_RESYNCS_TOTAL, observe_binance_response
+
+logger = logging.getLogger(__name__)
+
+ORDER_BOOKS_ENABLED = os.getenv('ORDER_BOOKS', 'false').lower() == 'true'
+ORDER_BOOK_DEPTH = int(os.getenv('ORDER_BOOK_DEPTH', '1000'))  # уровней в REST-снимке
+ORDER_BOOK_MAX = int(os.getenv('ORDER_BOOK_MAX', '50'))  # одновременно поддерживаемых стаканов
+ORDER_BOOK_IDLE_SEC = float(os.getenv('ORDER_BOOK_IDLE_SEC', '900'))  # стакан без запросов закрывается
+# Пауза перед снимком после разрыва: растет вдвое при частых разрывах (снимок limit=1000 - вес 20)
+RESYNC_MIN_DELAY = 1.0
+RESYNC_MAX_DELAY = 60.0
+# Размер ордера для оценки проскальзывания и допустимое проскальзывание
+ORDER_NOTIONAL = float(os.getenv('ORDER_NOTIONAL_USDT', '1000'))
+MAX_SLIPPAGE_BPS = float(os.getenv('MAX_SLIPPAGE_BPS', '15'))
+DEPTH_BPS = float(os.getenv('ORDER_BOOK_DEPTH_BPS', '10'))
+# Сколько скан ждет синхронизации стаканов символов с сигналами
+SYNC_TIMEOUT = float(os.getenv('ORDER_BOOK_SYNC_TIMEOUT', '3'))
+
+
+class OrderBookGap(Exception):
+    """Разрыв последовательности диффов - стакан нужно пересобрать со снимка"""
+
+
+def _is_buy(side: str) -> bool:
+    return side.upper() in ('BUY', 'LONG')
+
+
+class _BookSide:
+    """Одна сторона стакана: ключи по возрастанию от лучшей цены (у бидов ключ = -цена)"""
+    __slots__ = ('sign', 'keys', 'qtys', '_prices', '_cum_qty', '_cum_notional')
+
+    def __init__(self, sign: int):
+        self.sign = sign
+        self.keys: List[float] = []
+        self.qtys: List[float] = []
+        self._prices = None
+        self._cum_qty = None
+        self._cum_notional = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def load(self, levels):
+        pairs = sorted((self.sign * float(p), float(q)) for p, q in levels if float(q) > 0)
+        self.keys = [k for k, _ in pairs]
+        self.qtys = [q for _, q in pairs]
+        self._prices = None
+
+    def update(self, price: float, qty: float):
+        key = self.sign * price
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            if qty > 0:
+                self.qtys[i] = qty
+            else:
+                del self.keys[i]
+                del self.qtys[i]
+        elif qty > 0:
+            self.keys.insert(i, key)
+            self.qtys.insert(i, qty)
+        self._prices = None
+
+    @property
+    def best(self) -> Optional[float]:
+        return self.sign * self.keys[0] if self.keys else None
+
+    def _cumulative(self):
+        if self._prices is None:
+            self._prices = np.abs(np.array(self.keys, dtype=np.float64))
+            qtys = np.array(self.qtys, dtype=np.float64)
+            self._cum_qty = np.cumsum(qtys)
+            self._cum_notional = np.cumsum(self._prices * qtys)
+        return self._prices, self._cum_qty, self._cum_notional
+
+    def notional_until(self, price: float) -> float:
+        """Объем (в котируемой валюте) от лучшей цены до price включительно"""
+        _, _, cum_notional = self._cumulative()
+        i = bisect.bisect_right(self.keys, self.sign * price)
+        return float(cum_notional[i - 1]) if i else 0.0
+
+    def fill(self, notional: float):
+        """Количество и средняя цена рыночного ордера на notional; None, если глубины не хватает"""
+        prices, cum_qty, cum_notional = self._cumulative()
+        i = int(np.searchsorted(cum_notional, notional))
+        if i >= len(prices):
+            return None
+        qty_before = cum_qty[i - 1] if i else 0.0
+        notional_before = cum_notional[i - 1] if i else 0.0
+        qty = qty_before + (notional - notional_before) / prices[i]
+        return float(qty), notional / float(qty)
+
+    def max_fill(self, reference: float, max_bps: float):
+        """Наибольший ордер (количество, объем), средняя цена которого отходит от reference не больше max_bps"""
+        prices, cum_qty, cum_notional = self._cumulative()
+        if not len(prices):
+            return 0.0, 0.0
+        limit = reference * (1 + self.sign * max_bps / 1e4)
+        # Средняя цена монотонно ухудшается с каждым съеденным уровнем
+        slippage = self.sign * (cum_notional / cum_qty - limit)
+        k = int(np.searchsorted(slippage, 0.0, side='right'))
+        if k >= len(prices):
+            return float(cum_qty[-1]), float(cum_notional[-1])
+        qty_before = cum_qty[k - 1] if k else 0.0
+        notional_before = cum_notional[k - 1] if k else 0.0
+        # Часть уровня k: (N + x*p) / (Q + x) = limit
+        extra = max(0.0, (limit * qty_before - notional_before) / (prices[k] - limit)) \
+            if prices[k] != limit else 0.0
+        extra = min(extra, cum_qty[k] - qty_before)
+        return float(qty_before + extra), float(notional_before + extra * prices[k])
+
+
+class OrderBook:
+    """Локальный L2-стакан одного символа"""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = _BookSide(-1)
+        self.asks = _BookSide(1)
+        self.last_update_id: Optional[int] = None
+        # Применено первое событие после снимка - дальше проверяется цепочка pu
+        self.synced = False
+        self.updated = 0.0
+
+    def clear(self):
+        self.bids.load([])
+        self.asks.load([])
+        self.last_update_id = None
+        self.synced = False
+
+    def load_snapshot(self, snapshot: dict):
+        self.bids.load(snapshot['bids'])
+        self.asks.load(snapshot['asks'])
+        self.last_update_id = int(snapshot['lastUpdateId'])
+        self.synced = False
+        self.updated = time.time()
+
+    def apply(self, event: dict) -> bool:
+        """Применить дифф depthUpdate. False - событие старше снимка и пропущено"""
+        if self.last_update_id is None:
+            raise OrderBookGap("no snapshot loaded")
+        first, last = event['U'], event['u']
+        if not self.synced:
+            if last < self.last_update_id:
+                return False
+            if first > self.last_update_id:
+                raise OrderBookGap(f"first event U={first} is after snapshot {self.last_update_id}")
+        elif event['pu'] != self.last_update_id:
+            raise OrderBookGap(f"pu={event['pu']} != last u={self.last_update_id}")
+
+        for price, qty in event['b']:
+            self.bids.update(float(price), float(qty))
+        for price, qty in event['a']:
+            self.asks.update(float(price), float(qty))
+        self.last_update_id = last
+        self.synced = True
+        self.updated = time.time()
+        return True
+
+    # --- запросы ---
+
+    @property
+    def best_bid(self) -> Optional[float]:
+        return self.bids.best
+
+    @property
+    def best_ask(self) -> Optional[float]:
+        return self.asks.best
+
+    @property
+    def mid(self) -> Optional[float]:
+        if not self.bids or not self.asks:
+            return None
+        return (self.bids.best + self.asks.best) / 2
+
+    def spread_bps(self) -> float:
+        mid = self.mid
+        if mid is None:
+            return math.inf
+        return (self.asks.best - self.bids.best) / mid * 1e4
+
+    def depth_within_bps(self, bps: float, side: str = None) -> float:
+        """Объем в USDT в пределах bps от середины: side BUY - аски, SELL - биды, None - обе стороны"""
+        mid = self.mid
+        if mid is None:
+            return 0.0
+        asks = self.asks.notional_until(mid * (1 + bps / 1e4))
+        bids = self.bids.notional_until(mid * (1 - bps / 1e4))
+        if side is None:
+            return asks + bids
+        return asks if _is_buy(side) else bids
+
+    def estimate_slippage(self, side: str, notional: float) -> float:
+        """Проскальзывание рыночного ордера на notional USDT (bps средней цены от середины)"""
+        mid = self.mid
+        if mid is not None and notional <= 0:
+            return 0.0
+        book_side = self.asks if _is_buy(side) else self.bids
+        fill = book_side.fill(notional) if mid is not None else None
+        if fill is None:
+            return math.inf
+        _, avg_price = fill
+        return abs(avg_price - mid) / mid * 1e4
+
+    def max_quantity(self, side: str, max_slippage_bps: float) -> float:
+        """Наибольшее количество для рыночного ордера с проскальзыванием не больше max_slippage_bps"""
+        mid = self.mid
+        if mid is None:
+            return 0.0
+        book_side = self.asks if _is_buy(side) else self.bids
+        return book_side.max_fill(mid, max_slippage_bps)[0]
+
+    def liquidity(self, side: str, notional: float = ORDER_NOTIONAL, max_slippage_bps: float = MAX_SLIPPAGE_BPS,
+                  depth_bps: float = DEPTH_BPS) -> Dict:
+        """Сводка для ранжирования сигнала и размера ордера"""
+        mid = self.mid
+        book_side = self.asks if _is_buy(side) else self.bids
+        max_qty, max_notional = book_side.max_fill(mid, max_slippage_bps) if mid else (0.0, 0.0)
+        return {
+            'spread_bps': round(self.spread_bps(), 2),
+            'depth_usdt': round(self.depth_within_bps(depth_bps, side), 2),
+            'depth_bps': depth_bps,
+            'slippage_bps': round(self.estimate_slippage(side, notional), 2),
+            'notional': notional,
+            'max_qty': max_qty,
+            'max_notional': round(max_notional, 2),
+        }
+
+
+# --- источники данных ---
+
+class BinanceDepthSource:
+    """Снимки REST /fapi/v1/depth и поток диффов <symbol>@depth@100ms"""
+
+    def __init__(self, rest: str = BINANCE_REST, ws: str = BINANCE_WS, speed: str = '100ms'):
+        self.rest = rest
+        self.ws = ws
+        self.speed = speed
+
+    async def snapshot(self, symbol: str, limit: int = ORDER_BOOK_DEPTH) -> dict:
+        import httpx
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.get(f"{self.rest}/fapi/v1/depth", params={'symbol': symbol, 'limit': limit})
+            observe_binance_response('depth', response)
+            response.raise_for_status()
+            return response.json()
+
+    async def events(self, symbol: str) -> AsyncIterator[dict]:
+        import aiohttp
+        url = f"{self.ws}/ws/{symbol.lower()}@depth@{self.speed}"
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(url, heartbeat=30) as ws:
+                async for message in ws:
+                    if message.type == aiohttp.WSMsgType.TEXT:
+                        yield json.loads(message.data)
+                    elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+
+
+class FakeDepthSource:
+    """Локальная замена Binance для тестов и бенчмарков.
+
+    Для каждого символа ведет "настоящий" стакан и генерирует диффы с
+    корректными U/u/pu. drop_rate - доля событий, которые не доходят до
+    подписчика (разрывы последовательности), interval - пауза между событиями.
+    """
+
+    def __init__(self, levels: int = 200, interval: float = 0.01, drop_rate: float = 0.0, seed: int = 0,
+                 price: float = 100.0, tick: float = 0.01):
+        self.levels = levels
+        self.interval = interval
+        self.drop_rate = drop_rate
+        self.tick = tick
+        self.price = price
+        self.rng = random.Random(seed)
+        self.books: Dict[str, Dict[str, Dict[float, float]]] = {}
+        self.update_ids: Dict[str, int] = {}
+
+    def _book(self, symbol: str):
+        book = self.books.get(symbol)
+        if book is None:
+            mid = round(self.price / self.tick) * self.tick
+            book = self.books[symbol] = {
+                'bids': {round(mid - (i + 1) * self.tick, 8): self._qty() for i in range(self.levels)},
+                'asks': {round(mid + (i + 1) * self.tick, 8): self._qty() for i in range(self.levels)},
+            }
+            self.update_ids[symbol] = self.rng.randint(1, 10 ** 6)
+        return book
+
+    def _qty(self) -> float:
+        return round(self.rng.uniform(0.1, 50), 3)
+
+    def step(self, symbol: str, changes: int = 5) -> dict:
+        """Изменить стакан символа и вернуть соответствующее событие depthUpdate"""
+        book = self._book(symbol)
+        diff = {'bids': {}, 'asks': {}}
+        for _ in range(changes):
+            best_bid, best_ask = max(book['bids']), min(book['asks'])
+            side = self.rng.choice(('bids', 'asks'))
+            offset = self.rng.randint(0, self.levels // 4) * self.tick
+            price = round(best_bid - offset if side == 'bids' else best_ask + offset, 8)
+            # Иногда уровень снимается целиком, иногда появляется новый внутри спреда
+            roll = self.rng.random()
+            if roll < 0.2 and len(book[side]) > 1:
+                qty = 0.0
+            elif roll < 0.3 and best_ask - best_bid > self.tick * 1.5:
+                price = round(best_bid + self.tick if side == 'bids' else best_ask - self.tick, 8)
+                qty = self._qty()
+            else:
+                qty = self._qty()
+            if qty:
+                book[side][price] = qty
+            else:
+                book[side].pop(price, None)
+            diff[side][price] = qty
+        previous = self.update_ids[symbol]
+        # Номера обновлений Binance растут не подряд - у события диапазон U..u
+        last = previous + self.rng.randint(1, 10)
+        self.update_ids[symbol] = last
+        return {'e': 'depthUpdate', 'E': int(time.time() * 1000), 's': symbol, 'U': previous + 1, 'u': last,
+                'pu': previous, 'b': [[str(p), str(q)] for p, q in diff['bids'].items()],
+                'a': [[str(p), str(q)] for p, q in diff['asks'].items()]}
+
+    async def snapshot(self, symbol: str, limit: int = ORDER_BOOK_DEPTH) -> dict:
+        book = self._book(symbol)
+        bids = sorted(book['bids'].items(), reverse=True)[:limit]
+        asks = sorted(book['asks'].items())[:limit]
+        return {'lastUpdateId': self.update_ids[symbol], 'bids': [[str(p), str(q)] for p, q in bids],
+                'asks': [[str(p), str(q)] for p, q in asks]}
+
+    async def events(self, symbol: str) -> AsyncIterator[dict]:
+        self._book(symbol)
+        while True:
+            await asyncio.sleep(self.interval)
+            event = self.step(symbol)
+            if self.rng.random() >= self.drop_rate:
+                yield event
+
+
+# --- поддержка стаканов ---
+
+class OrderBookManager:
+    """Поддерживает стаканы запрошенных символов: снимок + диффы, пересборка при разрыве.
+
+    track() добавляет символы (кандидаты скана); стаканы, которые не
+    запрашивались ORDER_BOOK_IDLE_SEC, закрываются, всего не больше max_books.
+    """
+
+    def __init__(self, source=None, max_books: int = ORDER_BOOK_MAX, idle_ttl: float = ORDER_BOOK_IDLE_SEC,
+                 depth: int = ORDER_BOOK_DEPTH, retry_delay: float = 5.0):
+        self.source = source or BinanceDepthSource()
+        self.max_books = max_books
+        self.idle_ttl = idle_ttl
+        self.depth = depth
+        self.retry_delay = retry_delay
+        self.books: Dict[str, OrderBook] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._ready: Dict[str, asyncio.Event] = {}
+        self._wanted: Dict[str, float] = {}
+        self.resyncs = 0
+
+    def track(self, symbols: Iterable[str]):
+        """Поддерживать стаканы этих символов (запускает потоки для новых)"""
+        now = time.monotonic()
+        for symbol in symbols:
+            self._wanted[symbol] = now
+        # Давно не запрашиваемые и лишние (сверх max_books) стаканы закрываются
+        by_age = sorted(self._wanted, key=self._wanted.get, reverse=True)
+        keep = {s for s in by_age[:self.max_books] if now - self._wanted[s] <= self.idle_ttl}
+        for symbol in list(self._wanted):
+            if symbol not in keep:
+                self._untrack(symbol)
+        for symbol in keep:
+            if symbol not in self._tasks:
+                self.books[symbol] = OrderBook(symbol)
+                self._ready[symbol] = asyncio.Event()
+                self._tasks[symbol] = asyncio.create_task(self._run(symbol), name=f"order-book-{symbol}")
+
+    def _untrack(self, symbol: str):
+        task = self._tasks.pop(symbol, None)
+        if task is not None:
+            task.cancel()
+        self._wanted.pop(symbol, None)
+        self.books.pop(symbol, None)
+        self._ready.pop(symbol, None)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for symbol in list(self._tasks):
+            self._untrack(symbol)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def book(self, symbol: str) -> Optional[OrderBook]:
+        """Синхронизированный стакан символа или None"""
+        book = self.books.get(symbol)
+        return book if book is not None and book.synced else None
+
+    async def wait_synced(self, symbols: Iterable[str], timeout: float) -> int:
+        """Дождаться синхронизации стаканов (не дольше timeout); возвращает число готовых"""
+        events = [self._ready[s] for s in symbols if s in self._ready]
+        if events:
+            waits = [asyncio.create_task(event.wait()) for event in events]
+            _, pending = await asyncio.wait(waits, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        return sum(event.is_set() for event in events)
+
+    def cap_quantity(self, symbol: str, side: str, quantity: float,
+                     max_slippage_bps: float = MAX_SLIPPAGE_BPS) -> float:
+        """Уменьшить количество до того, что стакан примет с проскальзыванием не больше max_slippage_bps"""
+        book = self.book(symbol)
+        if book is None:
+            return quantity
+        return min(quantity, book.max_quantity(side, max_slippage_bps))
+
+    async def _run(self, symbol: str):
+        while True:
+            try:
+                await self._sync(symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                ORDER_BOOK_RESYNCS_TOTAL.labels('error').inc()
+                logger.warning(f"Order book {symbol} stream error: {e}, reconnecting in {self.retry_delay}s")
+            book = self.books.get(symbol)
+            if book is not None:
+                book.clear()
+                self._ready[symbol].clear()
+            await asyncio.sleep(self.retry_delay)
+
+    async def _sync(self, symbol: str):
+        book, ready = self.books[symbol], self._ready[symbol]
+        buffer: asyncio.Queue = asyncio.Queue()
+
+        async def read():
+            try:
+                async for event in self.source.events(symbol):
+                    buffer.put_nowait(event)
+                buffer.put_nowait(ConnectionError("depth stream closed"))
+            except Exception as e:
+                buffer.put_nowait(e)
+
+        reader = asyncio.create_task(read())
+        try:
+            # Поток уже открыт и буферизуется, только после этого берем снимок
+            pending = [await buffer.get()]
+            delay, snapshot_at = 0.0, 0.0
+            while True:
+                if delay:
+                    # Поток продолжает буферизоваться, пока ждем
+                    await asyncio.sleep(delay)
+                snapshot_at = time.monotonic()
+                book.load_snapshot(await self.source.snapshot(symbol, self.depth))
+                try:
+                    while True:
+                        for event in pending:
+                            if isinstance(event, Exception):
+                                raise event
+                            book.apply(event)
+                            if book.synced and not ready.is_set():
+                                logger.info(f"Order book {symbol} synced at update {book.last_update_id}")
+                                ready.set()
+                        pending = [await buffer.get()]
+                except OrderBookGap as e:
+                    # Событие, на котором обнаружен разрыв, может понадобиться после нового снимка
+                    pending = pending[pending.index(event):]
+                    self.resyncs += 1
+                    ORDER_BOOK_RESYNCS_TOTAL.labels('gap').inc()
+                    ready.clear()
+                    # Стакан продержался дольше максимальной паузы - разрыв случайный, backoff сначала
+                    stable = time.monotonic() - snapshot_at > RESYNC_MAX_DELAY
+                    delay = RESYNC_MIN_DELAY if stable or not delay else min(delay * 2, RESYNC_MAX_DELAY)
+                    logger.info(f"Order book {symbol} resync in {delay:g}s: {e}")
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+
+order_books = OrderBookManager()
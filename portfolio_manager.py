@@ -1,5 +1,5 @@
 import logging
-from data import fetch_klines
+from data import fetch_last_price
 from db import get_open_positions, update_position_price  # Теперь функция есть
 import asyncio
 
@@ -13,15 +13,14 @@ async def update_portfolio_prices():
         if not positions:
             return
 
-        logger.info(f"Updating prices for {len(positions)} open positions")
+        logger.debug("Updating prices for %d open positions", len(positions))
 
         for position in positions:
             symbol = position['symbol']
             try:
                 # Получаем текущую цену
-                df = await fetch_klines(symbol, '1m', limit=1)
-                if not df.empty:
-                    current_price = float(df.iloc[-1]['close'])
+                current_price = await fetch_last_price(symbol)
+                if current_price:
                     entry_price = position['entry_price']
                     qty = position['qty']
 
@@ -34,7 +33,7 @@ async def update_portfolio_prices():
                     # Обновляем позицию в базе
                     update_position_price(symbol, current_price, pnl)
 
-                    logger.debug(f"Updated {symbol}: price={current_price:.4f}, PnL={pnl:.2f}")
+                    logger.debug("Updated %s: price=%.4f, PnL=%.2f", symbol, current_price, pnl)
 
             except Exception as e:
                 logger.error(f"Error updating price for {symbol}: {e}")
@@ -0,0 +1,67 @@
+import logging
+from typing import Dict, List
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _zscore(x: np.ndarray) -> np.ndarray:
+    std = x.std()
+    return (x - x.mean()) / std if std > 0 else np.zeros_like(x)
+
+
+class TickerPrescreener:
+    """Дешевый первый этап скана по одному запросу /fapi/v1/ticker/24hr.
+
+    Для всех символов сразу (векторно) считаются:
+    - momentum: |изменение цены за 24ч, %|
+    - range: (high - low) / last, % - расширение диапазона
+    - volume surge: рост 24ч-объема относительно EWMA с прошлых сканов
+    До дорогого этапа (свечи + индикаторы) доходят только лучшие по сумме z-оценок.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._volume_baseline: Dict[str, float] = {}
+
+    def features(self, tickers: List[dict]) -> Dict[str, np.ndarray]:
+        symbols = np.array([t['symbol'] for t in tickers])
+        change_pct = np.array([t['priceChangePercent'] for t in tickers], dtype=np.float64)
+        high = np.array([t['highPrice'] for t in tickers], dtype=np.float64)
+        low = np.array([t['lowPrice'] for t in tickers], dtype=np.float64)
+        last = np.array([t['lastPrice'] for t in tickers], dtype=np.float64)
+        quote_volume = np.array([t['quoteVolume'] for t in tickers], dtype=np.float64)
+
+        baseline = np.array([self._volume_baseline.get(s, np.nan) for s in symbols])
+        baseline = np.where(np.isnan(baseline), quote_volume, baseline)
+        surge = np.divide(quote_volume, baseline, out=np.ones_like(quote_volume), where=baseline > 0) - 1.0
+        updated = baseline + self.alpha * (quote_volume - baseline)
+        self._volume_baseline.update(zip(symbols.tolist(), updated.tolist()))
+
+        range_pct = np.divide(high - low, last, out=np.zeros_like(last), where=last > 0) * 100
+        return {
+            'symbol': symbols,
+            'momentum': np.abs(change_pct),
+            'range': range_pct,
+            'volume_surge': surge,
+        }
+
+    def snapshot(self) -> Dict[str, float]:
+        return dict(self._volume_baseline)
+
+    def restore(self, baseline: Dict[str, float]):
+        self._volume_baseline.update(baseline)
+
+    def select(self, tickers: List[dict], keep: int) -> List[str]:
+        """Символы, прошедшие предварительный отбор (по убыванию score)"""
+        if not tickers:
+            return []
+        f = self.features(tickers)
+        if keep is None or keep >= len(tickers):
+            return f['symbol'].tolist()
+
+        score = _zscore(f['momentum']) + _zscore(f['range']) + _zscore(f['volume_surge'])
+        top = np.argpartition(-score, keep - 1)[:keep]
+        top = top[np.argsort(-score[top])]
+        logger.info(f"Prescreen: {keep} of {len(tickers)} symbols passed to full scan")
+        return f['symbol'][top].tolist()
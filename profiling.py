@@ -0,0 +1,220 @@
+"""Профилирование работающего бота по запросу (эндпоинты /admin/* в web_interface).
+
+- StackSampler: поток, снимающий стеки всех потоков через sys._current_frames;
+  результат в формате collapsed stacks (flamegraph.pl, speedscope)
+- dump_tasks: стеки asyncio-задач event loop'ов бота
+- tracemalloc: снимок-база и разница с текущим состоянием памяти
+- медленные колбэки: debug-режим loop и перехват предупреждений asyncio
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Event loop'ы, которые нужно показывать в дампе задач (основной loop бота, loop uvicorn)
+_loops: List[asyncio.AbstractEventLoop] = []
+
+
+def register_loop(loop: asyncio.AbstractEventLoop = None):
+    loop = loop or asyncio.get_running_loop()
+    if loop not in _loops:
+        _loops.append(loop)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """Семплирующий профилировщик: раз в interval снимает стеки всех потоков"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+            self.count += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        """Стеки в формате 'thread;outer;...;inner count' (по одному на строку)"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+_profile_lock = threading.Lock()
+
+
+async def profile(seconds: float = 10.0, interval: float = 0.005) -> str:
+    """Семплировать seconds секунд, не блокируя event loop"""
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("profiler is already running")
+    try:
+        sampler = StackSampler(interval)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+        logger.info(f"Profiled {seconds}s: {sampler.count} samples, {len(sampler.samples)} unique stacks")
+        return sampler.collapsed()
+    finally:
+        _profile_lock.release()
+
+
+def dump_tasks(limit: int = 20) -> List[Dict]:
+    """Текущие asyncio-задачи зарегистрированных loop'ов со стеками"""
+    result = []
+    loops = list(_loops)
+    try:
+        current = asyncio.get_running_loop()
+        if current not in loops:
+            loops.append(current)
+    except RuntimeError:
+        pass
+    for loop in loops:
+        for _ in range(3):
+            # all_tasks другого потока может поменяться во время обхода - пробуем еще раз
+            try:
+                tasks = list(asyncio.all_tasks(loop))
+                break
+            except RuntimeError:
+                tasks = []
+        for task in tasks:
+            coro = task.get_coro()
+            result.append({
+                'loop': id(loop),
+                'name': task.get_name(),
+                'coro': getattr(coro, '__qualname__', repr(coro)),
+                'done': task.done(),
+                'stack': [_frame_label(frame) for frame in task.get_stack(limit=limit)],
+            })
+    return result
+
+
+# --- tracemalloc ---
+
+_baseline = None
+
+
+def tracemalloc_start(frames: int = 25):
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _baseline = tracemalloc.take_snapshot()
+
+
+def tracemalloc_stop():
+    global _baseline
+    tracemalloc.stop()
+    _baseline = None
+
+
+def _snapshot(path_filter: str = None):
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    if path_filter:
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(True, f"*{path_filter}*")])
+    return snapshot
+
+
+def _stat(stat) -> Dict:
+    return {
+        'trace': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        'size_kb': round(stat.size / 1024, 1),
+        'count': stat.count,
+    }
+
+
+def tracemalloc_top(limit: int = 20, path_filter: str = None, key_type: str = 'lineno') -> Dict:
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not started")
+    current, peak = tracemalloc.get_traced_memory()
+    stats = _snapshot(path_filter).statistics(key_type)[:limit]
+    return {'current_mb': round(current / 2 ** 20, 2), 'peak_mb': round(peak / 2 ** 20, 2),
+            'top': [_stat(s) for s in stats]}
+
+
+def tracemalloc_diff(limit: int = 20, path_filter: str = None, key_type: str = 'lineno',
+                     reset: bool = False) -> Dict:
+    """Рост памяти с момента базового снимка (start или предыдущего reset)"""
+    global _baseline
+    if not tracemalloc.is_tracing() or _baseline is None:
+        raise RuntimeError("tracemalloc is not started")
+    snapshot = _snapshot(path_filter)
+    baseline = _baseline.filter_traces([tracemalloc.Filter(True, f"*{path_filter}*")]) if path_filter else _baseline
+    stats = snapshot.compare_to(baseline, key_type)[:limit]
+    if reset:
+        _baseline = tracemalloc.take_snapshot()
+    return {'diff': [{**_stat(s), 'size_diff_kb': round(s.size_diff / 1024, 1), 'count_diff': s.count_diff}
+                     for s in stats]}
+
+
+# --- медленные колбэки event loop ---
+
+class SlowCallbackHandler(logging.Handler):
+    """Собирает предупреждения asyncio 'Executing <Task ...> took N seconds'"""
+
+    def __init__(self, maxlen: int = 200):
+        super().__init__(logging.WARNING)
+        self.records = collections.deque(maxlen=maxlen)
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith('Executing '):
+            self.records.append({'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+                                 'thread': record.threadName, 'message': message})
+
+
+_slow_handler = None
+
+
+def slow_callbacks_start(threshold: float = 0.1):
+    """Включить debug-режим loop'ов: asyncio сообщает о колбэках дольше threshold"""
+    global _slow_handler
+    if _slow_handler is None:
+        _slow_handler = SlowCallbackHandler()
+        logging.getLogger('asyncio').addHandler(_slow_handler)
+    for loop in _loops:
+        loop.slow_callback_duration = threshold
+        loop.call_soon_threadsafe(loop.set_debug, True)
+
+
+def slow_callbacks_stop():
+    for loop in _loops:
+        loop.call_soon_threadsafe(loop.set_debug, False)
+
+
+def slow_callbacks() -> List[Dict]:
+    return list(_slow_handler.records) if _slow_handler else []
@@ -1,24 +1,55 @@
 import os, datetime
 import sqlite3
-import matplotlib.pyplot as plt
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.platypus import Table, TableStyle
+import hashlib
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from db import get_signal_outcome_stats, get_stats_buckets
+
+# matplotlib и reportlab импортируются лениво внутри функций:
+# они тяжелые и нужны только при генерации отчета (в отдельном процессе)
+
+logger = logging.getLogger(__name__)
 
 DB = os.getenv('BOT_DB_PATH', 'data/bot.db')
+REPORT_DIR = 'data/reports'
+CHART_CACHE_DIR = os.path.join(REPORT_DIR, 'charts')
+CHART_CACHE_KEEP = 20  # сколько последних картинок хранить в кэше
+
+_executor = None
+
 
 def fetch_trades(days=7):
     if not os.path.exists(DB):
         return []
     conn = sqlite3.connect(DB); c = conn.cursor()
-    c.execute("SELECT ts, symbol, side, qty, price, pnl FROM trades WHERE ts >= datetime('now','-? days')", (days,))
+    c.execute("SELECT ts, symbol, side, qty, price, pnl FROM trades WHERE ts >= datetime('now', ?)", (f'-{days} days',))
     rows = c.fetchall(); conn.close()
     trades = []
     for r in rows:
         trades.append({'ts': r[0], 'symbol': r[1], 'side': r[2], 'qty': r[3], 'price': r[4], 'pnl': r[5]})
     return trades
 
+
+def fetch_daily_buckets(days=7):
+    """Дневные агрегаты PnL за период (из предагрегированной статистики)"""
+    if not os.path.exists(DB):
+        return []
+    return [{'day': b['bucket'], 'trades': b['trades'], 'wins': b['wins'], 'pnl': b['pnl']}
+            for b in get_stats_buckets(days, 'daily')]
+
+
+def fetch_outcome_stats(days=7):
+    """Исходы сигналов за период (None - нет базы или таблица еще не создана)"""
+    if not os.path.exists(DB):
+        return None
+    try:
+        return get_signal_outcome_stats(days)
+    except sqlite3.OperationalError:
+        return None
+
+
 # fallback if no DB rows
 def _fallback_trades(n=20):
     import random, datetime as dt
@@ -30,40 +61,78 @@ def _fallback_trades(n=20):
         trades.append({'ts': (now - dt.timedelta(hours=n-i)).isoformat(), 'symbol':'BTCUSDT','side':'BUY','qty':1.0,'price':0.0,'pnl':pnl})
     return trades
 
-def _equity_series(trades, start=1000.0):
+
+def _fallback_buckets(days=7):
+    buckets = {}
+    for t in _fallback_trades(20 * days):
+        b = buckets.setdefault(t['ts'][:10], {'day': t['ts'][:10], 'trades': 0, 'wins': 0, 'pnl': 0.0})
+        b['trades'] += 1; b['wins'] += 1 if t['pnl'] > 0 else 0; b['pnl'] += t['pnl']
+    return [buckets[k] for k in sorted(buckets)]
+
+
+def _equity_series(buckets, start=1000.0):
     eq = start; series = []
-    for t in trades:
-        eq += float(t.get('pnl',0.0))
+    for b in buckets:
+        eq += float(b.get('pnl',0.0))
         series.append(eq)
     return series
 
+
 def _save_plot(series, out_path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(6,3))
     plt.plot(range(1,len(series)+1), series, marker='o')
     plt.title('Equity curve')
-    plt.xlabel('Trade #'); plt.ylabel('Balance USDT')
+    plt.xlabel('Day #'); plt.ylabel('Balance USDT')
     plt.tight_layout(); plt.savefig(out_path); plt.close()
 
-def generate_weekly_report():
-    report_dir = 'data/reports'; os.makedirs(report_dir, exist_ok=True)
-    file = os.path.join(report_dir, f"report_{datetime.date.today()}.pdf")
-    trades = fetch_trades(7)
-    if not trades:
-        trades = _fallback_trades(20)
-    series = _equity_series(trades, start=1000.0)
-    graph = os.path.join(report_dir, 'equity.png')
-    _save_plot(series, graph)
 
-    # stats
-    total = len(trades); wins = sum(1 for t in trades if float(t.get('pnl',0))>0)
-    winrate = wins/total*100 if total else 0; total_pnl = sum(float(t.get('pnl',0)) for t in trades)
-    avg = total_pnl/total if total else 0
+def _cached_plot(series):
+    """Отрисовать график equity, переиспользуя картинку для тех же данных"""
+    os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+    digest = hashlib.sha256(','.join(f'{v:.8f}' for v in series).encode()).hexdigest()[:16]
+    path = os.path.join(CHART_CACHE_DIR, f'equity_{digest}.png')
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    tmp = path + '.tmp.png'
+    _save_plot(series, tmp)
+    os.replace(tmp, path)
+    _prune_chart_cache()
+    return path
+
 
+def _prune_chart_cache(keep=CHART_CACHE_KEEP):
+    """Удалить старые картинки, оставив keep последних использованных"""
+    files = [os.path.join(CHART_CACHE_DIR, f) for f in os.listdir(CHART_CACHE_DIR) if f.endswith('.png')]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for stale in files[keep:]:
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+
+def generate_weekly_report():
     from reportlab.lib.pagesizes import letter
     from reportlab.pdfgen import canvas
     from reportlab.lib import colors
     from reportlab.platypus import Table, TableStyle
 
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    file = os.path.join(REPORT_DIR, f"report_{datetime.date.today()}.pdf")
+    buckets = fetch_daily_buckets(7)
+    if not buckets:
+        buckets = _fallback_buckets(7)
+    series = _equity_series(buckets, start=1000.0)
+    graph = _cached_plot(series)
+
+    # stats
+    total = sum(b['trades'] for b in buckets); wins = sum(b['wins'] for b in buckets)
+    winrate = wins/total*100 if total else 0; total_pnl = sum(float(b['pnl']) for b in buckets)
+
     c = canvas.Canvas(file, pagesize=letter); width, height = letter
     c.setFont('Helvetica-Bold',16); c.drawString(72, height-54, 'Weekly Trading Report')
     c.setFont('Helvetica',11); c.drawString(72, height-72, f'Date: {datetime.date.today()}')
@@ -72,12 +141,47 @@ def generate_weekly_report():
     c.drawString(72,y, f'Wins: {wins}  Winrate: {winrate:.2f}%'); y-=14
     c.drawString(72,y, f'Total PnL: {total_pnl:.2f} USDT'); y-=20
 
-    table_data = [['#','Timestamp','Symbol','Side','Qty','Price','PnL']]
-    for i,t in enumerate(trades,1):
-        table_data.append([i, t.get('ts',''), t.get('symbol',''), t.get('side',''), t.get('qty',''), t.get('price',''), f"{float(t.get('pnl',0)):.2f}"])
-    table = Table(table_data, colWidths=[30,120,60,40,40,60,60])
+    outcomes = fetch_outcome_stats(7)
+    if outcomes and outcomes['closed']:
+        c.setFont('Helvetica-Bold',11); c.drawString(72,y, 'Signal outcomes'); y-=14
+        c.setFont('Helvetica',11)
+        c.drawString(72,y, f"Signals: {outcomes['signals']}  Closed: {outcomes['closed']}  Open: {outcomes['open']}"); y-=14
+        c.drawString(72,y, f"Hit rate TP1/TP2/TP3: {outcomes['hit_rate']:.1f}% / {outcomes['tp2_rate']:.1f}% / "
+                           f"{outcomes['tp3_rate']:.1f}%  Stop before TP1: {outcomes['stop_rate']:.1f}%"); y-=14
+        c.drawString(72,y, f"Avg MAE: {outcomes['avg_mae_pct']:.2f}%  Avg MFE: {outcomes['avg_mfe_pct']:.2f}%  "
+                           f"Avg time to TP1: {outcomes['avg_minutes_to_tp1']:.0f} min"); y-=20
+
+    table_data = [['#','Day','Trades','Wins','PnL']]
+    for i,b in enumerate(buckets,1):
+        table_data.append([i, b['day'], b['trades'], b['wins'], f"{float(b['pnl']):.2f}"])
+    table = Table(table_data, colWidths=[30,100,60,60,80])
     table.setStyle(TableStyle([('BACKGROUND',(0,0),(-1,0),colors.grey),('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),('ALIGN',(0,0),(-1,-1),'CENTER'),('GRID',(0,0),(-1,-1),0.5,colors.black)]))
     tw, th = table.wrap(0,0); table.drawOn(c,72,y-th)
     c.drawImage(graph, 72, max(40, y-th-220), width=450, height=200)
     c.save()
     return file
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1)
+    return _executor
+
+
+async def generate_weekly_report_async():
+    """Сгенерировать отчет в отдельном процессе, не блокируя event loop"""
+    global _executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_executor(), generate_weekly_report)
+    except BrokenProcessPool as e:
+        # Процесс-воркер упал - пересоздаем пул при следующем вызове
+        broken, _executor = _executor, None
+        if broken is not None:
+            broken.shutdown(wait=False)
+        logger.error(f"Report worker died: {e}")
+        raise
+    except Exception as e:
+        logger.error(f"Report worker error: {e}")
+        raise
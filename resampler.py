@@ -0,0 +1,70 @@
+import logging
+from typing import List
+import numpy as np
+import pandas as pd
+from data import FLOW_COLUMNS, INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+
+def resample_ohlcv(open_time_ms: np.ndarray, open_: np.ndarray, high: np.ndarray, low: np.ndarray,
+                   close: np.ndarray, volume: np.ndarray, base_ms: int, target_ms: int, sums: dict = None) -> dict:
+    """Агрегировать свечи базового таймфрейма в старший (векторно, reduceat).
+
+    Возвращает массивы OHLCV старшего ТФ и маску complete: бар полный, только если
+    в нем есть все target_ms / base_ms базовых свечей (последний бар обычно частичный).
+    sums - дополнительные колонки, суммируемые по бару (quote_volume, taker_buy_base).
+    """
+    sums = sums or {}
+    if len(open_time_ms) == 0:
+        empty = np.empty(0)
+        return {'open_time': np.empty(0, dtype=np.int64), 'open': empty, 'high': empty, 'low': empty,
+                'close': empty, 'volume': empty, **{name: empty for name in sums},
+                'complete': np.empty(0, dtype=bool)}
+
+    buckets = open_time_ms // target_ms * target_ms
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.concatenate((starts[1:], [len(buckets)])) - 1
+    counts = ends - starts + 1
+
+    return {
+        'open_time': buckets[starts],
+        'open': open_[starts],
+        'high': np.maximum.reduceat(high, starts),
+        'low': np.minimum.reduceat(low, starts),
+        'close': close[ends],
+        'volume': np.add.reduceat(volume, starts),
+        **{name: np.add.reduceat(values, starts) for name, values in sums.items()},
+        'complete': counts == target_ms // base_ms,
+    }
+
+
+def resample_frame(df: pd.DataFrame, base_interval: str, target_interval: str,
+                   include_partial: bool = False) -> pd.DataFrame:
+    """Построить DataFrame старшего ТФ (формат fetch_klines) из базовых свечей"""
+    open_time_ms = df['open_time'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+    sums = {col: df[col].to_numpy() for col in FLOW_COLUMNS if col in df}
+    bars = resample_ohlcv(open_time_ms, df['open'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy(),
+                          df['close'].to_numpy(), df['volume'].to_numpy(),
+                          INTERVAL_MS[base_interval], INTERVAL_MS[target_interval], sums)
+    mask = slice(None) if include_partial else bars['complete']
+    return pd.DataFrame({
+        'open_time': pd.to_datetime(bars['open_time'][mask], unit='ms', utc=True),
+        'open': bars['open'][mask],
+        'high': bars['high'][mask],
+        'low': bars['low'][mask],
+        'close': bars['close'][mask],
+        'volume': bars['volume'][mask],
+        **{col: bars[col][mask] for col in sums},
+    })
+
+
+def compare_bars(derived: pd.DataFrame, exchange: pd.DataFrame, rtol: float = 1e-6) -> List[pd.Timestamp]:
+    """Сверить построенные бары с барами биржи; вернуть open_time расхождений"""
+    merged = derived.merge(exchange, on='open_time', suffixes=('', '_ex'))
+    if merged.empty:
+        return []
+    bad = np.zeros(len(merged), dtype=bool)
+    for col in ('open', 'high', 'low', 'close', 'volume'):
+        bad |= ~np.isclose(merged[col].to_numpy(), merged[f'{col}_ex'].to_numpy(), rtol=rtol)
+    return list(merged['open_time'][bad])
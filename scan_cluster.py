@@ -0,0 +1,289 @@
+"""Кластерный режим сканирования: координатор + процессы-воркеры.
+
+Координатор раздает символы воркерам по консистентному хэшированию, поэтому
+у каждого символа постоянный владелец со своим кэшем свечей и состоянием
+индикаторов. Воркеры присылают сигналы по мере нахождения, итоговое
+ранжирование делает MarketScanner.get_best_signals.
+
+Удаленный воркер (координатор должен слушать TCP-адрес):
+
+    IPC_SECRET=... python scan_cluster.py worker --connect 10.0.0.5:7400
+
+Слушать не-loopback TCP-адрес можно только с IPC_SECRET: воркер присылает
+его в hello, чужие подключения координатор закрывает.
+"""
+import argparse
+import asyncio
+import bisect
+import dataclasses
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Set, Tuple
+import ipc
+from logging_setup import setup_logging
+from metrics import SIGNALS_TOTAL
+from tracing import Trace
+
+logger = logging.getLogger(__name__)
+
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', '0'))
+SCAN_CLUSTER_ADDRESS = os.getenv('SCAN_CLUSTER_ADDRESS', 'unix:data/scan_cluster.sock')
+SCAN_TIMEOUT = float(os.getenv('SCAN_CLUSTER_TIMEOUT', '120'))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Консистентное хэширование: при добавлении/удалении узла переезжает ~1/N символов"""
+
+    def __init__(self, replicas: int = 100):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self._nodes: Set[str] = set()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add(self, node: str):
+        # Повторный hello того же воркера (переподключение) не должен удваивать его точки
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node: str):
+        self._nodes.discard(node)
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: n for p, n in self._owners.items() if n != node}
+
+    def node_for(self, key: str) -> str:
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[i]]
+
+    def partition(self, keys: List[str]) -> Dict[str, List[str]]:
+        parts: Dict[str, List[str]] = {}
+        for key in keys:
+            parts.setdefault(self.node_for(key), []).append(key)
+        return parts
+
+
+def encode_signal(data: dict) -> dict:
+    encoded = {**data, 'signal': dataclasses.asdict(data['signal'])}
+    if data.get('trace') is not None:
+        encoded['trace'] = data['trace'].to_dict()
+    return encoded
+
+
+def decode_signal(data: dict) -> dict:
+    from strategies import Signal
+    decoded = {**data, 'signal': Signal(**data['signal'])}
+    if data.get('trace') is not None:
+        decoded['trace'] = Trace.from_dict(data['trace'])
+    return decoded
+
+
+class _Scan:
+    """Состояние одного распределенного скана"""
+
+    def __init__(self):
+        self.results: Dict[str, Dict] = {}
+        # batch -> (воркер, символы), пока воркер не ответил done
+        self.pending: Dict[int, Tuple[str, List[str]]] = {}
+        self.batches = 0
+        self.done = asyncio.Event()
+
+
+class ScanCoordinator:
+    """Координатор кластера: принимает воркеров, делит символы и собирает сигналы"""
+
+    def __init__(self, workers: int = SCAN_WORKERS, address: str = SCAN_CLUSTER_ADDRESS,
+                 timeout: float = SCAN_TIMEOUT):
+        self.workers = workers
+        self.address = address
+        self.timeout = timeout
+        self.ring = HashRing()
+        self._writers: Dict[str, asyncio.StreamWriter] = {}
+        self._scans: Dict[int, _Scan] = {}
+        self._scan_seq = 0
+        self._processes: List[subprocess.Popen] = []
+        self._server = None
+        self._joined = None
+
+    @property
+    def size(self) -> int:
+        return len(self._writers)
+
+    async def start(self, wait: float = 60):
+        """Поднять сервер, запустить локальных воркеров и дождаться их подключения"""
+        self._joined = asyncio.Condition()
+        self._server = await ipc.start_server(self._handle_worker, self.address)
+        # Отдельный интерпретатор: воркер не импортирует bot.py и не наследует его loop и соединения
+        for i in range(self.workers):
+            self._processes.append(subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), 'worker', '--connect', self.address,
+                 '--id', f"{os.getpid()}-{i}"]))
+        async with self._joined:
+            await asyncio.wait_for(self._joined.wait_for(lambda: self.size >= self.workers), wait)
+        logger.info(f"Scan cluster started with {self.size} workers on {self.address}")
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._writers.values()):
+            writer.close()
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._processes = []
+
+    async def _handle_worker(self, reader, writer):
+        worker = None
+        try:
+            hello = await ipc.read_message(reader)
+            if not ipc.authorized(hello):
+                logger.warning(f"Rejected scan worker {hello.get('worker')!r}: bad secret")
+                return
+            worker = hello['worker']
+            self._writers[worker] = writer
+            self.ring.add(worker)
+            logger.info(f"Scan worker {worker} joined (pid {hello.get('pid')}), {self.size} workers")
+            async with self._joined:
+                self._joined.notify_all()
+
+            while True:
+                message = await ipc.read_message(reader)
+                scan = self._scans.get(message.get('scan_id'))
+                if scan is None:
+                    continue
+                if message['type'] == 'signal':
+                    data = decode_signal(message['data'])
+                    scan.results[message['symbol']] = data
+                    SIGNALS_TOTAL.labels(data['signal'].side).inc()
+                elif message['type'] == 'done':
+                    scan.pending.pop(message['batch'], None)
+                    if not scan.pending:
+                        scan.done.set()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Scan worker {worker} error: {e}")
+        finally:
+            writer.close()
+            if worker is not None and self._writers.get(worker) is writer:
+                await self._remove_worker(worker)
+
+    async def _remove_worker(self, worker: str):
+        """Воркер отключился: убрать из кольца и переназначить его незавершенные символы"""
+        del self._writers[worker]
+        self.ring.remove(worker)
+        logger.warning(f"Scan worker {worker} left, {self.size} workers")
+        for scan_id, scan in list(self._scans.items()):
+            lost = [batch for batch, (owner, _) in scan.pending.items() if owner == worker]
+            symbols = [symbol for batch in lost for symbol in scan.pending.pop(batch)[1]]
+            if symbols:
+                await self._dispatch(scan_id, scan, symbols)
+
+    async def _dispatch(self, scan_id: int, scan: _Scan, symbols: List[str]):
+        if not self.size:
+            # Воркеров не осталось - отдаем то, что успели собрать
+            scan.done.set()
+            return
+        for worker, part in self.ring.partition(symbols).items():
+            scan.batches += 1
+            batch = scan.batches
+            scan.pending[batch] = (worker, part)
+            try:
+                await ipc.send_message(self._writers[worker], {'type': 'scan', 'scan_id': scan_id, 'batch': batch,
+                                                               'symbols': part})
+            except (ConnectionError, KeyError):
+                # Отключение обработает _handle_worker этого воркера
+                pass
+
+    async def scan(self, symbols: List[str]) -> Dict[str, Dict]:
+        """Просканировать символы в кластере; результат в формате MarketScanner.scan_symbols"""
+        if not self.size:
+            raise RuntimeError("no scan workers connected")
+        self._scan_seq += 1
+        scan_id, scan = self._scan_seq, _Scan()
+        self._scans[scan_id] = scan
+        started = time.perf_counter()
+        try:
+            await self._dispatch(scan_id, scan, list(symbols))
+            if scan.pending:
+                await asyncio.wait_for(scan.done.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Cluster scan timed out, waiting for {sorted({w for w, _ in scan.pending.values()})}")
+        finally:
+            del self._scans[scan_id]
+        logger.info(f"Cluster scan of {len(symbols)} symbols on {self.size} workers: "
+                    f"{len(scan.results)} signals in {time.perf_counter() - started:.2f}s")
+        return scan.results
+
+
+async def run_worker(address: str, worker: str):
+    """Воркер: свой MarketScanner (кэш свечей, тренд старшего ТФ), сканирует присланные символы"""
+    from market_hub import MARKET_HUB_ADDRESS, HubClient
+    from market_scanner import MarketScanner
+    scanner = MarketScanner()
+    if MARKET_HUB_ADDRESS:
+        scanner.use_hub(HubClient(MARKET_HUB_ADDRESS, name=f"scan-worker-{worker}"))
+    reader, writer = await ipc.open_connection(address)
+    await ipc.send_message(writer, ipc.hello(worker=worker))
+    send_lock = asyncio.Lock()
+
+    async def send(message):
+        async with send_lock:
+            await ipc.send_message(writer, message)
+
+    async def handle(message):
+        scan_id = message['scan_id']
+
+        async def on_signal(symbol, data):
+            await send({'type': 'signal', 'scan_id': scan_id, 'symbol': symbol, 'data': encode_signal(data)})
+
+        await scanner.scan_symbols(message['symbols'], on_signal=on_signal)
+        await send({'type': 'done', 'scan_id': scan_id, 'batch': message['batch']})
+
+    tasks = set()
+    try:
+        while True:
+            message = await ipc.read_message(reader)
+            if message['type'] == 'scan':
+                task = asyncio.create_task(handle(message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        logger.info(f"Scan worker {worker}: coordinator closed the connection")
+
+
+def worker_main(address: str, worker: str):
+    setup_logging()
+    try:
+        asyncio.run(run_worker(address, worker))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scan cluster worker')
+    sub = parser.add_subparsers(dest='command', required=True)
+    worker_parser = sub.add_parser('worker')
+    worker_parser.add_argument('--connect', default=SCAN_CLUSTER_ADDRESS, help='адрес координатора')
+    worker_parser.add_argument('--id', default=None, help='имя воркера (по умолчанию host-pid)')
+    args = parser.parse_args()
+    import socket
+    worker_main(args.connect, args.id or f"{socket.gethostname()}-{os.getpid()}")
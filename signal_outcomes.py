@@ -0,0 +1,140 @@
+"""Оценка исходов опубликованных сигналов по свечам после публикации.
+
+Для каждого сигнала определяется, что цена коснулась раньше - стопа или
+TP1/TP2/TP3, когда это произошло и какими были MAE/MFE. Вместо прохода по
+барам строятся накопленные максимум и минимум цены (монотонные ряды), и
+первое касание каждого уровня находится через searchsorted. Состояние
+(экстремумы, время касаний, следующая свеча) хранится в signal_outcomes,
+поэтому каждый запуск докачивает только новые свечи.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List
+import numpy as np
+from data import INTERVAL_MS, KlineBatch, fetch_kline_batch
+from db import get_open_signal_outcomes, save_signal_outcomes, sync_signal_outcomes
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_INTERVAL = os.getenv('OUTCOME_INTERVAL', '5m')
+OUTCOME_HORIZON_HOURS = float(os.getenv('OUTCOME_HORIZON_HOURS', '48'))
+OUTCOME_CONCURRENCY = int(os.getenv('OUTCOME_CONCURRENCY', '10'))
+MAX_KLINES_PER_REQUEST = 1500  # лимит /fapi/v1/klines
+
+OPEN = 'OPEN'
+STOP = 'STOP'
+TP3 = 'TP3'
+EXPIRED = 'EXPIRED'
+TARGETS = ('tp1', 'tp2', 'tp3')
+
+
+def evaluate_outcome(outcome: Dict, batch: KlineBatch, interval_ms: int, horizon_ms: int) -> bool:
+    """Продолжить оценку исхода по новым закрытым свечам batch (по возрастанию open_time).
+
+    Если стоп и тейк задеты одной свечой, порядок внутри свечи неизвестен -
+    считаем, что первым был стоп (консервативная оценка).
+    Возвращает True, если состояние изменилось.
+    """
+    end_ms = outcome['start_ms'] + horizon_ms
+    start = int(np.searchsorted(batch.open_time, outcome['next_ms']))
+    end = int(np.searchsorted(batch.open_time, end_ms))
+    if start >= end:
+        if outcome['next_ms'] >= end_ms:
+            outcome['status'] = EXPIRED
+            return True
+        return False
+
+    # Приводим SHORT к LONG сменой знака: движение в плюс - вверх, в минус - вниз
+    sign = 1.0 if outcome['side'] == 'LONG' else -1.0
+    favorable = batch.high[start:end] if sign > 0 else -batch.low[start:end]
+    adverse = batch.low[start:end] if sign > 0 else -batch.high[start:end]
+    if outcome['max_price'] is None:
+        best0, worst0 = -np.inf, np.inf
+    elif sign > 0:
+        best0, worst0 = outcome['max_price'], outcome['min_price']
+    else:
+        best0, worst0 = -outcome['min_price'], -outcome['max_price']
+
+    # Накопленные экстремумы с учетом уже проверенных свечей
+    best = np.maximum.accumulate(np.concatenate(([best0], favorable)))[1:]
+    worst = np.minimum.accumulate(np.concatenate(([worst0], adverse)))[1:]
+    n = len(best)
+
+    targets = sign * np.array([outcome[k] for k in TARGETS], dtype=np.float64)
+    target_idx = np.searchsorted(best, targets, side='left')  # первый бар, где best >= цели
+    stop_idx = int(np.searchsorted(-worst, -sign * outcome['stop'], side='left'))  # worst <= стопа
+
+    close_time = batch.close_time[start:end]
+    for key, idx in zip(TARGETS, target_idx):
+        # Уже задетые уровни не пересматриваем; касание одной свечой со стопом не засчитываем
+        if outcome[f'{key}_ms'] is None and idx < stop_idx:
+            outcome[f'{key}_ms'] = int(close_time[idx])
+    outcome['best_tp'] = sum(outcome[f'{key}_ms'] is not None for key in TARGETS)
+
+    exit_idx = min(stop_idx, int(target_idx[2]))
+    last = min(exit_idx, n - 1)
+    if sign > 0:
+        outcome['max_price'], outcome['min_price'] = float(best[last]), float(worst[last])
+    else:
+        outcome['max_price'], outcome['min_price'] = float(-worst[last]), float(-best[last])
+    entry = sign * outcome['entry']
+    outcome['mfe_pct'] = max(float(best[last]) - entry, 0.0) / outcome['entry'] * 100
+    outcome['mae_pct'] = max(entry - float(worst[last]), 0.0) / outcome['entry'] * 100
+    outcome['next_ms'] = int(batch.open_time[start + last]) + interval_ms
+
+    if exit_idx < n:
+        if stop_idx <= target_idx[2]:
+            outcome['stop_ms'] = int(close_time[stop_idx])
+            outcome['status'] = STOP
+        else:
+            outcome['status'] = TP3
+    elif outcome['next_ms'] >= end_ms:
+        outcome['status'] = EXPIRED
+    return True
+
+
+async def _evaluate_symbol(symbol: str, outcomes: List[Dict], semaphore: asyncio.Semaphore, now_ms: int,
+                           interval: str, horizon_ms: int) -> List[Dict]:
+    interval_ms = INTERVAL_MS[interval]
+    start_ms = min(o['next_ms'] for o in outcomes)
+    limit = min(MAX_KLINES_PER_REQUEST, (now_ms - start_ms) // interval_ms + 1)
+    if limit <= 0:
+        return []
+    async with semaphore:
+        batch = await fetch_kline_batch(symbol, interval, limit, start_ms=start_ms)
+    batch = batch.closed(now_ms)
+    return [o for o in outcomes if evaluate_outcome(o, batch, interval_ms, horizon_ms)]
+
+
+async def update_signal_outcomes(now_ms: int = None, interval: str = OUTCOME_INTERVAL,
+                                 horizon_hours: float = OUTCOME_HORIZON_HOURS) -> Dict:
+    """Завести исходы новых сигналов и продвинуть открытые по закрытым свечам"""
+    now_ms = now_ms or int(time.time() * 1000)
+    horizon_ms = int(horizon_hours * 3_600_000)
+    added = sync_signal_outcomes(INTERVAL_MS[interval])
+
+    by_symbol = defaultdict(list)
+    for outcome in get_open_signal_outcomes():
+        by_symbol[outcome['symbol']].append(outcome)
+
+    semaphore = asyncio.Semaphore(OUTCOME_CONCURRENCY)
+    results = await asyncio.gather(*[
+        _evaluate_symbol(symbol, outcomes, semaphore, now_ms, interval, horizon_ms)
+        for symbol, outcomes in by_symbol.items()
+    ], return_exceptions=True)
+
+    changed = []
+    for symbol, result in zip(by_symbol, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Outcome evaluation for {symbol} failed: {result}")
+            continue
+        changed.extend(result)
+    if changed:
+        save_signal_outcomes(changed)
+
+    closed = sum(o['status'] != OPEN for o in changed)
+    logger.info(f"Signal outcomes: {added} new, {len(changed)} updated, {closed} closed")
+    return {'added': added, 'updated': len(changed), 'closed': closed}
@@ -0,0 +1,122 @@
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+NEW = 'NEW'
+ACTIVE = 'ACTIVE'
+UPDATED = 'UPDATED'
+EXPIRED = 'EXPIRED'
+
+
+@dataclass
+class TrackedSignal:
+    symbol: str
+    side: str
+    strategy: str
+    state: str
+    signal: object
+    entry: float
+    stop: float
+    first_seen: float
+    last_seen: float
+    last_emitted: float
+
+
+@dataclass
+class Transition:
+    state: str
+    tracked: TrackedSignal
+    data: dict = None
+
+
+def _changed_pct(old: float, new: float) -> float:
+    return abs(new - old) / abs(old) * 100 if old else float('inf')
+
+
+class SignalTracker:
+    """Жизненный цикл сигналов по ключу (symbol, side, strategy).
+
+    Повторно найденный сигнал с теми же уровнями остается ACTIVE и не
+    сохраняется/не рассылается. Наружу отдаются только переходы:
+    NEW - сигнал появился, UPDATED - вход или стоп сдвинулись больше порога
+    (не чаще раза в cooldown), EXPIRED - сигнал не находится дольше
+    expire_after или появился сигнал в обратную сторону.
+    """
+
+    def __init__(self, cooldown: float = None, entry_change_pct: float = None,
+                 stop_change_pct: float = None, expire_after: float = None):
+        self.cooldown = cooldown if cooldown is not None else float(os.getenv('SIGNAL_COOLDOWN_SEC', '1800'))
+        self.entry_change_pct = (entry_change_pct if entry_change_pct is not None
+                                 else float(os.getenv('SIGNAL_ENTRY_CHANGE_PCT', '0.5')))
+        self.stop_change_pct = (stop_change_pct if stop_change_pct is not None
+                                else float(os.getenv('SIGNAL_STOP_CHANGE_PCT', '0.5')))
+        self.expire_after = expire_after if expire_after is not None else float(os.getenv('SIGNAL_EXPIRE_SEC', '900'))
+        self._index: Dict[Tuple[str, str, str], TrackedSignal] = {}
+
+    def update(self, signals: List[dict], strategy: str = 'multi', now: float = None) -> List[Transition]:
+        """Учесть результат скана (элементы get_best_signals) и вернуть переходы состояний"""
+        now = time.time() if now is None else now
+        transitions = []
+        seen = set()
+
+        for data in signals:
+            signal = data['signal']
+            if signal.side == 'NONE':
+                continue
+            key = (data['symbol'], signal.side, strategy)
+            seen.add(key)
+            tracked = self._index.get(key)
+
+            # Сигнал в обратную сторону закрывает текущий
+            opposite = self._index.pop((key[0], 'SHORT' if signal.side == 'LONG' else 'LONG', strategy), None)
+            if opposite is not None:
+                opposite.state = EXPIRED
+                transitions.append(Transition(EXPIRED, opposite))
+
+            if tracked is None:
+                tracked = self._index[key] = TrackedSignal(data['symbol'], signal.side, strategy, NEW, signal,
+                                                           signal.entry, signal.stop, now, now, now)
+                transitions.append(Transition(NEW, tracked, data))
+                continue
+
+            tracked.signal = signal
+            tracked.last_seen = now
+            moved = (_changed_pct(tracked.entry, signal.entry) >= self.entry_change_pct
+                     or _changed_pct(tracked.stop, signal.stop) >= self.stop_change_pct)
+            if moved and now - tracked.last_emitted >= self.cooldown:
+                tracked.state = UPDATED
+                tracked.entry, tracked.stop = signal.entry, signal.stop
+                tracked.last_emitted = now
+                transitions.append(Transition(UPDATED, tracked, data))
+            else:
+                tracked.state = ACTIVE
+
+        for key, tracked in list(self._index.items()):
+            if key not in seen and now - tracked.last_seen >= self.expire_after:
+                tracked.state = EXPIRED
+                del self._index[key]
+                transitions.append(Transition(EXPIRED, tracked))
+
+        if transitions:
+            logger.info("Signal transitions: " + ", ".join(f"{t.tracked.symbol} {t.tracked.side} {t.state}"
+                                                          for t in transitions))
+        return transitions
+
+    def active(self) -> List[TrackedSignal]:
+        return list(self._index.values())
+
+    def snapshot(self) -> List[dict]:
+        """Активные сигналы простыми словарями (для чекпоинта)"""
+        return [asdict(tracked) for tracked in self._index.values()]
+
+    def restore(self, items: List[dict]) -> int:
+        """Вернуть активные сигналы после рестарта: повторная находка не рассылается как NEW"""
+        from strategies import Signal
+        for item in items:
+            tracked = TrackedSignal(**{**item, 'signal': Signal(**item['signal'])})
+            self._index[(tracked.symbol, tracked.side, tracked.strategy)] = tracked
+        return len(items)
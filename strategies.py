@@ -1,11 +1,17 @@
+import os
 import pandas as pd
 import pandas_ta as ta
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Tuple
 import logging
+from metrics import ADD_INDICATORS_SECONDS, GENERATE_SIGNAL_SECONDS, HTF_CACHE_TOTAL, timed
 
 logger = logging.getLogger(__name__)
 
+# Дисбаланс тейкеров (-1..1), начиная с которого поток сделок влияет на уверенность
+FLOW_IMBALANCE_THRESHOLD = float(os.getenv('FLOW_IMBALANCE_THRESHOLD', '0.1'))
+
 
 @dataclass
 class Signal:
@@ -19,6 +25,7 @@ class Signal:
     confidence: float = 0.0
 
 
+@timed(ADD_INDICATORS_SECONDS)
 def add_indicators(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
 
@@ -80,8 +87,60 @@ def trend_bias_from_last(row) -> Tuple[str, float]:
         return 'flat', 0
 
 
-def calculate_confidence(bias: str, rsi: float, macd: float, macd_signal: float, volume_ratio: float = 1.0) -> float:
-    """Рассчитать уверенность в сигнале с улучшенной логикой"""
+class HigherTimeframeCache:
+    """Кэш индикаторов и тренда старшего ТФ по (symbol, timeframe, open_time последней свечи).
+
+    Пока на старшем ТФ не закрылась новая свеча, тренд не пересчитывается.
+    Вытеснение LRU по количеству символов.
+    """
+
+    def __init__(self, max_symbols: int = 500):
+        self.max_symbols = max_symbols
+        # symbol -> {timeframe: (last_open_time, bias, strength, snapshot)}
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, symbol: str, timeframe: str, df_higher: pd.DataFrame) -> Tuple[str, float]:
+        last_open_time = df_higher['open_time'].iloc[-1]
+        by_timeframe = self._entries.get(symbol)
+        entry = by_timeframe.get(timeframe) if by_timeframe else None
+        if entry is not None and entry[0] == last_open_time:
+            self._entries.move_to_end(symbol)
+            HTF_CACHE_TOTAL.labels('hit').inc()
+            return entry[1], entry[2]
+
+        HTF_CACHE_TOTAL.labels('miss').inc()
+        bias, strength, snapshot = 'flat', 0, {}
+        dh = add_indicators(df_higher)
+        if not dh.empty:
+            last = dh.iloc[-1]
+            bias, strength = trend_bias_from_last(last)
+            snapshot = last.to_dict()
+
+        self._entries.setdefault(symbol, {})[timeframe] = (last_open_time, bias, strength, snapshot)
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.max_symbols:
+            self._entries.popitem(last=False)
+        return bias, strength
+
+    def snapshot(self, symbol: str, timeframe: str) -> dict:
+        """Последние значения индикаторов старшего ТФ (пустой dict, если нет в кэше)"""
+        entry = self._entries.get(symbol, {}).get(timeframe)
+        return entry[3] if entry else {}
+
+    def clear(self):
+        self._entries.clear()
+
+
+higher_tf_cache = HigherTimeframeCache(int(os.getenv('HTF_CACHE_MAX_SYMBOLS', '500')))
+
+
+def calculate_confidence(bias: str, rsi: float, macd: float, macd_signal: float, volume_ratio: float = 1.0,
+                         flow: dict = None) -> float:
+    """Рассчитать уверенность в сигнале с улучшенной логикой.
+
+    flow - признаки потока сделок (trade_flow): дисбаланс тейкеров и положение цены относительно VWAP;
+    передаются только при живом потоке aggTrade, без него уверенность не поправляется
+    """
     confidence = 0.0
 
     try:
@@ -115,13 +174,35 @@ def calculate_confidence(bias: str, rsi: float, macd: float, macd_signal: float,
         elif volume_ratio < 0.8:  # Низкий объем
             confidence -= 0.1
 
+        # Поток сделок (если доступен): агрессоры и VWAP должны быть на стороне тренда
+        if flow and bias in ('up', 'down'):
+            direction = 1 if bias == 'up' else -1
+            imbalance = flow.get('imbalance', 0.0) * direction
+            if imbalance > FLOW_IMBALANCE_THRESHOLD:
+                confidence += 0.1
+            elif imbalance < -FLOW_IMBALANCE_THRESHOLD:
+                confidence -= 0.1
+            vwap_distance = flow.get('vwap_distance_pct', 0.0) * direction
+            if vwap_distance > 0:  # Лонг выше VWAP, шорт ниже
+                confidence += 0.05
+            elif vwap_distance < 0:
+                confidence -= 0.05
+
     except Exception as e:
         logger.debug(f"Confidence calculation error: {e}")
 
     return min(1.0, max(0.0, confidence))
 
 
-def generate_signal_from_dfs(df_main: pd.DataFrame, df_higher: pd.DataFrame = None) -> Signal:
+def _flow_reason(flow: dict) -> str:
+    if not flow:
+        return ''
+    return f", Taker imbalance: {flow['imbalance']:+.2f}, VWAP {flow['vwap_distance_pct']:+.2f}%"
+
+
+@timed(GENERATE_SIGNAL_SECONDS)
+def generate_signal_from_dfs(df_main: pd.DataFrame, df_higher: pd.DataFrame = None, symbol: str = None,
+                             higher_timeframe: str = '1h', flow: dict = None) -> Signal:
     try:
         df = add_indicators(df_main)
         if df.empty:
@@ -141,9 +222,13 @@ def generate_signal_from_dfs(df_main: pd.DataFrame, df_higher: pd.DataFrame = No
         higher_strength = 0
         if df_higher is not None:
             try:
-                dh = add_indicators(df_higher)
-                if not dh.empty:
-                    higher_bias, higher_strength = trend_bias_from_last(dh.iloc[-1])
+                if symbol and not df_higher.empty and 'open_time' in df_higher:
+                    # Тренд старшего ТФ меняется только с закрытием его свечи
+                    higher_bias, higher_strength = higher_tf_cache.get(symbol, higher_timeframe, df_higher)
+                else:
+                    dh = add_indicators(df_higher)
+                    if not dh.empty:
+                        higher_bias, higher_strength = trend_bias_from_last(dh.iloc[-1])
             except Exception as e:
                 logger.debug(f"Higher timeframe analysis error: {e}")
 
@@ -155,7 +240,7 @@ def generate_signal_from_dfs(df_main: pd.DataFrame, df_higher: pd.DataFrame = No
         volume_ratio = last.get('volume', 1) / last.get('volume_sma', 1) if 'volume_sma' in last else 1.0
 
         # Рассчитываем уверенность
-        confidence = calculate_confidence(bias, rsi, macd, macd_signal, volume_ratio)
+        confidence = calculate_confidence(bias, rsi, macd, macd_signal, volume_ratio, flow)
 
         # УСИЛИВАЕМ ТРЕБОВАНИЯ: старший ТФ должен подтверждать сигнал
         if higher_bias != bias and higher_strength > 2:
@@ -201,6 +286,7 @@ def generate_signal_from_dfs(df_main: pd.DataFrame, df_higher: pd.DataFrame = No
             tp2 = entry + risk * 1.5
             tp3 = entry + risk * 2.0
             reason = f"STRONG LONG: Multi-TF confirmation, RSI {rsi:.1f}, Trend strength: {trend_strength:.1f}"
+            reason += _flow_reason(flow)
             return Signal('LONG', reason, entry, stop, tp1, tp2, tp3, confidence)
 
         elif short_score >= 5:  # 5 из 7 условий
@@ -210,6 +296,7 @@ def generate_signal_from_dfs(df_main: pd.DataFrame, df_higher: pd.DataFrame = No
             tp2 = entry - risk * 1.5
             tp3 = entry - risk * 2.0
             reason = f"STRONG SHORT: Multi-TF confirmation, RSI {rsi:.1f}, Trend strength: {trend_strength:.1f}"
+            reason += _flow_reason(flow)
             return Signal('SHORT', reason, entry, stop, tp1, tp2, tp3, confidence)
 
         return Signal('NONE',
@@ -0,0 +1,166 @@
+"""Трассировка задержки сигнала: от закрытия свечи на бирже до доставки в Telegram.
+
+Каждый сигнал получает Trace с correlation id. Этапы пишутся спанами
+(start/end в нс по локальным часам), точка отсчета - время закрытия свечи
+по часам биржи. Завершенные трассы хранятся в кольцевом буфере, по этапам
+считаются p50/p95/p99, буфер выгружается в OTLP/JSON (коллектор OTLP_ENDPOINT).
+"""
+import collections
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '2000'))
+OTLP_ENDPOINT = os.getenv('OTLP_ENDPOINT')  # например http://localhost:4318/v1/traces
+SERVICE_NAME = 'crypto_futures_bot'
+# Этапы пути сигнала по порядку (для дашборда)
+STAGES = ['candle_close_to_scan', 'prescreen', 'fetch_klines', 'generate_signal', 'scan', 'order_book',
+          'log_signal', 'notify_websocket', 'telegram_queue', 'telegram_send', 'end_to_end']
+
+
+class Trace:
+    """Трасса одного сигнала: спаны (stage, start_ns, end_ns, attrs)"""
+    __slots__ = ('trace_id', 'name', 'origin_ns', 'spans', 'attributes')
+
+    def __init__(self, name: str, origin_ns: int = None, trace_id: str = None, **attributes):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.name = name
+        # Закрытие свечи по часам биржи (нс); по умолчанию - момент создания
+        self.origin_ns = origin_ns or time.time_ns()
+        self.spans: List[tuple] = []
+        self.attributes = attributes
+
+    def span(self, stage: str, start_ns: int, end_ns: int, **attributes):
+        self.spans.append((stage, start_ns, end_ns, attributes))
+
+    @contextmanager
+    def stage(self, stage: str, **attributes):
+        start = time.time_ns()
+        try:
+            yield
+        finally:
+            self.spans.append((stage, start, time.time_ns(), attributes))
+
+    def to_dict(self) -> dict:
+        return {'trace_id': self.trace_id, 'name': self.name, 'origin_ns': self.origin_ns,
+                'spans': [list(s) for s in self.spans], 'attributes': self.attributes}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Trace':
+        trace = cls(data['name'], data['origin_ns'], data['trace_id'], **data['attributes'])
+        trace.spans = [tuple(s) for s in data['spans']]
+        return trace
+
+
+class Tracer:
+    """Кольцевой буфер завершенных трасс и перцентили по этапам.
+
+    finish() вызывается в event loop бота, а summary/recent/export_otlp - из
+    потока uvicorn: буферы меняются и копируются только под _lock.
+    """
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self.traces = collections.deque(maxlen=size)
+        self._durations: Dict[str, collections.deque] = {}
+        self._unexported = collections.deque(maxlen=size)
+        self.size = size
+        self._lock = threading.Lock()
+
+    def _observe(self, stage: str, seconds: float):
+        durations = self._durations.get(stage)
+        if durations is None:
+            durations = self._durations[stage] = collections.deque(maxlen=self.size)
+        durations.append(seconds)
+
+    def finish(self, trace: Trace, end_ns: int = None):
+        """Завершить трассу: полный путь от закрытия свечи - этап end_to_end"""
+        end_ns = end_ns or time.time_ns()
+        trace.attributes['end_ns'] = end_ns
+        with self._lock:
+            for stage, start, end, _ in trace.spans:
+                self._observe(stage, (end - start) / 1e9)
+            self._observe('end_to_end', (end_ns - trace.origin_ns) / 1e9)
+            self.traces.append(trace)
+            self._unexported.append(trace)
+
+    def summary(self) -> Dict[str, Dict]:
+        """p50/p95/p99 (мс) по этапам за последние size трасс"""
+        result = {}
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        with self._lock:
+            snapshot = {stage: list(durations) for stage, durations in self._durations.items()}
+        for stage, durations in sorted(snapshot.items(), key=lambda x: order.get(x[0], len(order))):
+            values = np.array(durations, dtype=np.float64) * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[stage] = {'count': len(values), 'p50_ms': round(float(p50), 1), 'p95_ms': round(float(p95), 1),
+                             'p99_ms': round(float(p99), 1), 'max_ms': round(float(values.max()), 1)}
+        return result
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        if limit <= 0:
+            return []
+        with self._lock:
+            traces = list(self.traces)[-limit:]
+        return [t.to_dict() for t in traces]
+
+    def export_otlp(self, traces: List[Trace] = None) -> dict:
+        """Трассы в формате OTLP/JSON (ExportTraceServiceRequest)"""
+        if traces is None:
+            with self._lock:
+                traces = list(self.traces)
+        spans = []
+        for trace in traces:
+            root_id = trace.trace_id[:16]
+            spans.append(_otlp_span(trace.trace_id, root_id, '', trace.name, trace.origin_ns,
+                                    trace.attributes.get('end_ns', trace.origin_ns),
+                                    {k: v for k, v in trace.attributes.items() if k != 'end_ns'}))
+            for stage, start, end, attributes in trace.spans:
+                spans.append(_otlp_span(trace.trace_id, secrets.token_hex(8), root_id, stage, start, end, attributes))
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME)]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}],
+        }]}
+
+    async def flush(self, endpoint: str = OTLP_ENDPOINT) -> int:
+        """Отправить новые трассы в OTLP-коллектор"""
+        if not endpoint or not self._unexported:
+            return 0
+        with self._lock:
+            batch = list(self._unexported)
+            self._unexported.clear()
+        import httpx
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                r = await client.post(endpoint, json=self.export_otlp(batch))
+                r.raise_for_status()
+        except Exception as e:
+            logger.warning(f"OTLP export of {len(batch)} traces failed: {e}")
+            return 0
+        return len(batch)
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def _otlp_span(trace_id: str, span_id: str, parent_id: str, name: str, start_ns: int, end_ns: int,
+               attributes: dict) -> dict:
+    return {'traceId': trace_id, 'spanId': span_id, 'parentSpanId': parent_id, 'name': name, 'kind': 1,
+            'startTimeUnixNano': str(start_ns), 'endTimeUnixNano': str(end_ns),
+            'attributes': [_otlp_attribute(k, v) for k, v in attributes.items()]}
+
+
+tracer = Tracer()
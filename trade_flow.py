@@ -0,0 +1,480 @@
+"""Признаки потока сделок: VWAP сессии, профиль объема, кумулятивная дельта, дисбаланс тейкеров.
+
+Сделки приходят из потоков <symbol>@aggTrade (один combined stream на все
+отслеживаемые символы) и складываются в предвыделенный буфер. Состояние
+символов - строки numpy-матриц фиксированного размера; буфер применяется
+пачкой (bincount по строкам), поэтому обработка сделки не создает объектов
+и не зависит от числа символов.
+
+Поток включается явно (TRADE_FLOW=true). Набор символов меняется сообщениями
+SUBSCRIBE/UNSUBSCRIBE в открытом соединении, без переподключения.
+
+Те же признаки считаются и по свечам (kline_flow): Binance отдает в kline
+объем в USDT и объем покупок тейкеров. Ими дополняется поток, который идет
+не с начала суток.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, TYPE_CHECKING
+import numpy as np
+from data import BINANCE_WS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TRADE_FLOW_ENABLED = os.getenv('TRADE_FLOW', 'false').lower() == 'true'
+TRADE_FLOW_SYMBOLS = int(os.getenv('TRADE_FLOW_SYMBOLS', '50'))  # строк в матрицах состояния
+FLOW_WINDOW_SEC = int(os.getenv('FLOW_WINDOW_SEC', '300'))  # окно дисбаланса тейкеров
+FLOW_BUCKET_SEC = int(os.getenv('FLOW_BUCKET_SEC', '5'))
+PROFILE_BINS = int(os.getenv('PROFILE_BINS', '64'))
+PROFILE_BIN_BPS = float(os.getenv('PROFILE_BIN_BPS', '10'))  # ширина корзины профиля объема
+PROFILE_HALF_LIFE_SEC = float(os.getenv('PROFILE_HALF_LIFE_SEC', '3600'))
+FLOW_KLINE_BARS = int(os.getenv('FLOW_KLINE_BARS', '12'))  # свечей для дисбаланса по klines
+SESSION_MS = 86_400_000  # сессия - сутки UTC
+
+
+class TradeFlow:
+    """Инкрементальные признаки потока сделок для нескольких символов"""
+
+    def __init__(self, capacity: int = TRADE_FLOW_SYMBOLS, batch: int = 8192, window_sec: int = FLOW_WINDOW_SEC,
+                 bucket_sec: int = FLOW_BUCKET_SEC, bins: int = PROFILE_BINS, bin_bps: float = PROFILE_BIN_BPS,
+                 half_life_sec: float = PROFILE_HALF_LIFE_SEC):
+        self.capacity = capacity
+        self.bucket_ms = bucket_sec * 1000
+        self.buckets = max(1, window_sec // bucket_sec)
+        self.bins = bins
+        self.bin_width = bin_bps / 1e4
+        self.half_life_ms = half_life_sec * 1000
+        self.index: Dict[str, int] = {}
+        self._free = list(range(capacity - 1, -1, -1))
+
+        # Состояние: по строке на символ
+        self.session = np.full(capacity, -1, dtype=np.int64)  # номер суток UTC
+        self.session_complete = np.zeros(capacity, dtype=bool)  # сессия видна с начала суток
+        self.pv = np.zeros(capacity)  # сумма price * qty за сессию
+        self.volume = np.zeros(capacity)
+        self.delta = np.zeros(capacity)  # кумулятивная дельта: покупки - продажи тейкеров
+        self.trades = np.zeros(capacity, dtype=np.int64)
+        self.last_price = np.zeros(capacity)
+        self.last_ts = np.zeros(capacity, dtype=np.int64)
+        self.buy = np.zeros((capacity, self.buckets))  # объемы тейкеров по временным корзинам
+        self.sell = np.zeros((capacity, self.buckets))
+        self.bucket_id = np.full((capacity, self.buckets), -1, dtype=np.int64)
+        self.anchor = np.zeros(capacity)  # цена центральной корзины профиля
+        self.profile = np.zeros((capacity, bins))
+        self.profile_ts = np.zeros(capacity, dtype=np.int64)
+
+        # Буфер сделок до применения
+        self._rows = np.empty(batch, dtype=np.intp)
+        self._price = np.empty(batch)
+        self._qty = np.empty(batch)
+        self._sign = np.empty(batch)
+        self._ts = np.empty(batch, dtype=np.int64)
+        self._n = 0
+
+        self.source = None
+        self._wanted: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._update_task: Optional[asyncio.Task] = None
+        self._streaming: Set[str] = set()
+
+    # --- строки символов ---
+
+    def row(self, symbol: str) -> int:
+        """Строка символа; при нехватке строк освобождается та, где дольше всего не было сделок"""
+        row = self.index.get(symbol)
+        if row is not None:
+            return row
+        if not self._free:
+            self.flush()
+            self.release(min(self.index, key=lambda s: self.last_ts[self.index[s]]))
+        row = self.index[symbol] = self._free.pop()
+        return row
+
+    def release(self, symbol: str):
+        row = self.index.pop(symbol, None)
+        if row is not None:
+            self.flush()
+            self._reset_row(row)
+            self._free.append(row)
+
+    def _reset_row(self, row: int):
+        self.session[row] = -1
+        self.session_complete[row] = False
+        for array in (self.pv, self.volume, self.delta, self.trades, self.last_price, self.last_ts, self.anchor,
+                      self.profile_ts):
+            array[row] = 0
+        self.buy[row] = 0
+        self.sell[row] = 0
+        self.bucket_id[row] = -1
+        self.profile[row] = 0
+
+    # --- прием сделок ---
+
+    def add(self, row: int, price: float, qty: float, buyer_maker: bool, ts_ms: int):
+        """Добавить сделку в буфер (m=True - агрессор продавец)"""
+        n = self._n
+        self._rows[n] = row
+        self._price[n] = price
+        self._qty[n] = qty
+        self._sign[n] = -1.0 if buyer_maker else 1.0
+        self._ts[n] = ts_ms
+        self._n = n + 1
+        if self._n == len(self._rows):
+            self.flush()
+
+    def add_message(self, message: dict):
+        """Событие aggTrade Binance"""
+        row = self.index.get(message['s'])
+        if row is not None:
+            self.add(row, float(message['p']), float(message['q']), message['m'], message['T'])
+
+    def add_batch(self, rows: np.ndarray, price: np.ndarray, qty: np.ndarray, buyer_maker: np.ndarray,
+                  ts_ms: np.ndarray):
+        """Добавить массив сделок (упорядоченных по времени)"""
+        start = 0
+        while start < len(rows):
+            size = min(len(rows) - start, len(self._rows) - self._n)
+            chunk, n = slice(start, start + size), self._n
+            self._rows[n:n + size] = rows[chunk]
+            self._price[n:n + size] = price[chunk]
+            self._qty[n:n + size] = qty[chunk]
+            self._sign[n:n + size] = np.where(buyer_maker[chunk], -1.0, 1.0)
+            self._ts[n:n + size] = ts_ms[chunk]
+            self._n += size
+            start += size
+            if self._n == len(self._rows):
+                self.flush()
+
+    def flush(self):
+        """Применить буфер к состоянию символов"""
+        n = self._n
+        if not n:
+            return
+        self._n = 0
+        rows, price, qty, sign, ts = self._rows[:n], self._price[:n], self._qty[:n], self._sign[:n], self._ts[:n]
+        capacity = self.capacity
+
+        # Смена суток: сессия строки начинается заново
+        day = ts // SESSION_MS
+        new_session = self.session.copy()
+        np.maximum.at(new_session, rows, day)
+        rolled = new_session > self.session
+        if rolled.any():
+            # Переход через границу суток (а не первая сделка) - сессия видна целиком
+            self.session_complete[rolled] = self.session[rolled] >= 0
+            self.pv[rolled] = 0
+            self.volume[rolled] = 0
+            self.delta[rolled] = 0
+            self.session[rolled] = new_session[rolled]
+        in_session = (day == self.session[rows]).astype(np.float64)
+
+        notional = price * qty
+        self.pv += np.bincount(rows, weights=notional * in_session, minlength=capacity)
+        self.volume += np.bincount(rows, weights=qty * in_session, minlength=capacity)
+        self.delta += np.bincount(rows, weights=sign * qty * in_session, minlength=capacity)
+        self.trades += np.bincount(rows, minlength=capacity)
+
+        # Последняя сделка строки: у последнего вхождения строки в буфере
+        last = n - 1 - np.unique(rows[::-1], return_index=True)[1]
+        touched = rows[last]
+        self.last_price[touched] = price[last]
+        self.last_ts[touched] = ts[last]
+
+        # Временные корзины окна дисбаланса (кольцо по номеру корзины)
+        bucket = ts // self.bucket_ms
+        slot = bucket % self.buckets
+        stale = self.bucket_id[rows, slot] < bucket
+        if stale.any():
+            self.buy[rows[stale], slot[stale]] = 0
+            self.sell[rows[stale], slot[stale]] = 0
+            self.bucket_id[rows[stale], slot[stale]] = bucket[stale]
+        current = self.bucket_id[rows, slot] == bucket
+        flat = rows * self.buckets + slot
+        size = capacity * self.buckets
+        self.buy += np.bincount(flat, weights=qty * (sign > 0) * current, minlength=size).reshape(self.buy.shape)
+        self.sell += np.bincount(flat, weights=qty * (sign < 0) * current, minlength=size).reshape(self.sell.shape)
+
+        self._update_profile(rows, price, qty, touched, last)
+
+    def _update_profile(self, rows, price, qty, touched, last):
+        # Затухание профиля строк с новыми сделками
+        now = self.last_ts[touched]
+        elapsed = np.where(self.profile_ts[touched] > 0, now - self.profile_ts[touched], 0)
+        self.profile[touched] *= (0.5 ** (elapsed / self.half_life_ms))[:, None]
+        self.profile_ts[touched] = now
+
+        # Якорь - цена первой сделки; цена ушла к краю профиля - сдвигаем его
+        new = touched[self.anchor[touched] == 0]
+        self.anchor[new] = self.last_price[new]
+        offset = np.round(np.log(self.last_price[touched] / self.anchor[touched]) / self.bin_width)
+        for row, shift in zip(touched[np.abs(offset) > self.bins // 4], offset[np.abs(offset) > self.bins // 4]):
+            self._recenter(int(row), int(shift))
+
+        index = np.round(np.log(price / self.anchor[rows]) / self.bin_width).astype(np.intp) + self.bins // 2
+        np.clip(index, 0, self.bins - 1, out=index)
+        size = self.capacity * self.bins
+        self.profile += np.bincount(rows * self.bins + index, weights=qty, minlength=size).reshape(self.profile.shape)
+
+    def _recenter(self, row: int, shift: int):
+        profile = self.profile[row]
+        if abs(shift) >= self.bins:
+            profile[:] = 0
+        elif shift > 0:
+            profile[:-shift] = profile[shift:].copy()
+            profile[-shift:] = 0
+        else:
+            profile[-shift:] = profile[:shift].copy()
+            profile[:-shift] = 0
+        self.anchor[row] *= np.exp(shift * self.bin_width)
+
+    # --- признаки ---
+
+    def features(self, symbol: str, now_ms: int = None) -> Optional[Dict]:
+        """Признаки символа по потоку сделок (None, если сделок еще не было)"""
+        row = self.index.get(symbol)
+        if row is None:
+            return None
+        self.flush()
+        if not self.trades[row] or not self.volume[row]:
+            return None
+        now_ms = now_ms or int(time.time() * 1000)
+
+        in_window = self.bucket_id[row] > now_ms // self.bucket_ms - self.buckets
+        buy = float(self.buy[row][in_window].sum())
+        sell = float(self.sell[row][in_window].sum())
+        vwap = float(self.pv[row] / self.volume[row])
+        last = float(self.last_price[row])
+        poc_bin = int(np.argmax(self.profile[row]))
+        poc = float(self.anchor[row] * np.exp((poc_bin - self.bins // 2) * self.bin_width))
+        return {
+            'source': 'trades',
+            'vwap': vwap,
+            'vwap_distance_pct': (last - vwap) / vwap * 100,
+            'cvd': float(self.delta[row]),
+            'imbalance': (buy - sell) / (buy + sell) if buy + sell else 0.0,
+            'buy_volume': buy,
+            'sell_volume': sell,
+            'poc': poc,
+            'poc_distance_pct': (last - poc) / poc * 100,
+            'last_price': last,
+            'session_complete': bool(self.session_complete[row]),
+            'trades': int(self.trades[row]),
+        }
+
+    def flow_features(self, symbol: str, df: 'pd.DataFrame' = None) -> Optional[Dict]:
+        """Признаки для стратегии: поток сделок, дополненный свечами (None, если сделок по символу не было).
+
+        VWAP и дельта сессии берутся из потока, только если он шел с начала суток,
+        иначе - по свечам; дисбаланс тейкеров и цена - всегда из потока.
+        """
+        live = self.features(symbol)
+        if live is None:
+            return None
+        flow = kline_flow(df) if df is not None and not live['session_complete'] else None
+        if flow is None:
+            return live
+        last = live['last_price']
+        return {**flow, 'source': 'klines+trades', 'imbalance': live['imbalance'],
+                'buy_volume': live['buy_volume'], 'sell_volume': live['sell_volume'],
+                'vwap_distance_pct': (last - flow['vwap']) / flow['vwap'] * 100,
+                'poc_distance_pct': (last - flow['poc']) / flow['poc'] * 100, 'last_price': last}
+
+    # --- поток aggTrade ---
+
+    def track(self, symbols: Iterable[str], idle_ttl: float = 900):
+        """Получать сделки этих символов (и запрошенных за последние idle_ttl секунд)"""
+        now = time.monotonic()
+        for symbol in symbols:
+            self._wanted[symbol] = now
+        wanted = sorted((s for s, ts in self._wanted.items() if now - ts <= idle_ttl),
+                        key=self._wanted.get, reverse=True)[:self.capacity]
+        self._wanted = {s: self._wanted[s] for s in wanted}
+        if set(wanted) != self._streaming:
+            self._resubscribe(set(wanted))
+
+    def _resubscribe(self, symbols: Set[str]):
+        for symbol in set(self.index) - symbols:
+            self.release(symbol)
+        for symbol in symbols:
+            self.row(symbol)
+        self._streaming = symbols
+        if not symbols:
+            self._cancel()
+        elif self._task is None:
+            self._task = asyncio.create_task(self._run(), name='trade-flow')
+        elif self.source is not None:
+            # Соединение открыто - меняем подписки в нем; при переподключении _run возьмет _streaming
+            self._update_task = asyncio.create_task(self._update_subscriptions(symbols))
+
+    async def _update_subscriptions(self, symbols: Set[str]):
+        try:
+            await self.source.update(symbols)
+        except Exception as e:
+            logger.warning(f"Trade flow resubscribe failed: {e}")
+
+    def _cancel(self) -> list:
+        tasks = [t for t in (self._task, self._update_task) if t is not None]
+        for task in tasks:
+            task.cancel()
+        self._task = self._update_task = None
+        return tasks
+
+    async def stop(self):
+        await asyncio.gather(*self._cancel(), return_exceptions=True)
+        self._streaming = set()
+
+    async def _run(self, retry_delay: float = 5.0):
+        if self.source is None:
+            self.source = BinanceAggTradeSource()
+        while True:
+            symbols = sorted(self._streaming)
+            try:
+                logger.info(f"Trade flow stream for {len(symbols)} symbols")
+                async for message in self.source.trades(symbols):
+                    self.add_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Trade flow stream error: {e}, reconnecting in {retry_delay}s")
+            await asyncio.sleep(retry_delay)
+
+
+def kline_flow(df: 'pd.DataFrame', bars: int = FLOW_KLINE_BARS, bin_bps: float = PROFILE_BIN_BPS) -> Optional[Dict]:
+    """Те же признаки по свечам (quote_volume, taker_buy_base) за текущие сутки UTC.
+
+    Если df начинается позже начала суток (кадр сканера - 100 свечей 5m, ~8 ч),
+    VWAP, дельта и профиль считаются по всему кадру: session_complete=False,
+    vwap_window='rolling'.
+    """
+    if df is None or df.empty or 'taker_buy_base' not in df:
+        return None
+    open_ms = df['open_time'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+    session_open = open_ms[-1] // SESSION_MS * SESSION_MS
+    session = open_ms >= session_open
+    session_complete = bool(open_ms[0] <= session_open)
+    volume = df['volume'].to_numpy()
+    taker_buy = df['taker_buy_base'].to_numpy()
+    close = df['close'].to_numpy()
+    session_volume = volume[session].sum()
+    if not session_volume:
+        return None
+
+    vwap = float(df['quote_volume'].to_numpy()[session].sum() / session_volume)
+    recent_buy, recent_volume = taker_buy[-bars:].sum(), volume[-bars:].sum()
+    # Профиль объема сессии по типичной цене свечи
+    typical = ((df['high'] + df['low'] + df['close']) / 3).to_numpy()[session]
+    index = np.round(np.log(typical / typical[0]) / (bin_bps / 1e4)).astype(np.int64)
+    counts = np.bincount(index - index.min(), weights=volume[session])
+    poc = float(typical[0] * np.exp((np.argmax(counts) + index.min()) * bin_bps / 1e4))
+    last = float(close[-1])
+    return {
+        'source': 'klines',
+        'vwap': vwap,
+        'vwap_distance_pct': (last - vwap) / vwap * 100,
+        'cvd': float((2 * taker_buy[session] - volume[session]).sum()),
+        'imbalance': float((2 * recent_buy - recent_volume) / recent_volume) if recent_volume else 0.0,
+        'buy_volume': float(recent_buy),
+        'sell_volume': float(recent_volume - recent_buy),
+        'poc': poc,
+        'poc_distance_pct': (last - poc) / poc * 100,
+        'last_price': last,
+        'session_complete': session_complete,
+        'vwap_window': 'session' if session_complete else 'rolling',
+    }
+
+
+# --- источники сделок ---
+
+def _stream(symbol: str) -> str:
+    return f"{symbol.lower()}@aggTrade"
+
+
+class BinanceAggTradeSource:
+    """Combined stream <symbol>@aggTrade для списка символов.
+
+    update() меняет подписки открытого соединения сообщениями SUBSCRIBE/UNSUBSCRIBE.
+    """
+
+    def __init__(self, ws: str = BINANCE_WS):
+        self.ws = ws
+        self._socket = None
+        self._subscribed: Set[str] = set()
+        self._wanted: Set[str] = set()
+        self._request_id = 0
+        self._lock = asyncio.Lock()
+
+    async def trades(self, symbols: List[str]) -> AsyncIterator[dict]:
+        import aiohttp
+        self._wanted = set(symbols)
+        streams = '/'.join(_stream(symbol) for symbol in symbols)
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(f"{self.ws}/stream?streams={streams}", heartbeat=30) as ws:
+                self._socket, self._subscribed = ws, set(symbols)
+                try:
+                    # Набор мог измениться, пока соединение открывалось
+                    await self.update(self._wanted)
+                    async for message in ws:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            data = json.loads(message.data)
+                            # Ответы на SUBSCRIBE/UNSUBSCRIBE ({"result": null, "id": n}) без data
+                            if 'data' in data:
+                                yield data['data']
+                        elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                finally:
+                    self._socket = None
+
+    async def update(self, symbols: Iterable[str]):
+        """Привести подписки открытого соединения к symbols (без соединения - запомнить для trades)"""
+        self._wanted = set(symbols)
+        async with self._lock:
+            if self._socket is None:
+                return
+            wanted = set(self._wanted)
+            for method, diff in (('UNSUBSCRIBE', self._subscribed - wanted), ('SUBSCRIBE', wanted - self._subscribed)):
+                if diff:
+                    self._request_id += 1
+                    await self._socket.send_json({'method': method, 'params': [_stream(s) for s in sorted(diff)],
+                                                  'id': self._request_id})
+            self._subscribed = wanted
+
+
+class FakeTradeSource:
+    """Локальная замена потока aggTrade: случайное блуждание цены, rate сделок в секунду на все символы"""
+
+    def __init__(self, rate: float = 1000, seed: int = 0, price: float = 100.0):
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.price = price
+        self.prices: Dict[str, float] = {}
+        self.trade_id = 0
+        self.symbols: List[str] = []
+
+    def trade(self, symbol: str, ts_ms: int = None) -> dict:
+        price = self.prices.get(symbol, self.price) * (1 + self.rng.gauss(0, 0.0002))
+        self.prices[symbol] = price
+        self.trade_id += 1
+        return {'e': 'aggTrade', 's': symbol, 'a': self.trade_id, 'p': f"{price:.6f}",
+                'q': f"{self.rng.uniform(0.01, 5):.3f}", 'T': ts_ms or int(time.time() * 1000),
+                'm': self.rng.random() < 0.5}
+
+    async def trades(self, symbols: List[str]) -> AsyncIterator[dict]:
+        self.symbols = list(symbols)
+        batch = max(1, int(self.rate / 100))
+        while True:
+            await asyncio.sleep(batch / self.rate)
+            for _ in range(batch if self.symbols else 0):
+                yield self.trade(self.rng.choice(self.symbols))
+
+    async def update(self, symbols: Iterable[str]):
+        self.symbols = sorted(symbols)
+
+
+trade_flow = TradeFlow()
@@ -1,18 +1,26 @@
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, JSONResponse
+import hmac
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import json
 import asyncio
 import logging
-from db import get_open_positions, get_portfolio_summary, get_signals
-import pandas as pd
+import analytics
+from chart_data import CHART_POINTS, ChartRateLimited, chart_data
+from db import get_open_positions, get_portfolio_summary, get_signal_outcome_stats, get_signals
+from metrics import render_metrics
+import profiling
+from tracing import tracer
 from datetime import datetime
 import os
 
 logger = logging.getLogger(__name__)
 
 web_app = FastAPI(title="Trading Bot Dashboard")
+# Колонки графика и аналитики (метки времени, цены) сжимаются в разы
+web_app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 os.makedirs("static", exist_ok=True)
 os.makedirs("docs", exist_ok=True)
@@ -21,6 +29,22 @@ web_app.mount("/static", StaticFiles(directory="static"), name="static")
 
 docs = Jinja2Templates(directory="docs")
 
+# Токен для /admin/*; без него эндпоинты профилирования отключены
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    """Проверка токена администратора (только заголовок X-Admin-Token: query string попадает в access-лог)"""
+    supplied = x_admin_token or ''
+    if not ADMIN_TOKEN or not hmac.compare_digest(supplied, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="admin token required")
+
+
+@web_app.on_event("startup")
+async def register_web_loop():
+    # uvicorn работает в своем потоке и loop - показываем его задачи в /admin/tasks
+    profiling.register_loop()
+
 
 class ConnectionManager:
     def __init__(self):
@@ -119,13 +143,152 @@ async def api_signals(limit: int = 10):
         return {"error": str(e)}
 
 
+@web_app.get("/api/signal_outcomes")
+async def api_signal_outcomes(days: int = 7):
+    """Реальные исходы сигналов: доля тейков и стопов, MAE/MFE"""
+    try:
+        return get_signal_outcome_stats(days)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@web_app.get("/api/analytics")
+async def api_analytics_queries():
+    """Список аналитических запросов и их параметров"""
+    return {"engine": analytics.engine(),
+            "queries": {name: spec['description'] for name, spec in analytics.QUERIES.items()}}
+
+
+@web_app.get("/api/analytics/{name}")
+async def api_analytics(name: str, days: float = 7, symbol: str = '*'):
+    """Результат аналитического запроса по колонкам: {колонка: [значения]}"""
+    if name not in analytics.QUERIES:
+        raise HTTPException(status_code=404, detail=f"unknown query {name}")
+    try:
+        columns = await asyncio.to_thread(analytics.query, name, days, symbol)
+        return {"query": name, "engine": analytics.engine(), "columns": analytics.to_json(columns)}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@web_app.get("/api/chart/{symbol}")
+async def api_chart(symbol: str, interval: str = '5m', start: int = None, end: int = None,
+                    points: int = CHART_POINTS, method: str = 'lttb', since: int = None):
+    """Свечи для графика: диапазон [start, end) в мс, прореженный до points точек,
+    или с since - новые сырые свечи для дописывания"""
+    try:
+        if since is not None:
+            return await chart_data.since(symbol, interval, since)
+        return await chart_data.range(symbol, interval, start, end, points, method)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ChartRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
+
+
+@web_app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики Prometheus"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@web_app.get("/api/latency")
+async def api_latency(limit: int = 20):
+    """Задержка сигналов по этапам (p50/p95/p99) и последние трассы"""
+    return {"stages": tracer.summary(), "recent": tracer.recent(limit)}
+
+
+@web_app.get("/api/latency/otlp")
+async def api_latency_otlp():
+    """Трассы из буфера в формате OTLP/JSON"""
+    return tracer.export_otlp()
+
+
+@web_app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def admin_profile(seconds: float = 10.0, interval_ms: float = 5.0):
+    """Семплирующий профиль всех потоков за seconds секунд (collapsed stacks для flamegraph)"""
+    try:
+        stacks = await profiling.profile(min(seconds, 300.0), max(interval_ms, 1.0) / 1000)
+        return PlainTextResponse(stacks)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+
+
+@web_app.get("/admin/tasks", dependencies=[Depends(require_admin)])
+async def admin_tasks(limit: int = 20):
+    """Дамп asyncio-задач со стеками"""
+    return profiling.dump_tasks(limit)
+
+
+@web_app.post("/admin/tracemalloc/start", dependencies=[Depends(require_admin)])
+async def admin_tracemalloc_start(frames: int = 25):
+    """Включить tracemalloc и запомнить базовый снимок"""
+    profiling.tracemalloc_start(frames)
+    return {"status": "tracing"}
+
+
+@web_app.post("/admin/tracemalloc/stop", dependencies=[Depends(require_admin)])
+async def admin_tracemalloc_stop():
+    profiling.tracemalloc_stop()
+    return {"status": "stopped"}
+
+
+@web_app.get("/admin/tracemalloc/top", dependencies=[Depends(require_admin)])
+async def admin_tracemalloc_top(limit: int = 20, filter: str = None, key_type: str = 'lineno'):
+    """Крупнейшие места выделения памяти (filter - подстрока пути, например data.py)"""
+    try:
+        return profiling.tracemalloc_top(limit, filter, key_type)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+
+
+@web_app.get("/admin/tracemalloc/diff", dependencies=[Depends(require_admin)])
+async def admin_tracemalloc_diff(limit: int = 20, filter: str = None, key_type: str = 'lineno', reset: bool = False):
+    """Рост памяти с базового снимка (reset=true - сделать текущий снимок новой базой)"""
+    try:
+        return profiling.tracemalloc_diff(limit, filter, key_type, reset)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+
+
+@web_app.post("/admin/slow-callbacks/start", dependencies=[Depends(require_admin)])
+async def admin_slow_callbacks_start(threshold_ms: float = 100.0):
+    """Debug-режим event loop: отчет о колбэках и шагах корутин дольше threshold_ms"""
+    profiling.slow_callbacks_start(threshold_ms / 1000)
+    return {"status": "enabled"}
+
+
+@web_app.post("/admin/slow-callbacks/stop", dependencies=[Depends(require_admin)])
+async def admin_slow_callbacks_stop():
+    profiling.slow_callbacks_stop()
+    return {"status": "disabled"}
+
+
+@web_app.get("/admin/slow-callbacks", dependencies=[Depends(require_admin)])
+async def admin_slow_callbacks():
+    return profiling.slow_callbacks()
+
+
+# (check_signals, loop бота): скан должен выполняться в loop бота - блокировки
+# сканера, очередь уведомлений и клиенты стаканов/хаба принадлежат ему
+_scan_handler = None
+
+
+def register_scan_handler(check_signals, loop: asyncio.AbstractEventLoop = None):
+    global _scan_handler
+    _scan_handler = (check_signals, loop or asyncio.get_running_loop())
+
+
 @web_app.post("/api/scan")
 async def api_scan():
     """API для запуска сканирования"""
+    if _scan_handler is None:
+        return {"status": "error", "error": "bot is not running"}
+    check_signals, loop = _scan_handler
     try:
-        # Импортируем здесь чтобы избежать циклических импортов
-        from bot import check_signals
-        await check_signals()
+        # uvicorn работает в своем потоке - передаем скан в loop бота и ждем результата
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(check_signals(), loop))
         return {"status": "scan_started"}
     except Exception as e:
         return {"status": "error", "error": str(e)}
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from db import close_position, log_trade, open_position
+from exchange import close_position_order, place_market_order
+from metrics import WEBHOOK_ALERTS_TOTAL
+from order_book import MAX_SLIPPAGE_BPS, order_books
+
+logger = logging.getLogger(__name__)
+
+# Общий секрет: поле "secret" в теле алерта TradingView или заголовок X-Webhook-Secret
+WEBHOOK_SECRET = os.getenv('TRADINGVIEW_SECRET')
+# Сколько секунд помнить алерт для отсечения повторов TradingView
+IDEMPOTENCY_TTL = float(os.getenv('WEBHOOK_IDEMPOTENCY_TTL', '300'))
+MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '1000'))
+WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+ACTIONS = ('LONG', 'SHORT', 'CLOSE')
+
+
+class IdempotencyCache:
+    """Ключи обработанных алертов с TTL (потокобезопасно, вызывается из потока uvicorn)"""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_size: int = 100_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key: str, now: float = None) -> bool:
+        """Запомнить ключ; False, если он уже был в пределах TTL"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            # TTL одинаковый, поэтому ключи упорядочены по времени истечения
+            while self._expires and (next(iter(self._expires.values())) <= now
+                                     or len(self._expires) >= self.max_size):
+                self._expires.popitem(last=False)
+            if key in self._expires:
+                return False
+            self._expires[key] = now + self.ttl
+            return True
+
+    def discard(self, key: str):
+        with self._lock:
+            self._expires.pop(key, None)
+
+
+# Поля времени бара/алерта (плейсхолдеры TradingView {{time}}, {{timenow}})
+TIME_FIELDS = ('time', 'timenow', 'timestamp', 'bar_time')
+
+
+def alert_key(payload: dict, raw: bytes) -> Optional[str]:
+    """Ключ идемпотентности: id алерта, иначе хэш тела с временем бара; None - не дедуплицировать.
+
+    Тело без id и без времени у одинаковых легитимных алертов совпадает
+    (тот же сигнал на следующем баре), поэтому такие алерты не отсекаются.
+    """
+    alert_id = payload.get('id') or payload.get('alert_id')
+    if alert_id:
+        return f"id:{alert_id}"
+    # Время входит в тело - повтор доставки того же алерта дает тот же хэш, следующий бар - другой
+    if not any(payload.get(field) for field in TIME_FIELDS):
+        return None
+    return "sha256:" + hashlib.sha256(raw).hexdigest()
+
+
+async def execute_alert(alert: dict) -> str:
+    """Исполнить алерт: ордер на бирже и запись в БД. Возвращает текст уведомления"""
+    symbol, action, amount = alert['symbol'], alert['action'], alert['amount']
+
+    if action == 'CLOSE':
+        res = await close_position_order(symbol)
+        if not res.success:
+            raise RuntimeError(res.info.get('error', 'Unknown error'))
+        close_position(symbol)
+        return f'TradingView webhook executed: CLOSE {symbol}'
+
+    side = 'BUY' if action == 'LONG' else 'SELL'
+    # Цена для записи в позицию, как при ручной торговле
+    from data import fetch_last_price
+    try:
+        price = await fetch_last_price(symbol)
+    except Exception:
+        price = 0.0
+    # Объем режется до того, что стакан примет без сильного проскальзывания
+    requested, amount = amount, order_books.cap_quantity(symbol, side, amount)
+    if amount < requested:
+        # Урезанный объем - произвольное число: биржа примет только кратное stepSize и не меньше minQty
+        from data import fetch_lot_size, floor_to_step
+        step, min_qty = await fetch_lot_size(symbol)
+        amount = floor_to_step(amount, step)
+        if amount < min_qty:
+            amount = 0.0
+    if amount <= 0:
+        raise RuntimeError(f'order book of {symbol} is too thin for a market order')
+    res = await place_market_order(symbol, side, amount)
+    if not res.success:
+        raise RuntimeError(res.info.get('error', 'Unknown error'))
+    log_trade(symbol, side, amount, price)
+    open_position(symbol, side, amount, price)
+    if amount < requested:
+        return (f'TradingView webhook executed: {action} {symbol} {amount:g} '
+                f'(reduced from {requested:g} to limit slippage to {MAX_SLIPPAGE_BPS:g} bps)')
+    return f'TradingView webhook executed: {action} {symbol} {amount}'
+
+
+class WebhookPipeline:
+    """Прием алертов TradingView: проверка, дедупликация и быстрый ответ.
+
+    accept() только валидирует алерт и ставит его в очередь, ордера исполняют
+    воркеры в event loop бота. Алерты одного символа исполняются строго по
+    очереди и в порядке поступления. accept() можно вызывать из другого
+    потока - uvicorn работает в своем.
+    """
+
+    def __init__(self, executor: Callable = execute_alert, notify: Optional[Callable] = None,
+                 secret: str = WEBHOOK_SECRET, ttl: float = IDEMPOTENCY_TTL, max_pending: int = MAX_PENDING,
+                 workers: int = WORKERS):
+        self.executor = executor
+        self.notify = notify
+        self.secret = secret
+        self.max_pending = max_pending
+        self.workers = workers
+        self.seen = IdempotencyCache(ttl)
+        self.executed = 0
+        self.failed = 0
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._symbol_locks = {}
+        if not secret:
+            logger.warning("TRADINGVIEW_SECRET is not set, webhook alerts are not authenticated")
+
+    def start(self):
+        """Запустить воркеры в текущем event loop"""
+        if not self._tasks:
+            self._loop = asyncio.get_running_loop()
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def drain(self):
+        """Дождаться исполнения всех принятых алертов"""
+        # Принятые, но еще не попавшие в очередь (call_soon_threadsafe) тоже ждем
+        while self._pending:
+            await asyncio.sleep(0)
+            await self._queue.join()
+
+    def accept(self, raw: bytes, header_secret: str = None) -> Tuple[int, dict]:
+        """Разобрать тело запроса и поставить алерт в очередь. Возвращает (HTTP-статус, ответ)"""
+        try:
+            payload = json.loads(raw)
+            if not isinstance(payload, dict):
+                raise ValueError('payload must be an object')
+        except ValueError:
+            WEBHOOK_ALERTS_TOTAL.labels('invalid').inc()
+            return 400, {'ok': False, 'error': 'invalid json'}
+
+        if self.secret and not hmac.compare_digest(str(payload.get('secret') or header_secret or ''), self.secret):
+            WEBHOOK_ALERTS_TOTAL.labels('unauthorized').inc()
+            return 401, {'ok': False, 'error': 'unauthorized'}
+
+        action = str(payload.get('action', '')).upper()
+        symbol = str(payload.get('symbol') or '').upper()
+        try:
+            amount = float(payload.get('amount', 0))
+        except (TypeError, ValueError):
+            amount = -1.0
+        if action not in ACTIONS or not symbol or (action != 'CLOSE' and amount <= 0):
+            WEBHOOK_ALERTS_TOTAL.labels('invalid').inc()
+            return 400, {'ok': False, 'error': 'invalid action'}
+
+        if self._loop is None:
+            return 503, {'ok': False, 'error': 'webhook worker is not running'}
+
+        key = alert_key(payload, raw)
+        if key is not None and not self.seen.add(key):
+            WEBHOOK_ALERTS_TOTAL.labels('duplicate').inc()
+            logger.info(f"Webhook duplicate dropped: {action} {symbol} ({key})")
+            return 200, {'ok': True, 'duplicate': True, 'id': key}
+
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                if key is not None:
+                    self.seen.discard(key)
+                WEBHOOK_ALERTS_TOTAL.labels('rejected').inc()
+                return 503, {'ok': False, 'error': 'queue is full'}
+            self._pending += 1
+
+        alert = {'key': key, 'symbol': symbol, 'action': action, 'amount': amount}
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, alert)
+        WEBHOOK_ALERTS_TOTAL.labels('queued').inc()
+        return 200, {'ok': True, 'queued': True, 'id': key}
+
+    async def _worker(self):
+        while True:
+            alert = await self._queue.get()
+            try:
+                # Блокировка символа берется сразу после get - порядок алертов символа сохраняется
+                async with self._symbol_locks.setdefault(alert['symbol'], asyncio.Lock()):
+                    text = await self.executor(alert)
+                self.executed += 1
+                WEBHOOK_ALERTS_TOTAL.labels('executed').inc()
+            except Exception as e:
+                self.failed += 1
+                WEBHOOK_ALERTS_TOTAL.labels('failed').inc()
+                logger.error(f"Webhook {alert['action']} {alert['symbol']} failed: {e}")
+                text = f"TradingView webhook failed: {alert['action']} {alert['symbol']}: {e}"
+            finally:
+                with self._pending_lock:
+                    self._pending -= 1
+                self._queue.task_done()
+            if self.notify and text:
+                self.notify(text)